@@ -1,6 +1,8 @@
 import datetime
 
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -44,6 +46,30 @@ class MaintenanceModeQuerySet(models.QuerySet):
         return self.filter(start__lt=timezone.now(), end__gt=timezone.now())
 
 
+MAINTENANCE_MODE_CACHE_KEY = 'maintenance_mode_active'
+
+
+def is_maintenance_mode_active(context=None):
+    """
+    Return whether maintenance mode is currently active
+
+    If a serializer context is given, the result is stored in it so that
+    it is looked up only once when serializing many objects. The result is
+    also cached for RESPA_MAINTENANCE_MODE_CACHE_TIMEOUT seconds.
+    """
+    if context is not None and 'maintenance_mode_active' in context:
+        return context['maintenance_mode_active']
+    active = cache.get(MAINTENANCE_MODE_CACHE_KEY)
+    if active is None:
+        active = MaintenanceMode.objects.active().exists()
+        timeout = getattr(settings, 'RESPA_MAINTENANCE_MODE_CACHE_TIMEOUT', 10)
+        if timeout:
+            cache.set(MAINTENANCE_MODE_CACHE_KEY, active, timeout)
+    if context is not None:
+        context['maintenance_mode_active'] = active
+    return active
+
+
 class MaintenanceMode(ModifiableModel):
     start = models.DateTimeField(verbose_name=_('Begin time'), null=False, blank=False)
     end = models.DateTimeField(verbose_name=_('End time'), null=False, blank=False)
@@ -0,0 +1,10 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import MAINTENANCE_MODE_CACHE_KEY, MaintenanceMode
+
+
+@receiver([post_save, post_delete], sender=MaintenanceMode)
+def invalidate_maintenance_mode_cache(sender, **kwargs):
+    cache.delete(MAINTENANCE_MODE_CACHE_KEY)
@@ -11,7 +11,7 @@ from django.utils.translation import gettext_lazy as _
 from django.urls import path, reverse
 from django.shortcuts import render
 from django.http import HttpResponseRedirect, HttpResponse
-from .models import NotificationTemplate, NotificationTemplateGroup
+from .models import NotificationOutboxMessage, NotificationTemplate, NotificationTemplateGroup
 from resources.admin.base import PopulateCreatedAndModifiedMixin, CommonExcludeMixin
 
 logger = logging.getLogger(__name__)
@@ -114,5 +114,14 @@ class NotificationTemplateAdmin(TranslatableAdmin):
     update_notification_html_templates.short_description = _('Update notification HTML templates')
 
 
+class NotificationOutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('recipient', 'channel', 'subject', 'state', 'attempts', 'next_attempt_at', 'created_at')
+    list_filter = ('state', 'channel')
+    search_fields = ('recipient', 'subject')
+    readonly_fields = ('attempts', 'last_error', 'created_at', 'sent_at')
+    exclude = ('attachments',)
+
+
 admin_site.register(NotificationTemplateGroup, NotificationGroupAdmin)
+admin_site.register(NotificationOutboxMessage, NotificationOutboxMessageAdmin)
 admin_site.register(NotificationTemplate, NotificationTemplateAdmin)
@@ -0,0 +1,59 @@
+import logging
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from notifications.models import NotificationOutboxMessage
+
+logger = logging.getLogger()
+
+
+class Command(BaseCommand):
+    help = 'Send queued e-mail and SMS notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of notifications sent per batch')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new notifications instead of exiting when the queue is empty')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to wait between polls when looping')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = self.send_batch(options['batch_size'])
+            if sent or failed:
+                logger.info('Sent %d queued notifications, %d failed' % (sent, failed))
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def send_batch(self, batch_size):
+        sent = failed = 0
+        with transaction.atomic():
+            # Locked rows are being sent by another worker.
+            messages = list(
+                NotificationOutboxMessage.objects.due().select_for_update(skip_locked=True)[:batch_size]
+            )
+            if not messages:
+                return sent, failed
+
+            # Share one mail server connection for the whole batch. If it
+            # can't be opened, every message fails and gets retried later.
+            connection = get_connection()
+            try:
+                connection.open()
+            except Exception as exc:
+                logger.error('Opening mail connection failed: %s' % exc)
+            try:
+                for message in messages:
+                    if message.send(connection=connection):
+                        sent += 1
+                    else:
+                        failed += 1
+            finally:
+                connection.close()
+        return sent, failed
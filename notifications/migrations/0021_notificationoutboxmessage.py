@@ -0,0 +1,36 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0020_missing_migrations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(choices=[('email', 'Email'), ('sms', 'SMS')], max_length=10, verbose_name='Channel')),
+                ('recipient', models.CharField(max_length=254, verbose_name='Recipient')),
+                ('subject', models.TextField(blank=True, verbose_name='Subject')),
+                ('body', models.TextField(blank=True, verbose_name='Body')),
+                ('html_body', models.TextField(blank=True, verbose_name='HTML body')),
+                ('attachments', models.JSONField(blank=True, default=list, verbose_name='Attachments')),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='State')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next attempt at')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Sent at')),
+            ],
+            options={
+                'verbose_name': 'Queued notification',
+                'verbose_name_plural': 'Queued notifications',
+                'ordering': ('next_attempt_at', 'id'),
+                'indexes': [models.Index(fields=['state', 'next_attempt_at'], name='notificatio_state_a7a871_idx')],
+            },
+        ),
+    ]
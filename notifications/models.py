@@ -1,9 +1,11 @@
+import base64
 import logging
+from datetime import timedelta
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.utils import translation
+from django.utils import timezone, translation
 from django.utils.html import strip_tags
 from django.utils.translation import gettext_lazy as _
 from django.utils.formats import date_format
@@ -66,6 +68,23 @@ class NotificationTemplateException(Exception):
     pass
 
 
+_template_environment = None
+# Compiled templates by (template id, language, field) with the source they
+# were compiled from.
+_compiled_templates = {}
+
+
+def get_template_environment():
+    global _template_environment
+    if _template_environment is None:
+        env = SandboxedEnvironment(trim_blocks=True, lstrip_blocks=True, undefined=StrictUndefined)
+        env.filters['reservation_time'] = reservation_time
+        env.filters['format_datetime'] = format_datetime
+        env.filters['format_datetime_tz'] = format_datetime_tz
+        _template_environment = env
+    return _template_environment
+
+
 
 class NotificationTemplate(TranslatableModel):
     NOTIFICATION_TYPE_CHOICES = (
@@ -141,6 +160,41 @@ class NotificationTemplate(TranslatableModel):
                     return str(t[1])
         return 'N/A'
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.clear_compiled_templates()
+
+    def delete(self, *args, **kwargs):
+        self.clear_compiled_templates()
+        return super().delete(*args, **kwargs)
+
+    def clear_compiled_templates(self):
+        for key in [key for key in _compiled_templates if key[0] == self.pk]:
+            _compiled_templates.pop(key, None)
+
+    def get_compiled_templates(self, language_code=DEFAULT_LANG):
+        """
+        Return the compiled content field templates of the given language
+
+        Compiled templates are cached for the process. A cached template is
+        used only if it was compiled from the current content of the field.
+        """
+        env = get_template_environment()
+        compiled_templates = {}
+        with switch_language(self, language_code):
+            for attr in ('short_message', 'subject', 'html_body', 'body'):
+                source = getattr(self, attr)
+                if attr == 'body' and not source:
+                    continue
+                key = (self.pk, language_code, attr)
+                cached = _compiled_templates.get(key)
+                if cached is None or cached[0] != source:
+                    cached = (source, env.from_string(source))
+                    if self.pk is not None:
+                        _compiled_templates[key] = cached
+                compiled_templates[attr] = cached[1]
+        return compiled_templates
+
     def render(self, context, language_code=DEFAULT_LANG):
         """
         Render this notification template with given context and language
@@ -150,27 +204,32 @@ class NotificationTemplate(TranslatableModel):
         {'short_message': 'foo', 'subject': 'bar', 'body': 'baz', 'html_body': '<b>foobar</b>'}
 
         """
+        return self.render_many([context], language_code)[0]
 
-        env = SandboxedEnvironment(trim_blocks=True, lstrip_blocks=True, undefined=StrictUndefined)
-        env.filters['reservation_time'] = reservation_time
-        env.filters['format_datetime'] = format_datetime
-        env.filters['format_datetime_tz'] = format_datetime_tz
+    def render_many(self, contexts, language_code=DEFAULT_LANG):
+        """
+        Render this notification template with each of the given contexts
 
+        Returns a list of dicts like `render`, in the order of the contexts.
+        """
         logger.debug('Rendering template for notification %s' % self.type)
-        with switch_language(self, language_code):
-            try:
+        try:
+            templates = self.get_compiled_templates(language_code)
+            rendered_notifications = []
+            for context in contexts:
                 rendered_notification = {
-                    attr: env.from_string(getattr(self, attr)).render(context)
+                    attr: templates[attr].render(context)
                     for attr in ('short_message', 'subject', 'html_body')
                 }
-                if self.body:
-                    rendered_notification['body'] = env.from_string(self.body).render(context)
+                if 'body' in templates:
+                    rendered_notification['body'] = templates['body'].render(context)
                 else:
                     # if text body is empty use html body without tags as text body
                     rendered_notification['body'] = strip_tags(rendered_notification['html_body'])
-                return rendered_notification
-            except TemplateError as e:
-                raise NotificationTemplateException(e) from e
+                rendered_notifications.append(rendered_notification)
+            return rendered_notifications
+        except TemplateError as e:
+            raise NotificationTemplateException(e) from e
 
     def clean(self, **kwargs):
         super().clean()
@@ -189,10 +248,7 @@ class NotificationTemplate(TranslatableModel):
 
     def validate_templates(self):
         context = {}
-        env = SandboxedEnvironment(trim_blocks=True, lstrip_blocks=True, undefined=StrictUndefined)
-        env.filters['reservation_time'] = reservation_time
-        env.filters['format_datetime'] = format_datetime
-        env.filters['format_datetime_tz'] = format_datetime_tz
+        env = get_template_environment()
         templates = ['short_message', 'body', 'html_body']
         for template in templates:
             try:
@@ -253,3 +309,121 @@ class NotificationTemplateGroup(ModifiableModel):
     def __str__(self):
         return self.name
 
+
+class NotificationOutboxMessageQuerySet(models.QuerySet):
+    def due(self, now=None):
+        if now is None:
+            now = timezone.now()
+        return self.filter(state=NotificationOutboxMessage.STATE_PENDING, next_attempt_at__lte=now)
+
+    def enqueue_mail(self, email_address, subject, body, html_body=None, attachments=None):
+        """
+        Queue a mail to be sent by the send_queued_notifications command
+
+        The message is created in the current transaction, so it is sent only
+        if the transaction is committed.
+        """
+        return self.create(
+            channel=NotificationOutboxMessage.CHANNEL_EMAIL, recipient=email_address,
+            subject=subject, body=body, html_body=html_body or '',
+            attachments=[
+                [filename, base64.b64encode(content.encode() if isinstance(content, str) else content).decode(),
+                 mimetype]
+                for filename, content, mimetype in attachments or []
+            ],
+        )
+
+    def enqueue_sms(self, phone_number, subject, short_message):
+        """
+        Queue a SMS to be sent by the send_queued_notifications command
+        """
+        return self.create(
+            channel=NotificationOutboxMessage.CHANNEL_SMS, recipient=phone_number,
+            subject=subject, body=short_message,
+        )
+
+
+class NotificationOutboxMessage(models.Model):
+    CHANNEL_EMAIL = 'email'
+    CHANNEL_SMS = 'sms'
+    CHANNEL_CHOICES = (
+        (CHANNEL_EMAIL, _('Email')),
+        (CHANNEL_SMS, _('SMS')),
+    )
+
+    STATE_PENDING = 'pending'
+    STATE_SENT = 'sent'
+    STATE_FAILED = 'failed'
+    STATE_CHOICES = (
+        (STATE_PENDING, _('Pending')),
+        (STATE_SENT, _('Sent')),
+        (STATE_FAILED, _('Failed')),
+    )
+
+    MAX_ATTEMPTS = 6
+    RETRY_BASE_DELAY = timedelta(minutes=1)
+    RETRY_MAX_DELAY = timedelta(hours=1)
+
+    channel = models.CharField(verbose_name=_('Channel'), max_length=10, choices=CHANNEL_CHOICES)
+    recipient = models.CharField(verbose_name=_('Recipient'), max_length=254)
+    subject = models.TextField(verbose_name=_('Subject'), blank=True)
+    body = models.TextField(verbose_name=_('Body'), blank=True)
+    html_body = models.TextField(verbose_name=_('HTML body'), blank=True)
+    attachments = models.JSONField(verbose_name=_('Attachments'), default=list, blank=True)
+
+    state = models.CharField(verbose_name=_('State'), max_length=10, choices=STATE_CHOICES,
+                             default=STATE_PENDING)
+    attempts = models.PositiveSmallIntegerField(verbose_name=_('Attempts'), default=0)
+    next_attempt_at = models.DateTimeField(verbose_name=_('Next attempt at'), default=timezone.now)
+    last_error = models.TextField(verbose_name=_('Last error'), blank=True)
+    created_at = models.DateTimeField(verbose_name=_('Created at'), auto_now_add=True)
+    sent_at = models.DateTimeField(verbose_name=_('Sent at'), null=True, blank=True)
+
+    objects = NotificationOutboxMessageQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = _('Queued notification')
+        verbose_name_plural = _('Queued notifications')
+        ordering = ('next_attempt_at', 'id')
+        indexes = [
+            models.Index(fields=['state', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return '%s: %s (%s)' % (self.get_channel_display(), self.recipient, self.get_state_display())
+
+    def get_attachments(self):
+        return [
+            (filename, base64.b64decode(content), mimetype)
+            for filename, content, mimetype in self.attachments
+        ]
+
+    def send(self, connection=None):
+        """
+        Send the message and record the outcome
+
+        Failed messages are retried with an exponential backoff until
+        MAX_ATTEMPTS is reached.
+        """
+        from resources.models.utils import deliver_respa_mail, deliver_respa_sms
+
+        self.attempts += 1
+        try:
+            if self.channel == self.CHANNEL_SMS:
+                deliver_respa_sms(self.recipient, self.subject, self.body, connection=connection)
+            else:
+                deliver_respa_mail(self.recipient, self.subject, self.body, self.html_body,
+                                   self.get_attachments(), connection=connection)
+        except Exception as exc:
+            logger.error('Sending queued notification %s failed: %s', self.pk, exc)
+            self.last_error = str(exc)
+            if self.attempts >= self.MAX_ATTEMPTS:
+                self.state = self.STATE_FAILED
+            else:
+                delay = min(self.RETRY_BASE_DELAY * 2 ** (self.attempts - 1), self.RETRY_MAX_DELAY)
+                self.next_attempt_at = timezone.now() + delay
+        else:
+            self.state = self.STATE_SENT
+            self.sent_at = timezone.now()
+        self.save(update_fields=['attempts', 'state', 'next_attempt_at', 'last_error', 'sent_at'])
+        return self.state == self.STATE_SENT
@@ -0,0 +1,71 @@
+import datetime
+from unittest import mock
+
+import pytest
+from django.core import mail
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from notifications.models import NotificationOutboxMessage
+from resources.models.utils import send_respa_mail, send_respa_sms
+
+
+@pytest.fixture
+def outbox_enabled(settings):
+    settings.RESPA_NOTIFICATION_OUTBOX_ENABLED = True
+    settings.GSM_NOTIFICATION_ADDRESS = 'sms.example.com'
+
+
+@pytest.mark.django_db
+def test_notifications_are_queued_and_sent_by_command(outbox_enabled):
+    send_respa_mail('test@example.com', 'Subject', 'Body', '<b>Body</b>',
+                    [('reservation.ics', b'BEGIN:VCALENDAR', 'text/calendar')])
+    send_respa_sms('0401234567', 'SMS subject', 'Short message')
+    assert len(mail.outbox) == 0
+    assert NotificationOutboxMessage.objects.filter(state=NotificationOutboxMessage.STATE_PENDING).count() == 2
+
+    call_command('send_queued_notifications')
+
+    assert len(mail.outbox) == 2
+    email = next(m for m in mail.outbox if m.to == ['test@example.com'])
+    assert email.subject == 'Subject'
+    assert email.alternatives[0][0] == '<b>Body</b>'
+    assert email.attachments[0][0] == 'reservation.ics'
+    sms = next(m for m in mail.outbox if m.to == ['0401234567@sms.example.com'])
+    assert sms.body == 'Short message'
+    assert not NotificationOutboxMessage.objects.exclude(state=NotificationOutboxMessage.STATE_SENT).exists()
+
+
+@pytest.mark.django_db
+def test_failed_notifications_are_retried_with_backoff(outbox_enabled):
+    send_respa_mail('test@example.com', 'Subject', 'Body')
+    message = NotificationOutboxMessage.objects.get()
+
+    with mock.patch('resources.models.utils.EmailMultiAlternatives.send', side_effect=OSError('timeout')):
+        call_command('send_queued_notifications')
+    message.refresh_from_db()
+    assert message.state == NotificationOutboxMessage.STATE_PENDING
+    assert message.attempts == 1
+    assert message.last_error == 'timeout'
+    assert message.next_attempt_at > timezone.now()
+
+    # Not due yet
+    call_command('send_queued_notifications')
+    assert len(mail.outbox) == 0
+
+    NotificationOutboxMessage.objects.update(
+        next_attempt_at=timezone.now() - datetime.timedelta(seconds=1),
+        attempts=NotificationOutboxMessage.MAX_ATTEMPTS - 1)
+    with mock.patch('resources.models.utils.EmailMultiAlternatives.send', side_effect=OSError('timeout')):
+        call_command('send_queued_notifications')
+    message.refresh_from_db()
+    assert message.state == NotificationOutboxMessage.STATE_FAILED
+
+
+@pytest.mark.django_db(transaction=True)
+def test_failed_enqueue_does_not_break_the_transaction(outbox_enabled):
+    with transaction.atomic():
+        assert send_respa_mail('x' * 300 + '@example.com', 'Subject', 'Body') is None
+        send_respa_sms('0401234567', 'SMS subject', 'Short message')
+    assert NotificationOutboxMessage.objects.count() == 1
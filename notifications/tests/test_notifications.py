@@ -96,3 +96,34 @@ def test_notification_template_rendering_empty_html_body(notification_template):
     assert rendered['subject'] == "testiotsikko, muuttujan arvo: bar!"
     assert rendered['body'] == "testiruumis, muuttujan arvo: baz!"
     assert rendered['html_body'] == ""
+
+
+@pytest.mark.django_db
+def test_notification_template_render_many(notification_template):
+    contexts = [
+        {'short_message_var': i, 'subject_var': i, 'body_var': i, 'html_body_var': i}
+        for i in range(3)
+    ]
+
+    rendered = notification_template.render_many(contexts, 'en')
+    assert [r['subject'] for r in rendered] == [
+        "test subject, variable value: 0!",
+        "test subject, variable value: 1!",
+        "test subject, variable value: 2!",
+    ]
+    assert rendered[1] == notification_template.render(contexts[1], 'en')
+
+
+@pytest.mark.django_db
+def test_notification_template_compiled_cache_follows_changes(notification_template):
+    context = {'short_message_var': 'foo', 'subject_var': 'bar', 'body_var': 'baz', 'html_body_var': 'foo'}
+    compiled = notification_template.get_compiled_templates('en')
+    assert notification_template.get_compiled_templates('en')['subject'] is compiled['subject']
+
+    with switch_language(notification_template, 'en'):
+        notification_template.subject = "changed subject: {{ subject_var }}"
+        notification_template.save()
+
+    template = NotificationTemplate.objects.get(pk=notification_template.pk)
+    assert template.render(context, 'en')['subject'] == "changed subject: bar"
+    assert template.render(context, 'fi')['subject'] == "testiotsikko, muuttujan arvo: bar!"
@@ -44,6 +44,9 @@ TAX_PERCENTAGES = [Decimal(x) for x in (
 
 DEFAULT_TAX_PERCENTAGE = Decimal('24.00')
 
+# Per period prices are calculated in chunks of this length
+PRICE_CHECK_INTERVAL = timedelta(minutes=5)
+
 class CustomerGroupTimeSlotPrice(AutoIdentifiedModel):
     price = models.DecimalField(
         verbose_name=_('price including VAT'), max_digits=10, decimal_places=2,
@@ -456,37 +459,20 @@ class Product(models.Model):
             return price
         elif self.price_type == Product.PRICE_PER_PERIOD:
             if time_slot_prices:
-                slot_begin = local_tz_begin
-                check_interval = timedelta(minutes=5)
+                # calculate price for each time slot and use their sum as final price
+                interval_share = Decimal(PRICE_CHECK_INTERVAL / self.price_period)
                 price_sum = 0
-                # calculate price for each time chunk and use their sum as final price
-                while slot_begin + check_interval <= local_tz_end:
-                    price_was_added = False
-                    for time_slot_price in time_slot_prices:
-                        if is_datetime_range_between_times(begin_x=slot_begin, end_x=slot_begin + check_interval,
-                            begin_y=time_slot_price.begin, end_y=time_slot_price.end):
-                                cg_time_slot_price = CustomerGroupTimeSlotPrice.objects.filter(
-                                    time_slot_price=time_slot_price, customer_group_id=self._in_memory_cg).first()
-                                slot_price = time_slot_price.price
-                                if cg_time_slot_price:
-                                    slot_price = cg_time_slot_price.price
-                                elif (ProductCustomerGroup.objects.filter(
-                                    product=self, customer_group_id=self._in_memory_cg).exists()
-                                    or hasattr(self, '_orderline_has_stored_pcg_price_for_non_null_cg')):
-                                    # customer group data exists for product but not for time slot ->
-                                    # use default pricing
-                                    break
-
-                                interval_price = slot_price * Decimal(check_interval / self.price_period)
-                                price_sum += interval_price
-                                price_was_added = True
-                                break
-
-                    if not price_was_added:
-                        # time chunk was not in any priced slot -> use default pricing
-                        interval_price = price * Decimal(check_interval / self.price_period)
-                        price_sum += interval_price
-                    slot_begin += check_interval
+                chunk_counts, cg_time_slot_prices = self._get_time_slot_chunk_counts(
+                    time_slot_prices, local_tz_begin, local_tz_end)
+                for time_slot_price, count in chunk_counts.items():
+                    if time_slot_price is None:
+                        # time chunks not in any priced slot -> use default pricing
+                        slot_price = price
+                    elif time_slot_price.id in cg_time_slot_prices:
+                        slot_price = cg_time_slot_prices[time_slot_price.id].price
+                    else:
+                        slot_price = time_slot_price.price
+                    price_sum += count * (slot_price * interval_share)
                 return Decimal(price_sum)
 
             assert self.price_period, '{} {}'.format(self, self.price_period)
@@ -539,88 +525,59 @@ class Product(models.Model):
             # per period product
             if time_slot_prices:
                 # per period product with added time slot pricing
-                slot_begin = local_tz_begin
-                check_interval = timedelta(minutes=5)
-
-                # calculate price for each time chunk
-                while slot_begin + check_interval <= local_tz_end:
-                    price_was_added = False
-                    for time_slot_price in time_slot_prices:
-                        if is_datetime_range_between_times(begin_x=slot_begin, end_x=slot_begin + check_interval,
-                            begin_y=time_slot_price.begin, end_y=time_slot_price.end):
-                                cg_time_slot_price = CustomerGroupTimeSlotPrice.objects.filter(
-                                    time_slot_price=time_slot_price, customer_group_id=self._in_memory_cg).first()
-                                slot_price = time_slot_price.price
-                                tax_free_price = time_slot_price.price_tax_free
-                                if cg_time_slot_price:
-                                    # cg time slot pricing exists -> use its prices.
-                                    slot_price = cg_time_slot_price.price
-                                    tax_free_price = cg_time_slot_price.price_tax_free
-                                elif (ProductCustomerGroup.objects.filter(
-                                    product=self, customer_group_id=self._in_memory_cg).exists()
-                                    or hasattr(self, '_orderline_has_stored_pcg_price_for_non_null_cg')):
-                                    # customer group data exists for product but not for time slot ->
-                                    # use default pricing
-                                    break
-
-                                if time_slot_price.id in detailed_pricing:
-                                    detailed_pricing[time_slot_price.id]['count'] += 1
-                                if time_slot_price.id not in detailed_pricing:
-                                    detailed_pricing[time_slot_price.id] = get_price_dict(
-                                        count=1,
-                                        price=slot_price,
-                                        pretax=self.get_pretax_price_context(slot_price,rounded=False),
-                                        begin=time_slot_price.begin.isoformat('minutes'),
-                                        end=time_slot_price.end.isoformat('minutes'),
-                                        taxfree_price=tax_free_price
-                                    )
-                                    if quantity > 1:
-                                        # quantity is > 1 if there are multiples of the same product
-                                        detailed_pricing[time_slot_price.id]['quantity'] = quantity
-
-                                price_was_added = True
-                                break
-
-                    if not price_was_added:
-                        # time chunk was not in any priced slot -> use default pricing
-                        # default already exists? +1 to count
-                        if 'default' in detailed_pricing:
-                            detailed_pricing['default']['count'] += 1
-                        if 'default' not in detailed_pricing:
-                            # first occurrence of default? -> add default to inner_price
-                            detailed_pricing['default'] = get_price_dict(
-                                count=1,
-                                price=price,
-                                pretax=self.get_pretax_price_context(price, rounded=False),
-                                taxfree_price=price_tax_free
-                            )
-                            if quantity > 1:
-                                # quantity is only defined/>1 if there are multiples of the same product
-                                detailed_pricing['default']['quantity'] = quantity
-
-                    slot_begin += check_interval
+                chunk_counts, cg_time_slot_prices = self._get_time_slot_chunk_counts(
+                    time_slot_prices, local_tz_begin, local_tz_end)
+                for time_slot_price, count in chunk_counts.items():
+                    if time_slot_price is None:
+                        # time chunks not in any priced slot -> use default pricing
+                        detailed_pricing['default'] = get_price_dict(
+                            count=count,
+                            price=price,
+                            pretax=self.get_pretax_price_context(price, rounded=False),
+                            taxfree_price=price_tax_free
+                        )
+                        if quantity > 1:
+                            # quantity is only defined/>1 if there are multiples of the same product
+                            detailed_pricing['default']['quantity'] = quantity
+                        continue
+
+                    slot_price = time_slot_price.price
+                    tax_free_price = time_slot_price.price_tax_free
+                    cg_time_slot_price = cg_time_slot_prices.get(time_slot_price.id)
+                    if cg_time_slot_price:
+                        # cg time slot pricing exists -> use its prices.
+                        slot_price = cg_time_slot_price.price
+                        tax_free_price = cg_time_slot_price.price_tax_free
+
+                    detailed_pricing[time_slot_price.id] = get_price_dict(
+                        count=count,
+                        price=slot_price,
+                        pretax=self.get_pretax_price_context(slot_price, rounded=False),
+                        begin=time_slot_price.begin.isoformat('minutes'),
+                        end=time_slot_price.end.isoformat('minutes'),
+                        taxfree_price=tax_free_price
+                    )
+                    if quantity > 1:
+                        # quantity is > 1 if there are multiples of the same product
+                        detailed_pricing[time_slot_price.id]['quantity'] = quantity
+
                 # finalize the detailed_pricing so that it contains totals.
                 detailed_pricing = finalize_price_data(detailed_pricing, self.price_type, self.price_period)
                 # return detailed pricing for this per period product that contains time slot specific pricing.
                 return detailed_pricing
 
             # per period product with no time slot prices -> use default.
-            slot_begin = local_tz_begin
-            check_interval = timedelta(minutes=5)
-            while slot_begin + check_interval <= local_tz_end:
-                if 'default' in detailed_pricing:
-                    detailed_pricing['default']['count'] += 1
-                else:
-                    detailed_pricing['default'] = get_price_dict(
-                        count=1,
-                        price=price,
-                        pretax=self.get_pretax_price_context(price, rounded=False),
-                        taxfree_price=self.price_tax_free
-                    )
-                    if quantity > 1:
-                        # quantity is only defined/>1 if there are multiples of the same product
-                        detailed_pricing['default']['quantity'] = quantity
-                slot_begin += check_interval
+            chunk_count = (local_tz_end - local_tz_begin) // PRICE_CHECK_INTERVAL
+            if chunk_count:
+                detailed_pricing['default'] = get_price_dict(
+                    count=chunk_count,
+                    price=price,
+                    pretax=self.get_pretax_price_context(price, rounded=False),
+                    taxfree_price=self.price_tax_free
+                )
+                if quantity > 1:
+                    # quantity is only defined/>1 if there are multiples of the same product
+                    detailed_pricing['default']['quantity'] = quantity
 
             detailed_pricing = finalize_price_data(detailed_pricing, self.price_type, self.price_period)
             # return detailed_pricing for this per period product that has no time slot specific pricing.
@@ -628,6 +585,52 @@ class Product(models.Model):
         else:
             raise NotImplementedError('Cannot calculate detailed pricing, unknown price type "{}".'.format(self.price_type))
 
+    def _get_time_slot_chunk_counts(self, time_slot_prices, begin: datetime, end: datetime):
+        '''
+        Returns the number of 5 minute time chunks of the time range priced by
+        each time slot, and the customer group prices of the time slots.
+
+        Chunks which are not priced by any time slot are counted under None. The
+        counts are ordered by the first chunk priced by each slot. A chunk is
+        priced by the first slot containing it, unless the product has customer
+        group pricing but the slot does not, in which case the default price is used.
+        '''
+        time_slot_prices = list(time_slot_prices)
+        cg_time_slot_prices = {
+            cg_time_slot_price.time_slot_price_id: cg_time_slot_price
+            for cg_time_slot_price in CustomerGroupTimeSlotPrice.objects.filter(
+                time_slot_price__in=time_slot_prices, customer_group_id=self._in_memory_cg)
+        }
+        cg_data_exists_for_product = None
+
+        def get_chunk_time_slot_price(chunk_begin):
+            nonlocal cg_data_exists_for_product
+            for time_slot_price in time_slot_prices:
+                if not is_datetime_range_between_times(begin_x=chunk_begin, end_x=chunk_begin + PRICE_CHECK_INTERVAL,
+                        begin_y=time_slot_price.begin, end_y=time_slot_price.end):
+                    continue
+                if time_slot_price.id in cg_time_slot_prices:
+                    return time_slot_price
+                if cg_data_exists_for_product is None:
+                    cg_data_exists_for_product = (ProductCustomerGroup.objects.filter(
+                        product=self, customer_group_id=self._in_memory_cg).exists()
+                        or hasattr(self, '_orderline_has_stored_pcg_price_for_non_null_cg'))
+                # customer group data exists for product but not for time slot ->
+                # use default pricing
+                return None if cg_data_exists_for_product else time_slot_price
+            return None
+
+        # Chunks a day apart begin at the same time of day, so only the chunks
+        # of the first day need to be matched against the time slots.
+        chunk_count = (end - begin) // PRICE_CHECK_INTERVAL
+        chunks_per_day = timedelta(days=1) // PRICE_CHECK_INTERVAL
+        chunk_counts = {}
+        for chunk in range(min(chunk_count, chunks_per_day)):
+            time_slot_price = get_chunk_time_slot_price(begin + chunk * PRICE_CHECK_INTERVAL)
+            occurrences = (chunk_count - chunk - 1) // chunks_per_day + 1
+            chunk_counts[time_slot_price] = chunk_counts.get(time_slot_price, 0) + occurrences
+        return chunk_counts, cg_time_slot_prices
+
     def get_pretax_price_for_reservation(self, reservation: Reservation, rounded: bool = True) -> Decimal:
         return self.get_pretax_price_for_time_range(reservation.begin, reservation.end, rounded=rounded)
 
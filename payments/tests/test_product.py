@@ -6,7 +6,11 @@ from pytz import UTC
 
 from resources.tests.conftest import resource_in_unit  # noqa
 
-from ..models import ARCHIVED_AT_NONE, CustomerGroup, Product, ProductCustomerGroup
+from ..factories import TimeSlotPriceFactory
+from ..models import (
+    ARCHIVED_AT_NONE, CustomerGroup, CustomerGroupTimeSlotPrice, Product, ProductCustomerGroup, TimeSlotPrice
+)
+from ..utils import is_datetime_range_between_times, round_price
 
 @pytest.fixture(autouse=True)
 def auto_use_django_db(db):
@@ -159,3 +163,72 @@ def test_get_detailed_price_for_time_range_per_period_no_timeslots_quantity(prod
     result = product_with_no_price_product_cg.get_detailed_price_for_time_range(begin, end, quantity=2)
     assert 'quantity' in result['default']
     assert result['default']['quantity'] == 2
+
+
+def _get_reference_price_for_time_range(product, begin, end, price):
+    """The original 5 minute chunk by chunk per period pricing"""
+    time_slot_prices = TimeSlotPrice.objects.filter(product=product)
+    tz = product.resources.first().unit.get_tz()
+    slot_begin = begin.astimezone(tz)
+    local_tz_end = end.astimezone(tz)
+    check_interval = datetime.timedelta(minutes=5)
+    price_sum = 0
+    counts = {}
+    while slot_begin + check_interval <= local_tz_end:
+        key = 'default'
+        slot_price = price
+        for time_slot_price in time_slot_prices:
+            if is_datetime_range_between_times(begin_x=slot_begin, end_x=slot_begin + check_interval,
+                                               begin_y=time_slot_price.begin, end_y=time_slot_price.end):
+                cg_time_slot_price = CustomerGroupTimeSlotPrice.objects.filter(
+                    time_slot_price=time_slot_price, customer_group_id=product._in_memory_cg).first()
+                if cg_time_slot_price:
+                    key, slot_price = time_slot_price.id, cg_time_slot_price.price
+                elif not ProductCustomerGroup.objects.filter(
+                        product=product, customer_group_id=product._in_memory_cg).exists():
+                    key, slot_price = time_slot_price.id, time_slot_price.price
+                break
+        price_sum += slot_price * Decimal(check_interval / product.price_period)
+        counts[key] = counts.get(key, 0) + 1
+        slot_begin += check_interval
+    return Decimal(price_sum), counts
+
+
+@pytest.mark.parametrize('begin, end', (
+    (datetime.datetime(2119, 5, 5, 6, 0), datetime.datetime(2119, 5, 5, 10, 0)),
+    (datetime.datetime(2119, 5, 5, 6, 3), datetime.datetime(2119, 5, 5, 15, 59)),
+    (datetime.datetime(2119, 5, 5, 9, 0), datetime.datetime(2119, 5, 5, 9, 4)),
+    (datetime.datetime(2119, 5, 5, 18, 30), datetime.datetime(2119, 5, 8, 11, 17)),
+    (datetime.datetime(2119, 3, 29, 12, 1), datetime.datetime(2119, 4, 4, 9, 0)),
+))
+@pytest.mark.parametrize('customer_group', (None, 'cg-adults-1', 'cg-children-1', 'cg-elders-1'))
+def test_get_price_for_time_range_matches_chunked_pricing(
+        product_with_pcgs_and_time_slot_prices, begin, end, customer_group):
+    """Test per period time slot pricing against pricing the range 5 minutes at a time"""
+    product = product_with_pcgs_and_time_slot_prices
+    product.price_period = datetime.timedelta(minutes=45)
+    product.save()
+    TimeSlotPriceFactory.create(
+        begin=datetime.time(14, 0), end=datetime.time(23, 59),
+        price=Decimal('3.33'), product=product
+    )
+    if customer_group:
+        product._in_memory_cg = customer_group
+        product_cg = ProductCustomerGroup.objects.filter(
+            product=product, customer_group_id=product._in_memory_cg).first()
+    else:
+        product._in_memory_cg = None
+        product_cg = None
+    begin, end = UTC.localize(begin), UTC.localize(end)
+    price = product.price if not product_cg else product_cg.price
+
+    expected_price, expected_counts = _get_reference_price_for_time_range(product, begin, end, price)
+    assert product.get_price_for_time_range(begin, end, product_cg=product_cg) == round_price(expected_price)
+    assert product.get_price_for_time_range(
+        begin, end, product_cg=product_cg, rounded=False).quantize(Decimal('0.000001')) == \
+        expected_price.quantize(Decimal('0.000001'))
+
+    detailed = product.get_detailed_price_for_time_range(begin, end, product_cg=product_cg)
+    assert list(detailed) == list(expected_counts)
+    for key, count in expected_counts.items():
+        assert detailed[key]['count'] == pytest.approx(count / 9)
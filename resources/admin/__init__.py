@@ -386,8 +386,8 @@ class ResourceEquipmentAdmin(PopulateCreatedAndModifiedMixin, CommonExcludeMixin
 
 class ReservationReminderInline(admin.StackedInline):
     model = ReservationReminder
-    fields = ('reminder_date', )
-    readonly_fields = ('reminder_date', )
+    fields = ('reminder_date', 'sent_at')
+    readonly_fields = ('reminder_date', 'sent_at')
     show_change_link = True
     extra = 0
 
@@ -13,6 +13,7 @@ from django.db.models import Q
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.utils.translation import gettext_lazy as _
 from django.contrib.gis.geos import Point
+from resources.auth import PermissionSnapshot
 from resources.models.availability import Period, Day
 from resources.models.resource import Resource
 from resources.models.unit import Unit
@@ -35,6 +36,16 @@ def register_view(klass, name, base_name=None):
 
 LANGUAGES = [x[0] for x in settings.LANGUAGES]
 
+def get_permission_snapshot(request):
+    """
+    Return the permission snapshot of the request user, shared by the whole request
+    """
+    snapshot = getattr(request, '_permission_snapshot', None)
+    if snapshot is None or not snapshot.is_for(request.user):
+        snapshot = request._permission_snapshot = PermissionSnapshot(request.user)
+    return snapshot
+
+
 def get_translated_field_help_text(field_name, value_type = 'string'):
     return f'example: "{field_name}": {{"fi": "{value_type}", "en": "{value_type}", "sv": "{value_type}"}}'
 
@@ -0,0 +1,175 @@
+"""
+Response cache for read-only API endpoints
+
+The data of list and detail responses to anonymous users is cached by
+URL, language and format. Each cached response is tied to the versions
+of the models it was built from, and saving or deleting any of those
+models bumps the version, so that the old responses are no longer used.
+
+The versions have to be seen by every process serving the API, so the
+responses are cached only when a shared cache is configured in the
+RESPA_API_CACHE setting.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils import timezone, translation
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+from resources.models import ResourcePublishDate
+
+VERSION_KEY_PREFIX = 'api_cache_version:'
+RESPONSE_KEY_PREFIX = 'api_response:'
+
+_cached_models = set()
+
+
+def is_response_cache_enabled():
+    return bool(getattr(settings, 'RESPA_API_CACHE', None))
+
+
+def get_response_cache():
+    return caches[getattr(settings, 'RESPA_API_CACHE', None) or 'default']
+
+
+def _get_version_key(model):
+    return VERSION_KEY_PREFIX + model._meta.label_lower
+
+
+def get_model_versions(models):
+    """
+    Return the current cache versions of the given models
+    """
+    cache = get_response_cache()
+    keys = [_get_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # A version which has been evicted gets a new unique value, so that
+            # responses cached with any earlier value don't come back in use
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def invalidate_model(model):
+    if not is_response_cache_enabled():
+        return
+    get_response_cache().set(_get_version_key(model), uuid.uuid4().hex, None)
+
+
+def _invalidate(model):
+    invalidate_model(model)
+    # Until the transaction is committed, other requests could still cache the
+    # old data with the new version, so the version is changed again after it
+    transaction.on_commit(lambda: invalidate_model(model))
+
+
+def _invalidate_sender(sender, **kwargs):
+    _invalidate(sender)
+
+
+def _invalidate_m2m(sender, instance, action, model, **kwargs):
+    if not action.startswith('post_'):
+        return
+    for changed in {type(instance), model}:
+        if changed in _cached_models:
+            _invalidate(changed)
+
+
+def get_publish_state():
+    """
+    Return a digest of the publish dates whose resources are public right now
+
+    The public state of a resource with a publish date changes when the date
+    is passed, without the resource being saved.
+    """
+    public = ResourcePublishDate.objects.public_at(timezone.now()).order_by('pk').values_list('pk', flat=True)
+    return hashlib.md5(','.join(str(pk) for pk in public).encode()).hexdigest()
+
+
+def register_cached_models(models):
+    """
+    Invalidate the cached responses of the given models when they are changed
+    """
+    for model in models:
+        if model in _cached_models:
+            continue
+        _cached_models.add(model)
+        uid = 'api_cache_invalidate:' + model._meta.label_lower
+        post_save.connect(_invalidate_sender, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(_invalidate_sender, sender=model, weak=False, dispatch_uid=uid)
+        for field in model._meta.many_to_many:
+            m2m_changed.connect(_invalidate_m2m, sender=field.remote_field.through, weak=False,
+                                dispatch_uid=uid + ':' + field.name)
+
+
+class CachedResponseMixin:
+    """
+    Cache the responses of the list and retrieve actions of a viewset
+
+    `cache_models` lists the models the responses are built from. Only
+    responses to anonymous users are cached, since what the other users
+    see depends on their permissions. The responses are also given an
+    ETag, so unchanged responses can be answered with 304 Not Modified.
+
+    Data which changes with time instead of saves, like today's opening
+    hours, must be covered by `get_response_cache_variant`.
+    """
+    cache_models = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        register_cached_models(cls.cache_models)
+
+    def get_response_cache_key(self, request):
+        """
+        Return the cache key of the response, or None if it should not be cached
+        """
+        if not is_response_cache_enabled() or request.method != 'GET' or request.user.is_authenticated:
+            return None
+        parts = [
+            request.get_full_path(), translation.get_language() or '', request.accepted_renderer.format,
+        ] + get_model_versions(self.cache_models) + self.get_response_cache_variant(request)
+        return RESPONSE_KEY_PREFIX + hashlib.md5('\n'.join(parts).encode()).hexdigest()
+
+    def get_response_cache_variant(self, request):
+        """
+        Return the cache key parts of the time dependent data of the response
+        """
+        return [timezone.localdate().isoformat()]
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        self.response_cache_key = self.get_response_cache_key(request)
+        self.response_cache_hit = False
+        if self.response_cache_key is not None:
+            data = get_response_cache().get(self.response_cache_key)
+            if data is not None:
+                self.response_cache_hit = True
+                return Response(data)
+        return handler(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if (getattr(self, 'response_cache_key', None) is None or response.status_code != 200 or
+                not isinstance(response, Response)):
+            return response
+
+        if not self.response_cache_hit:
+            timeout = getattr(settings, 'RESPA_API_CACHE_TIMEOUT', 300)
+            get_response_cache().set(self.response_cache_key, response.data, timeout)
+        response.render()
+        response['ETag'] = quote_etag(hashlib.md5(response.content).hexdigest())
+        return get_conditional_response(request, etag=response['ETag'], response=response)
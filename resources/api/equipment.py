@@ -3,6 +3,7 @@ from rest_framework.permissions import DjangoModelPermissionsOrAnonReadOnly
 import django_filters
 from rest_framework.relations import PrimaryKeyRelatedField
 from .base import TranslatedModelSerializer, register_view
+from .cache import CachedResponseMixin
 from resources.models import Equipment, EquipmentAlias, EquipmentCategory
 
 
@@ -29,7 +30,8 @@ class PlainEquipmentCategorySerializer(TranslatedModelSerializer):
         fields = ('name', 'id')
 
 
-class EquipmentCategoryViewSet(viewsets.ModelViewSet):
+class EquipmentCategoryViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_models = (EquipmentCategory, Equipment)
     queryset = EquipmentCategory.objects.all()
     serializer_class = EquipmentCategorySerializer
     permission_classes = (DjangoModelPermissionsOrAnonReadOnly, )
@@ -104,7 +106,8 @@ class EquipmentFilterSet(django_filters.FilterSet):
         fields = ('resource_group',)
 
 
-class EquipmentViewSet(viewsets.ModelViewSet):
+class EquipmentViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_models = (Equipment, EquipmentAlias, EquipmentCategory)
     queryset = Equipment.objects.all()
     serializer_class = EquipmentSerializer
     filter_backends = (django_filters.rest_framework.DjangoFilterBackend,)
@@ -1,16 +1,18 @@
+import tempfile
 import uuid
+from contextlib import contextmanager
 import arrow
 import django_filters
 from arrow.parser import ParserError
 from django.conf import settings
-from guardian.core import ObjectPermissionChecker
 from django.contrib.auth import get_user_model
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import (
     PermissionDenied, ValidationError as DjangoValidationError
 )
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
@@ -18,6 +20,7 @@ from django.contrib.auth.models import AnonymousUser
 from notifications.models import NotificationType
 from rest_framework import viewsets, serializers, filters, exceptions, permissions, mixins
 from rest_framework.authentication import TokenAuthentication, SessionAuthentication
+from rest_framework.decorators import action
 from rest_framework.fields import BooleanField, IntegerField
 from rest_framework import renderers
 from rest_framework.exceptions import NotAcceptable, ValidationError
@@ -34,24 +37,30 @@ from payments.models import Order
 
 from resources.models import (
     Reservation, Resource, ReservationMetadataSet,
-    ReservationHomeMunicipalityField, ReservationBulk, Unit
+    ReservationHomeMunicipalityField, ReservationBulk, ReservationValidationContext
 )
-from resources.models.reservation import RESERVATION_EXTRA_FIELDS
+from resources.models.reservation import RESERVATION_EXTRA_FIELDS, is_reservation_overlap_error
 from resources.models.utils import build_reservations_ical_file
 from resources.pagination import ReservationPagination
-from resources.models.utils import generate_reservation_xlsx, get_object_or_none
+from resources.models.utils import (
+    generate_reservation_xlsx, get_object_or_none, iter_reservation_export_csv, iter_reservation_export_rows,
+    write_reservation_export_xlsx
+)
 
-from ..auth import is_general_admin, is_underage, is_overage, is_authenticated_user, is_any_admin, is_any_manager
+from ..auth import (
+    PermissionSnapshot, is_general_admin, is_underage, is_overage, is_authenticated_user, is_any_admin,
+    is_any_manager
+)
 from .base import (
     NullableDateTimeField, TranslatedModelSerializer, register_view, DRFFilterBooleanWidget,
-    ExtraDataMixin, ReservationCreateMixin
+    ExtraDataMixin, ReservationCreateMixin, get_permission_snapshot
 )
 from resources.signals import reservation_confirmed
 
 from ..models.utils import has_reservation_data_changed, is_reservation_metadata_or_times_different
 from respa.renderers import ResourcesBrowsableAPIRenderer
 
-from maintenance.models import MaintenanceMode
+from maintenance.models import is_maintenance_mode_active
 
 User = get_user_model()
 
@@ -120,6 +129,23 @@ class HomeMunicipalitySerializer(TranslatedModelSerializer):
             return super().to_internal_value(data)
 
 
+@contextmanager
+def reservation_overlap_as_validation_error():
+    """
+    Report a violation of the reservation overlap constraint as a validation error
+
+    This is the same error that Reservation.clean() gives for a collision,
+    which concurrent requests can get past.
+    """
+    try:
+        with transaction.atomic():
+            yield
+    except IntegrityError as exc:
+        if not is_reservation_overlap_error(exc):
+            raise
+        raise ValidationError({'period': [_("The resource is already reserved for some of the period")]})
+
+
 class ReservationSerializer(ExtraDataMixin,
                             ReservationCreateMixin,
                             TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
@@ -177,6 +203,14 @@ class ReservationSerializer(ExtraDataMixin,
             extra_fields['resource'] = ResourceInlineSerializer(read_only=True, context=context)
         return extra_fields
 
+    def create(self, validated_data):
+        with reservation_overlap_as_validation_error():
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        with reservation_overlap_as_validation_error():
+            return super().update(instance, validated_data)
+
     def validate_state(self, value):
         instance = self.instance
         request_user = self.context['request'].user
@@ -208,7 +242,7 @@ class ReservationSerializer(ExtraDataMixin,
         obj_user_is_staff = bool(request_user and request_user.is_staff)
 
         if (not reservation or (reservation and reservation.state != Reservation.WAITING_FOR_PAYMENT)) \
-            and MaintenanceMode.objects.active().exists():
+            and is_maintenance_mode_active(self.context):
                 raise ValidationError(_('Reservations are disabled at this moment.'))
 
 
@@ -219,6 +253,7 @@ class ReservationSerializer(ExtraDataMixin,
             data.update({
                 'resource': resource
             })
+        resource._permission_snapshot = get_permission_snapshot(self.context['request'])
 
         if not data.get('begin', None):
             data.update({
@@ -283,8 +318,13 @@ class ReservationSerializer(ExtraDataMixin,
         if not resource.can_create_reservations_for_other_users(request_user):
             data.pop('user', None)
 
+        # Opening hours are loaded here and the reservations to check against
+        # after the resource has been locked below.
+        validation_context = ReservationValidationContext(resource, request_user, data['begin'], data['end'])
+
         # Check user specific reservation restrictions relating to given period.
-        resource.validate_reservation_period(reservation, request_user, data=data)
+        resource.validate_reservation_period(
+            reservation, request_user, data=data, opening_hours=validation_context.opening_hours)
         reserver_phone_number = data.get('reserver_phone_number', '')
         if reserver_phone_number.startswith('+'):
             if not region_code_for_country_code(phonenumbers.parse(reserver_phone_number).country_code):
@@ -332,15 +372,21 @@ class ReservationSerializer(ExtraDataMixin,
             if access_code_enabled and reservation and data['access_code'] != reservation.access_code:
                 raise ValidationError(dict(access_code=_('This field cannot be changed')))
 
+        # Check maximum number of active reservations per user per resource.
+        # Only new reservations are taken into account ie. a normal user can modify an existing reservation
+        # even if it exceeds the limit. (one that was created via admin ui for example).
+        check_max_reservations = reservation is None and not isinstance(request_user, AnonymousUser)
+
         # Mark begin of a critical section. Subsequent calls with this same resource will block here until the first
         # request is finished. This is needed so that the validations and possible reservation saving are
         # executed in one block and concurrent requests cannot be validated incorrectly.
-        Resource.objects.select_for_update().get(pk=resource.pk)
+        # Overlapping reservations are prevented by a database constraint, so the lock is only needed
+        # for the checks that look at other reservations in other ways.
+        if (check_max_reservations and resource.max_reservations_per_user is not None or
+                resource.cooldown or validation_context.check_unit_overlap):
+            Resource.objects.select_for_update().get(pk=resource.pk)
 
-        # Check maximum number of active reservations per user per resource.
-        # Only new reservations are taken into account ie. a normal user can modify an existing reservation
-        # even if it exceeds the limit. (one that was created via admin ui for example).
-        if reservation is None and not isinstance(request_user, AnonymousUser):
+        if check_max_reservations:
             resource.validate_max_reservations_per_user(request_user)
 
         request = self.context.get('request')
@@ -352,7 +398,9 @@ class ReservationSerializer(ExtraDataMixin,
         # Run model clean
         instance = Reservation(**data)
         try:
-            instance.clean(original_reservation=reservation, user=request_user)
+            # Collisions of new reservations are reported when saving, see reservation_overlap_as_validation_error()
+            instance.clean(original_reservation=reservation, user=request_user, context=validation_context,
+                           check_collision=reservation is not None)
         except DjangoValidationError as exc:
             # Convert Django ValidationError to DRF ValidationError so that in the response
             # field specific error messages are added in the field instead of in non_field_messages.
@@ -488,7 +536,7 @@ class ReservationStackSerializer(serializers.Serializer):
 
 class ReservationBulkSerializer(ReservationCreateMixin, serializers.Serializer):
     resource = serializers.PrimaryKeyRelatedField(queryset=Resource.objects.all())
-    reservation_stack = ReservationStackSerializer(many=True)
+    reservation_stack = ReservationStackSerializer(many=True, allow_empty=False)
 
     class Meta:
         fields = ReservationSerializer.Meta.fields + [ 'reservation_stack', 'resource' ]
@@ -517,11 +565,33 @@ class ReservationBulkSerializer(ReservationCreateMixin, serializers.Serializer):
             raise NotAcceptable({
                 'reservation_stack': _('Reservation failed. Too many reservations at once.')
             })
-        for data in reservation_stack:
-            reservation = Reservation(**_cattrs, **data)
-            reservation.clean()
-            resource.validate_reservation_period(reservation, reservation.user)
-            resource.validate_max_reservations_per_user(reservation.user)
+
+        # The reservations are made for the requesting user. Permissions, opening hours
+        # and existing reservations are loaded once for the whole stack.
+        request_user = self.context['request'].user
+        user = get_user_model().objects.prefetch_related(
+            'unit_authorizations', 'unit_group_authorizations__subject__members'
+        ).get(pk=request_user.pk)
+        resource._permission_snapshot = PermissionSnapshot(user)
+
+        _cattrs['user'] = user
+        reservations = [Reservation(**_cattrs, **data) for data in reservation_stack]
+        context = ReservationValidationContext(
+            resource, user,
+            min(reservation.begin for reservation in reservations),
+            max(reservation.end for reservation in reservations),
+        )
+        reservation_count = None
+        if resource.max_reservations_per_user is not None:
+            reservation_count = resource.reservations.filter(user=user).active().count()
+
+        for reservation in reservations:
+            reservation.clean(context=context)
+            resource.validate_reservation_period(reservation, user, opening_hours=context.opening_hours)
+            resource.validate_max_reservations_per_user(user, reservation_count=reservation_count)
+            context.add(reservation)
+            if reservation_count is not None:
+                reservation_count += 1
 
         return attrs
 
@@ -533,16 +603,21 @@ class ReservationBulkSerializer(ReservationCreateMixin, serializers.Serializer):
 
     def create(self, validated_data):
         reservation_stack = validated_data.pop('reservation_stack')
-        reservations = []
         user = validated_data['user']
-        for reservation_data in reservation_stack:
-            reservation = Reservation.objects.create(state=Reservation.CONFIRMED,
-                                      approver=user, **validated_data, **reservation_data)
+        with reservation_overlap_as_validation_error():
+            reservations = Reservation.objects.create_stack([
+                Reservation(state=Reservation.CONFIRMED, approver=user, **validated_data, **reservation_data)
+                for reservation_data in reservation_stack
+            ])
+
+        for reservation in reservations:
             reservation_confirmed.send(
                 sender=self.__class__,
                 instance=reservation, user=user)
-            reservation.save()
-            reservations.append(reservation)
+        # the signal handlers may have created reminders
+        reminded = [reservation for reservation in reservations if reservation.reminder_id]
+        if reminded:
+            Reservation.objects.bulk_update(reminded, ['reminder'])
 
         instance = ReservationBulk.objects.create(created_by=user)
         instance.reservations.add(*reservations)
@@ -670,7 +745,8 @@ class CanApproveFilterBackend(filters.BaseFilterBackend):
         filter_value = request.query_params.get('can_approve', None)
         if filter_value:
             queryset = queryset.filter(resource__need_manual_confirmation=True)
-            allowed_resources = Resource.objects.with_perm('can_approve_reservation', request.user)
+            allowed_resources = Resource.objects.with_perm(
+                'can_approve_reservation', request.user, snapshot=get_permission_snapshot(request))
             can_approve = BooleanField().to_internal_value(filter_value)
             if can_approve:
                 queryset = queryset.filter(resource__in=allowed_resources)
@@ -806,24 +882,9 @@ class ReservationExcelRenderer(renderers.BaseRenderer):
 
 class ReservationCacheMixin:
     def _preload_permissions(self):
-        units = set()
-        resource_groups = set()
-        resources = set()
-        checker = ObjectPermissionChecker(self.request.user)
-
+        snapshot = get_permission_snapshot(self.request)
         for rv in self._page:
-            resources.add(rv.resource)
-            rv.resource._permission_checker = checker
-
-        for res in resources:
-            units.add(res.unit)
-            for g in res.groups.all():
-                resource_groups.add(g)
-
-        if units:
-            checker.prefetch_perms(units)
-        if resource_groups:
-            checker.prefetch_perms(resource_groups)
+            rv.resource._permission_snapshot = snapshot
 
     def _get_cache_context(self):
         context = {}
@@ -851,25 +912,26 @@ class ReservationBulkViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
     def get_notification_context(self, reservations):
         return {
             'first_reservation': {
-                'begin': self._strftime(reservations.first().begin),
-                'end': self._strftime(reservations.first().end)
+                'begin': self._strftime(reservations[0].begin),
+                'end': self._strftime(reservations[0].end)
             },
             'last_reservation': {
-                'begin': self._strftime(reservations.last().begin),
-                'end': self._strftime(reservations.last().end)
+                'begin': self._strftime(reservations[-1].begin),
+                'end': self._strftime(reservations[-1].end)
             },
             'dates': [
                 {'begin': self._strftime(reservation.begin),
                 'end': self._strftime(reservation.end)}
-                for reservation in reservations.all()
+                for reservation in reservations
             ]
         }
 
     def perform_create(self, serializer):
         instance = serializer.save(user=self.request.user)
+        reservations = list(instance.reservations.select_related('resource', 'resource__unit'))
 
         attachments = []
-        for reservation in instance.reservations.all():
+        for reservation in reservations:
             ical_file = build_reservations_ical_file([reservation])
             begin = self._strftime(reservation.begin)
             end = self._strftime(reservation.end) \
@@ -877,10 +939,10 @@ class ReservationBulkViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
             
             attachment = ('reservation %s - %s.ics' % (begin, end), ical_file, 'text/calendar')
             attachments.append(attachment)
-        instance.reservations.first().send_reservation_mail(
+        reservations[0].send_reservation_mail(
             NotificationType.RESERVATION_BULK_CREATED,
             attachments=attachments,
-            extra_context=self.get_notification_context(instance.reservations)
+            extra_context=self.get_notification_context(reservations)
         )
 
 class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, ReservationCacheMixin):
@@ -952,13 +1014,43 @@ class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, Res
         if user.is_authenticated:
             filters |= Q(user=user)
 
+        snapshot = get_permission_snapshot(self.request)
         if is_any_admin(user) or is_any_manager(user):
-            filters |= Q(resource__unit__in=Unit.objects.managed_by(user))
+            filters |= Q(resource__unit__in=snapshot.get_managed_unit_ids())
 
         queryset = queryset.filter(filters)
-        queryset = queryset.filter(resource__in=Resource.objects.visible_for(user))
+        queryset = queryset.filter(resource__in=Resource.objects.visible_for(user, snapshot=snapshot))
         return queryset
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Export the filtered reservations as a streamed xlsx or CSV file
+
+        Unlike the xlsx format of the list, the export is not paginated
+        and does not include the resource utilization summary.
+        """
+        export_format = request.query_params.get('export_format', 'xlsx')
+        if export_format not in ('xlsx', 'csv'):
+            raise ValidationError({'export_format': _('Invalid export format.')})
+
+        queryset = self.filter_queryset(self.get_queryset())
+        weekdays = [int(day) for day in request.query_params.get('weekdays', '').split(',') if day.isdigit()]
+        if weekdays:
+            queryset = queryset.filter(begin__iso_week_day__in=[day + 1 for day in weekdays])
+        include_block_reservations = request.query_params.get('include_block_reservations', '0') == '1'
+        rows = iter_reservation_export_rows(queryset, request.user, include_block_reservations)
+
+        if export_format == 'csv':
+            response = StreamingHttpResponse(iter_reservation_export_csv(rows), content_type='text/csv; charset=utf-8')
+        else:
+            output = tempfile.TemporaryFile()
+            write_reservation_export_xlsx(rows, output)
+            output.seek(0)
+            response = FileResponse(output, content_type=ReservationExcelRenderer.media_type)
+        response['Content-Disposition'] = 'attachment; filename={}.{}'.format(_('reservations'), export_format)
+        return response
+
     def perform_create(self, serializer):
         user = self.request.user
         override_data = {'created_by': user if user.is_authenticated else None,
@@ -1,6 +1,7 @@
 import collections
 import datetime
 import logging
+import re
 from posixpath import basename
 import jsonschema as json
 
@@ -9,12 +10,15 @@ import base64
 import django_filters
 import pytz
 from arrow.parser import ParserError
+from psycopg2.extras import DateTimeTZRange
 
 from django import forms
 from django.conf import settings
 from django.core.validators import validate_email
 from django.core.files.base import ContentFile
-from django.db.models import OuterRef, Prefetch, Q, Subquery, Value
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, OuterRef, Q, Subquery, Value
+from django.db.models.expressions import RawSQL
 from django.db.models.functions import Coalesce, Least
 from django.urls import reverse
 from django.contrib.gis.db.models.functions import Distance
@@ -29,7 +33,8 @@ from resources.timmi import TimmiManager
 from PIL import Image
 from io import BytesIO
 
-from resources.pagination import PurposePagination
+from maintenance.models import MaintenanceMode
+from resources.pagination import PurposePagination, ResourcePagination
 from rest_framework import (
     exceptions, filters, mixins, 
     serializers, viewsets, response, 
@@ -39,25 +44,26 @@ from rest_framework import (
 from rest_framework.response import Response
 from rest_framework.authentication import SessionAuthentication, TokenAuthentication
 from rest_framework.decorators import action
-from guardian.core import ObjectPermissionChecker
 from munigeo import api as munigeo_api
 from resources.models import (
     AccessibilityValue, AccessibilityViewpoint, Purpose, Reservation, Resource, ResourceAccessibility,
     ResourceImage, ResourceType, ResourceEquipment, TermsOfUse, Equipment, ReservationMetadataSet,
     ReservationMetadataField, ReservationHomeMunicipalityField,
     ReservationHomeMunicipalitySet, ResourceDailyOpeningHours, UnitAccessibility, Unit, ResourceTag,
-    ResourceUniversalField, ResourceUniversalFormOption, UniversalFormFieldType, ResourcePublishDate
+    ResourceUniversalField, ResourceUniversalFormOption, UniversalFormFieldType, ResourcePublishDate,
+    ResourceFreeInterval
 )
-from resources.models.resource import determine_hours_time_range
+from resources.models.resource import SEARCH_CONFIGS, CleanResourceID, determine_hours_time_range
 from payments.models import Product
 from respa_admin.models import DisabledFieldsSet
 
 from ..auth import has_permission, is_general_admin, is_staff, has_api_permission
 from .accessibility import ResourceAccessibilitySerializer
+from .cache import CachedResponseMixin, get_publish_state
 from .base import (
     ExtraDataMixin, TranslatedModelSerializer, register_view,
     DRFFilterBooleanWidget, PeriodSerializer, DaySerializer, Period,
-    LocationField, get_translated_field_help_text, CancelReservationsView
+    LocationField, get_permission_snapshot, get_translated_field_help_text, CancelReservationsView
 )
 from .reservation import ReservationSerializer
 from .unit import UnitSerializer
@@ -66,7 +72,7 @@ from .resource_field import UniversalFormFieldTypeSerializer
 from rest_framework.settings import api_settings as drf_settings
 from rest_framework.relations import PrimaryKeyRelatedField
 from resources.models.utils import log_entry
-from maintenance.models import MaintenanceMode
+from maintenance.models import is_maintenance_mode_active
 
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
@@ -76,6 +82,33 @@ logger = logging.getLogger(__name__)
 
 ALLOWED_IMAGE_FORMATS = ("JPEG", "JPG", "PNG", "SVG", "MPO", "WEBP")
 
+# Resources with a continuous free time of at least the given length inside
+# the given range. Free intervals of a resource touching each other are merged
+# into islands: an interval not starting where the previous one ends starts a
+# new island, and the running count of island starts numbers the islands.
+FREE_RESOURCES_SQL = """
+    SELECT resource_id FROM (
+        SELECT resource_id, tstzrange(min(lower(free_between)), max(upper(free_between)), '[)')
+            * tstzrange(%s, %s, '[)') AS free_between
+        FROM (
+            SELECT resource_id, free_between,
+                count(*) FILTER (WHERE starts_island) OVER (
+                    PARTITION BY resource_id ORDER BY lower(free_between)
+                ) AS island
+            FROM (
+                SELECT resource_id, free_between,
+                    lower(free_between) IS DISTINCT FROM lag(upper(free_between)) OVER (
+                        PARTITION BY resource_id ORDER BY lower(free_between)
+                    ) AS starts_island
+                FROM {table}
+                WHERE free_between && tstzrange(%s, %s, '[)')
+            ) AS intervals
+        ) AS islands
+        GROUP BY resource_id, island
+    ) AS free_times
+    WHERE upper(free_between) - lower(free_between) >= %s
+"""
+
 
 def parse_query_time_range(params):
     times = {}
@@ -154,7 +187,8 @@ class PurposeSerializer(TranslatedModelSerializer):
         super().update(instance, validated_data)
         return instance
 
-class PurposeViewSet(viewsets.ModelViewSet):
+class PurposeViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_models = (Purpose,)
     queryset = Purpose.objects.all()
     serializer_class = PurposeSerializer
     pagination_class = PurposePagination
@@ -190,7 +224,8 @@ class ResourceTypeFilterSet(django_filters.FilterSet):
         fields = ('resource_group',)
 
 
-class ResourceTypeViewSet(viewsets.ModelViewSet):
+class ResourceTypeViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_models = (ResourceType,)
     queryset = ResourceType.objects.all()
     serializer_class = ResourceTypeSerializer
     filter_backends = (django_filters.rest_framework.DjangoFilterBackend,)
@@ -722,6 +757,9 @@ class ResourceSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.
         return [ResourceAccessibilitySerializer(summary).data for summary in summaries]
 
     def get_tags(self, obj):
+        tags_cache = self.context.get('tags_cache')
+        if tags_cache is not None:
+            return list(tags_cache.get(obj.pk, set()))
         return list(set(
             [tag.label for tag in ResourceTag.objects.filter(resource=obj)] + list(obj.tags.names())))
 
@@ -745,14 +783,19 @@ class ResourceSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.
         }
 
 
-        if MaintenanceMode.objects.active().exists():
+        if is_maintenance_mode_active(self.context):
             return permissions.fromkeys(permissions, False)
 
         return permissions
 
     def get_is_favorite(self, obj):
+        favorite_cache = self.context.get('favorite_cache')
+        if favorite_cache is not None:
+            return obj.pk in favorite_cache
         request = self.context.get('request', None)
-        return request.user in obj.favorited_by.all()
+        if not request or not request.user.is_authenticated:
+            return False
+        return obj.favorited_by.filter(pk=request.user.pk).exists()
 
     def get_generic_terms(self, obj):
         data = TermsOfUseSerializer(obj.generic_terms).data
@@ -763,7 +806,7 @@ class ResourceSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.
         return data['text']
 
     def get_reservable(self, obj):
-        if MaintenanceMode.objects.active().exists():
+        if is_maintenance_mode_active(self.context):
             return False
         return obj.reservable
 
@@ -912,7 +955,8 @@ class ResourceSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.
         model = Resource
         exclude = ('reservation_requested_notification_extra', 'reservation_confirmed_notification_extra',
                    'access_code_type', 'reservation_metadata_set', 'reservation_home_municipality_set', 
-                   'created_by', 'modified_by', 'configuration', 'resource_email', 'soft_deleted', '_public')
+                   'created_by', 'modified_by', 'configuration', 'resource_email', 'soft_deleted', '_public',
+                   'search_vector')
 
 
 class ResourceDetailsSerializer(ResourceSerializer):
@@ -1061,120 +1105,37 @@ class ResourceFilterSet(django_filters.FilterSet):
         available_start = self._deserialize_datetime(value[0])
         available_end = self._deserialize_datetime(value[1])
 
-        if available_start.date() != available_end.date():
-            raise exceptions.ParseError('available_between timestamps must be on the same day.')
-        overlapping_reservations = Reservation.objects.filter(
-            resource__in=queryset, end__gt=available_start, begin__lt=available_end
-        ).current()
+        if available_start > available_end:
+            raise exceptions.ParseError('available_between start must not be after its end.')
 
         if len(value) == 2:
-            return self._filter_available_between_whole_range(
-                queryset, overlapping_reservations, available_start, available_end
-            )
+            return self._filter_available_between_whole_range(queryset, available_start, available_end)
         else:
             try:
                 period = datetime.timedelta(minutes=int(value[2]))
             except ValueError:
                 raise exceptions.ParseError('available_between period must be an integer.')
-            return self._filter_available_between_with_period(
-                queryset, overlapping_reservations, available_start, available_end, period
-            )
-
-    def _filter_available_between_whole_range(self, queryset, reservations, available_start, available_end):
-        # exclude resources that have reservation(s) overlapping with the available_between range
-        queryset = queryset.exclude(reservations__in=reservations)
-        closed_resource_ids = {
-            resource.id
-            for resource in queryset
-            if not self._is_resource_open(resource, available_start, available_end)
-        }
-
-        return queryset.exclude(id__in=closed_resource_ids)
-
-    @staticmethod
-    def _is_resource_open(resource, start, end):
-        opening_hours = resource.get_opening_hours(start, end)
-        if len(opening_hours) > 1:
-            # range spans over multiple days, assume resources aren't open all night and skip the resource
-            return False
-
-        hours = next(iter(opening_hours.values()))[0]  # assume there is only one hours obj per day
-        if not hours['opens'] and not hours['closes']:
-            return False
-
-        start_too_early = hours['opens'] and start < hours['opens']
-        end_too_late = hours['closes'] and end > hours['closes']
-        if start_too_early or end_too_late:
-            return False
-
-        return True
-
-    def _filter_available_between_with_period(self, queryset, reservations, available_start, available_end, period):
-        reservations = reservations.order_by('begin').select_related('resource')
-
-        reservations_by_resource = collections.defaultdict(list)
-        for reservation in reservations:
-            reservations_by_resource[reservation.resource_id].append(reservation)
-
-        available_resources = set()
-
-        hours_qs = ResourceDailyOpeningHours.objects.filter(
-            open_between__overlap=(available_start, available_end, '[)'))
-
-        # check the resources one by one to determine which ones have open slots
-        for resource in queryset.prefetch_related(None).prefetch_related(
-                Prefetch('opening_hours', queryset=hours_qs, to_attr='prefetched_opening_hours')):
-            reservations = reservations_by_resource[resource.id]
-
-            if self._is_resource_available(resource, available_start, available_end, reservations, period):
-                available_resources.add(resource.id)
-
-        return queryset.filter(id__in=available_resources)
-
-    @staticmethod
-    def _is_resource_available(resource, available_start, available_end, reservations, period):
-        opening_hours = resource.get_opening_hours(available_start, available_end, resource.prefetched_opening_hours)
-        hours = next(iter(opening_hours.values()))[0]  # assume there is only one hours obj per day
+            return self._filter_available_between_with_period(queryset, available_start, available_end, period)
 
-        if not (hours['opens'] or hours['closes']):
-            return False
-
-        current = max(available_start, hours['opens']) if hours['opens'] is not None else available_start
-        end = min(available_end, hours['closes']) if hours['closes'] is not None else available_end
-
-        if current >= end:
-            # the resource is already closed
-            return False
-
-        if not reservations:
-            # the resource has no reservations, just check if the period fits in the resource's opening times
-            if end - current >= period:
-                return True
-            return False
+    def _filter_available_between_whole_range(self, queryset, available_start, available_end):
+        if available_start.date() != available_end.date():
+            # free intervals end at closing time, so a range spanning several
+            # days may be covered by consecutive intervals
+            return self._filter_available_between_with_period(
+                queryset, available_start, available_end, available_end - available_start)
 
-        # try to find an open slot between reservations and opening / closing times.
-        # start from period start time or opening time depending on which one is earlier.
-        for reservation in reservations:
-            if reservation.end <= current:
-                # this reservation is in the past
-                continue
-            if reservation.begin - current >= period:
-                # found an open slot before the reservation currently being examined
-                return True
-            if reservation.end > end:
-                # the reservation currently being examined ends after the period or closing time,
-                # so no free slots
-                return False
-            # did not find an open slot before the reservation currently being examined,
-            # proceed to next reservation
-            current = reservation.end
-        else:
-            # all reservations checked and no free slot found, check if there is a free slot after the last
-            # reservation
-            if end - reservation.end >= period:
-                return True
+        # a single free interval of the resource must cover the whole range
+        available_range = DateTimeTZRange(available_start, available_end, '[)')
+        return queryset.filter(free_intervals__free_between__contains=available_range)
 
-        return False
+    def _filter_available_between_with_period(self, queryset, available_start, available_end, period):
+        # Adjacent free intervals are merged into continuous free time with
+        # window functions, and the part of it inside the range must fit
+        # the period.
+        free_resources = RawSQL(FREE_RESOURCES_SQL.format(table=ResourceFreeInterval._meta.db_table), (
+            available_start, available_end, available_start, available_end, period
+        ))
+        return queryset.filter(id__in=free_resources)
 
     class Meta:
         model = Resource
@@ -1196,6 +1157,37 @@ class ResourceFilterBackend(filters.BaseFilterBackend):
         return ResourceFilterSet(request.query_params, queryset=queryset, user=request.user).qs
 
 
+class ResourceSearchFilter(filters.BaseFilterBackend):
+    """
+    Full-text search of resources, best matches first.
+
+    Resources are searched by names, descriptions, unit and type names
+    and tags in all languages. The last word of the search also matches
+    words starting with it, so the search works while typing.
+    """
+    search_param = drf_settings.SEARCH_PARAM
+
+    def get_search_query(self, request):
+        words = re.findall(r'\w+', request.query_params.get(self.search_param, ''))
+        if not words:
+            return None
+        terms = ["'%s'" % word for word in words]
+        terms[-1] += ':*'
+        raw_query = ' & '.join(terms)
+        query = SearchQuery(raw_query, config='simple', search_type='raw')
+        for config in SEARCH_CONFIGS.values():
+            query |= SearchQuery(raw_query, config=config, search_type='raw')
+        return query
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_search_query(request)
+        if query is None:
+            return queryset
+        queryset = queryset.filter(search_vector=query)
+        queryset = queryset.annotate(search_rank=SearchRank(F('search_vector'), query))
+        return queryset.order_by('-search_rank', *Resource._meta.ordering)
+
+
 class LocationFilterBackend(filters.BaseFilterBackend):
     """
     Filters based on resource (or resource unit) location.
@@ -1253,6 +1245,8 @@ class ResourceCacheMixin:
         return hours_by_resource
 
     def _preload_reservations(self, times):
+        # The reservations themselves are serialized, so they can't be
+        # answered from the free intervals like available_between is
         qs = get_resource_reservations_queryset(times['start'], times['end'])
         reservations = qs.filter(resource__in=self._page)
         reservations_by_resource = {}
@@ -1262,19 +1256,26 @@ class ResourceCacheMixin:
         return reservations_by_resource
 
     def _preload_permissions(self):
-        units = set()
-        resource_groups = set()
-        checker = ObjectPermissionChecker(self.request.user)
+        snapshot = get_permission_snapshot(self.request)
         for res in self._page:
-            units.add(res.unit)
-            for g in res.groups.all():
-                resource_groups.add(g)
-            res._permission_checker = checker
-
-        if units:
-            checker.prefetch_perms(units)
-        if resource_groups:
-            checker.prefetch_perms(resource_groups)
+            res._permission_snapshot = snapshot
+
+    def _preload_tags(self):
+        resource_ids = [resource.pk for resource in self._page]
+        # Both the plain resource tags and the taggit tags in a single query
+        tags = ResourceTag.objects.filter(resource__in=resource_ids).values_list('resource_id', 'label').union(
+            CleanResourceID.objects.filter(object_id__in=resource_ids).values_list('object_id', 'tag__name'))
+        tags_cache = {}
+        for resource_id, label in tags:
+            tags_cache.setdefault(resource_id, set()).add(label)
+        return tags_cache
+
+    def _preload_favorites(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return set()
+        resource_ids = [resource.pk for resource in self._page]
+        return set(user.favorite_resources.filter(pk__in=resource_ids).values_list('pk', flat=True))
 
     def _get_cache_context(self):
         context = {}
@@ -1296,6 +1297,8 @@ class ResourceCacheMixin:
         context['opening_hours_cache'] = self._preload_opening_hours(times)
 
         context['accessibility_viewpoint_cache'] = AccessibilityViewpoint.objects.all()
+        context['tags_cache'] = self._preload_tags()
+        context['favorite_cache'] = self._preload_favorites()
 
         self._preload_permissions()
 
@@ -1693,7 +1696,7 @@ class ResourceCreateSerializer(TranslatedModelSerializer):
             'resource_email', 'configuration',
             'created_at', 'modified_at',
             'modified_by', 'created_by',
-            'generic_terms', 'payment_terms'
+            'generic_terms', 'payment_terms', 'search_vector'
         )
         required_translations = (
             'name_fi', 'name_sv', 'name_en'
@@ -2069,21 +2072,25 @@ class ResourceDeleteView(views.APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class ResourceListViewSet(munigeo_api.GeoModelAPIView, mixins.ListModelMixin,
+class ResourceListViewSet(CachedResponseMixin, munigeo_api.GeoModelAPIView, mixins.ListModelMixin,
                           viewsets.GenericViewSet, ResourceCacheMixin):
+    cache_models = (
+        Resource, Unit, ResourceType, Purpose, ResourceImage, ResourceEquipment, Equipment, ResourceTag,
+        TermsOfUse, ReservationMetadataSet, ResourceDailyOpeningHours, AccessibilityViewpoint,
+        ResourceAccessibility, ResourceUniversalField, ResourceUniversalFormOption, Product, MaintenanceMode,
+        ResourcePublishDate,
+    )
+    # Responses to these depend on the current reservations
+    time_query_params = ('start', 'end', 'duration', 'during_closing', 'available_between')
     queryset = Resource.objects.select_related('generic_terms', 'payment_terms', 'unit', 'type', 'reservation_metadata_set')
-    queryset = queryset.prefetch_related('favorited_by', 'resource_equipment', 'resource_equipment__equipment',
-                                         'purposes', 'images', 'purposes', 'groups', 'resource_tags')
+    queryset = queryset.prefetch_related('resource_equipment', 'resource_equipment__equipment',
+                                         'purposes', 'images', 'purposes', 'groups')
     if settings.RESPA_PAYMENTS_ENABLED:
         queryset = queryset.prefetch_related('products')
-    filter_backends = (filters.SearchFilter, ResourceFilterBackend, LocationFilterBackend)
-    search_fields = (
-                    'name_fi', 'description_fi', 'unit__name_fi', 'type__name_fi',
-                    'name_sv', 'description_sv', 'unit__name_sv', 'type__name_sv',
-                    'name_en', 'description_en', 'unit__name_en', 'type__name_en', '=resource_tags__label'
-                    )
+    filter_backends = (ResourceSearchFilter, ResourceFilterBackend, LocationFilterBackend)
 
     serializer_class = ResourceSerializer
+    pagination_class = ResourcePagination
     authentication_classes = (
         list(drf_settings.DEFAULT_AUTHENTICATION_CLASSES) +
         [SessionAuthentication])
@@ -2114,7 +2121,17 @@ class ResourceListViewSet(munigeo_api.GeoModelAPIView, mixins.ListModelMixin,
         return context
 
     def get_queryset(self):
-        return self.queryset.visible_for(self.request.user)
+        return self.queryset.visible_for(self.request.user, snapshot=get_permission_snapshot(self.request))
+
+    def get_response_cache_key(self, request):
+        if any(param in request.query_params for param in self.time_query_params):
+            return None
+        return super().get_response_cache_key(request)
+
+    def get_response_cache_variant(self, request):
+        return super().get_response_cache_variant(request) + [
+            get_publish_state(), str(is_maintenance_mode_active()),
+        ]
 
 
 class ResourceViewSet(munigeo_api.GeoModelAPIView, mixins.RetrieveModelMixin,
@@ -2151,7 +2168,7 @@ class ResourceViewSet(munigeo_api.GeoModelAPIView, mixins.RetrieveModelMixin,
         return context
 
     def get_queryset(self):
-        return self.queryset.visible_for(self.request.user)
+        return self.queryset.visible_for(self.request.user, snapshot=get_permission_snapshot(self.request))
 
     def _set_favorite(self, request, value):
         resource = self.get_object()
@@ -1,12 +1,19 @@
-from django.db.models import Q
+import hashlib
+
+from django.conf import settings
+from django.db.models import Case, IntegerField, Q, Value, When
 from django.utils.encoding import force_str
+from modeltranslation.utils import build_localized_fieldname, get_language
 from rest_framework import viewsets
 from rest_framework.fields import BooleanField
 from rest_framework.response import Response
 
+from resources.api.cache import get_model_versions, get_response_cache, is_response_cache_enabled
 from resources.api.resource import ResourceListViewSet
 from resources.api.unit import UnitViewSet
 
+TYPEAHEAD_RESULT_COUNT = 10
+
 
 class TypeaheadViewSet(viewsets.ViewSet):
     """
@@ -25,6 +32,10 @@ class TypeaheadViewSet(viewsets.ViewSet):
     be limited by the comma-separated `types` query parameter.
 
     Currently supported are "resource" and "unit".
+
+    Names are matched in all languages. Objects whose name is the input
+    or starts with it come first. When a shared API cache is configured,
+    results to anonymous users are cached until the objects change.
     """
     objects = {
         "resource": {"search_fields": ["name"], "viewset": ResourceListViewSet, "text_getter": force_str},
@@ -52,26 +63,72 @@ class TypeaheadViewSet(viewsets.ViewSet):
                 yield obj_list
 
     def get_single_object_type_object_list(self, request, obj_name, query_parts, full=False):
-        # TODO: Could add caching here, keyed on `query_parts`
         obj_schema = self.objects.get(obj_name)
         if not obj_schema:
             return None
-        q = self.build_q(obj_schema["search_fields"], query_parts)
 
         # Defer serialization and queryset retrieval to the viewsets that are in use
         # in the general API.
         viewset_class = obj_schema["viewset"]
         object_viewset = viewset_class(request=request)
         object_viewset.initial(request)
-        queryset = object_viewset.get_queryset().filter(q)[:10]  # TODO: Sort these?
-        if queryset.exists():
-            if full:
-                data = object_viewset.get_serializer(queryset, many=True).data
-            else:
-                text_getter = obj_schema["text_getter"]
-                data = [{"id": obj.pk, "text": text_getter(obj)} for obj in queryset]
+
+        cache_key = self.get_cache_key(request, object_viewset, obj_name, query_parts, full)
+        if cache_key is not None:
+            data = get_response_cache().get(cache_key)
+            if data is not None:
+                return (obj_name, data) if data else None
+
+        search_fields = self.get_localized_fields(obj_schema["search_fields"])
+        queryset = object_viewset.get_queryset().filter(self.build_q(search_fields, query_parts))
+        queryset = self.rank(queryset, search_fields, query_parts)
+        objects = list(queryset[:TYPEAHEAD_RESULT_COUNT])
+        if full:
+            data = object_viewset.get_serializer(objects, many=True).data
+        else:
+            text_getter = obj_schema["text_getter"]
+            data = [{"id": obj.pk, "text": text_getter(obj)} for obj in objects]
+
+        if cache_key is not None:
+            timeout = getattr(settings, 'RESPA_API_CACHE_TIMEOUT', 300)
+            get_response_cache().set(cache_key, data, timeout)
+        if data:
             return (obj_name, data)
 
+    def get_cache_key(self, request, object_viewset, obj_name, query_parts, full):
+        # What the users see depends on their permissions, so only anonymous results are shared
+        if not is_response_cache_enabled() or request.user.is_authenticated:
+            return None
+        parts = [
+            obj_name, ' '.join(query_parts), str(full), get_language(),
+        ] + get_model_versions(object_viewset.cache_models)
+        if full:
+            parts += object_viewset.get_response_cache_variant(request)
+        return 'typeahead:' + hashlib.md5('\n'.join(parts).encode()).hexdigest()
+
+    def get_localized_fields(self, fields):
+        return [
+            build_localized_fieldname(field, lang)
+            for field in fields
+            for lang, _name in settings.LANGUAGES
+        ]
+
+    def rank(self, queryset, fields, query_parts):
+        phrase = ' '.join(query_parts)
+        exact = Q()
+        prefix = Q()
+        for field in fields:
+            exact |= Q(**{"%s__iexact" % field: phrase})
+            prefix |= Q(**{"%s__istartswith" % field: phrase})
+        queryset = queryset.annotate(typeahead_rank=Case(
+            When(exact, then=Value(0)),
+            When(prefix, then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField(),
+        ))
+        name_field = build_localized_fieldname('name', get_language())
+        return queryset.order_by('typeahead_rank', name_field, 'pk')
+
     def build_q(self, fields, query_parts):
         q = Q()
         for field in fields:
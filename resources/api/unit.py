@@ -14,12 +14,13 @@ from resources.api.base import (
     NullableDateTimeField, TranslatedModelSerializer,
     register_view, DRFFilterBooleanWidget, CancelReservationsView
 )
-from resources.models import Unit
-from resources.models.resource import Resource
+from resources.models import Day, Period, Unit, UnitAccessibility, UnitAuthorization
+from resources.models.resource import Resource, ResourcePublishDate
 from resources.models.reservation import Reservation
 from resources.enums import UNIT_AUTH_MAP
 from .accessibility import UnitAccessibilitySerializer
 from .base import ExtraDataMixin, LocationField, PeriodSerializer
+from .cache import CachedResponseMixin, get_publish_state
 from resources.models.utils import log_entry
 
 from users.models import User
@@ -211,12 +212,17 @@ class UnitSerializer(ExtraDataMixin, TranslatedModelSerializer):
         )
 
 
-class UnitViewSet(viewsets.ModelViewSet):
+class UnitViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    cache_models = (Unit, UnitAuthorization, UnitAccessibility, Period, Day, Resource, ResourcePublishDate)
     queryset = Unit.objects.all()
     serializer_class = UnitSerializer
     filter_backends = (django_filters.rest_framework.DjangoFilterBackend,)
     filterset_class = UnitFilterSet
     permission_classes = (DjangoModelPermissionsOrAnonReadOnly, )
 
+    def get_response_cache_variant(self, request):
+        # Units are hidden based on the public state of their resources
+        return super().get_response_cache_variant(request) + [get_publish_state()]
+
 
 register_view(UnitViewSet, 'unit')
@@ -1,4 +1,6 @@
 from django.contrib.auth.models import AnonymousUser
+from django.db.models import Q
+from django.utils.functional import cached_property
 from .enums import UnitGroupAuthorizationLevel, UnitAuthorizationLevel
 
 def is_authenticated_user(user):
@@ -117,3 +119,105 @@ def has_api_permission(user, scope, permission, **kwargs):
     return is_authenticated_user(user) and \
         has_permission(user, '{app}.{scope}:api:{permission}' \
             .format(app=kwargs.get('app', 'resources'), scope=scope, permission=permission))
+
+
+class PermissionSnapshot:
+    """
+    Unit roles and object permissions of a user, loaded once
+
+    Checking permissions for many resources re-reads the same unit and
+    unit group authorizations and guardian permissions over and over.
+    The snapshot reads each of them once, on first use, and answers the
+    checks from sets. It is meant to be shared by the checks of a single
+    request, so that changes to the permissions are seen by the next one.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.is_authenticated = is_authenticated_user(user)
+        self.is_superuser = is_superuser(user)
+        self.is_general_admin = is_general_admin(user)
+
+    def is_for(self, user):
+        if not self.is_authenticated:
+            return not is_authenticated_user(user)
+        return is_authenticated_user(user) and user.pk == self.user.pk
+
+    @cached_property
+    def unit_levels(self):
+        """
+        Authorization levels of the user by unit id, both directly and via unit groups
+        """
+        levels = {}
+        if not self.is_authenticated:
+            return levels
+        for auth in self.user.unit_authorizations.all():
+            levels.setdefault(auth.subject_id, set()).add(auth.level)
+        for group_auth in self.user.unit_group_authorizations.all():
+            for unit in group_auth.subject.members.all():
+                levels.setdefault(unit.pk, set()).add(group_auth.level)
+        return levels
+
+    @cached_property
+    def object_perms(self):
+        """
+        Codenames of the guardian permissions of the user by content type id and object pk
+        """
+        from django.contrib.contenttypes.models import ContentType
+        from guardian.models import GroupObjectPermission, UserObjectPermission
+        from .models import ResourceGroup, Unit
+
+        perms = {}
+        if not self.is_authenticated or not self.user.is_active:
+            return perms
+        content_types = ContentType.objects.get_for_models(Unit, ResourceGroup).values()
+        for model, owner in ((UserObjectPermission, Q(user=self.user)),
+                             (GroupObjectPermission, Q(group__user=self.user))):
+            rows = model.objects.filter(owner, content_type__in=content_types)
+            for content_type_id, object_pk, codename in rows.values_list(
+                    'content_type_id', 'object_pk', 'permission__codename'):
+                perms.setdefault((content_type_id, object_pk), set()).add(codename)
+        return perms
+
+    def has_role(self, unit_id, roles):
+        return bool(self.unit_levels.get(unit_id, set()).intersection(roles))
+
+    def is_unit_admin(self, unit_id):
+        return self.is_general_admin or self.has_role(
+            unit_id, (UnitAuthorizationLevel.admin, UnitGroupAuthorizationLevel.admin))
+
+    def is_unit_manager(self, unit_id):
+        return self.has_role(unit_id, (UnitAuthorizationLevel.manager,))
+
+    def is_unit_viewer(self, unit_id):
+        return self.has_role(unit_id, (UnitAuthorizationLevel.viewer,))
+
+    def has_object_perm(self, codename, model, pk):
+        from django.contrib.contenttypes.models import ContentType
+
+        content_type = ContentType.objects.get_for_model(model)
+        return codename in self.object_perms.get((content_type.pk, str(pk)), ())
+
+    def get_object_pks_with_perm(self, codename, model):
+        from django.contrib.contenttypes.models import ContentType
+
+        content_type = ContentType.objects.get_for_model(model)
+        return {
+            object_pk for (content_type_id, object_pk), codenames in self.object_perms.items()
+            if content_type_id == content_type.pk and codename in codenames
+        }
+
+    def has_role_in_all_units(self, roles):
+        if not self.is_authenticated or not roles:
+            return False
+        if self.is_superuser:
+            return True
+        admin_roles = {UnitAuthorizationLevel.admin, UnitGroupAuthorizationLevel.admin}
+        return self.is_general_admin and bool(admin_roles.intersection(roles))
+
+    def get_unit_ids_with_roles(self, roles):
+        return {unit_id for unit_id, levels in self.unit_levels.items() if levels.intersection(roles)}
+
+    def get_managed_unit_ids(self):
+        return self.get_unit_ids_with_roles(
+            (UnitAuthorizationLevel.admin, UnitAuthorizationLevel.manager, UnitGroupAuthorizationLevel.admin))
@@ -1,21 +1,46 @@
-from django.core.management.base import BaseCommand, CommandError
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from resources.models import Reservation
 from resources.models.reservation import ReservationReminder
 
-from time import time
+logger = logging.getLogger()
 
 
 class Command(BaseCommand):
-    help = "Handles email notification reminders."
+    help = "Handles SMS notification reminders."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of reminders sent per batch')
 
     def handle(self, *args, **options):
-        if not ReservationReminder.objects.all():
-            print('No reminders.')
-            return
-        for reminder in ReservationReminder.objects.all():
-            if reminder.reservation.state == 'cancelled':
-                reminder.delete()
-            elif reminder.reservation.state == 'confirmed':
-                if int(time()) > reminder.get_unix_timestamp():
-                    reminder.remind()
-                    reminder.delete()
+        ReservationReminder.objects.unsent().filter(reservation__state=Reservation.CANCELLED).delete()
+
+        total = 0
+        while True:
+            sent = self.send_batch(options['batch_size'])
+            if not sent:
+                break
+            total += sent
+
+        if total:
+            logger.info('Sent %d reservation reminders' % total)
 
+    def send_batch(self, batch_size):
+        with transaction.atomic():
+            # Locked reminders are being sent by another worker.
+            reminders = list(
+                ReservationReminder.objects.due()
+                .select_related('reservation', 'reservation__user', 'reservation__resource__unit')
+                .select_for_update(skip_locked=True, of=('self',))
+                .order_by('reminder_date')[:batch_size]
+            )
+            for reminder in reminders:
+                reminder.remind()
+            ReservationReminder.objects.filter(id__in=[reminder.id for reminder in reminders]) \
+                .update(sent_at=timezone.now())
+        return len(reminders)
@@ -0,0 +1,80 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from resources.models import Reservation, Resource
+
+logger = logging.getLogger()
+
+OVERLAPPING_RESERVATIONS_SQL = """
+    SELECT r1.id, r2.id
+    FROM resources_reservation r1
+    JOIN resources_reservation r2
+        ON r2.resource_id = r1.resource_id AND r2.id > r1.id AND r2.duration && r1.duration
+    WHERE r1.state NOT IN ('cancelled', 'denied') AND r2.state NOT IN ('cancelled', 'denied')
+"""
+
+
+def get_overlapping_reservation_pairs(cursor):
+    cursor.execute(OVERLAPPING_RESERVATIONS_SQL)
+    return cursor.fetchall()
+
+
+class Command(BaseCommand):
+    help = (
+        "Lists reservations that overlap another reservation of the same resource, "
+        "and with --resolve denies or cancels all but the earliest created of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resolve', action='store_true', default=False,
+                            help='Deny or cancel the overlapping reservations instead of only listing them')
+        parser.add_argument('--state', choices=(Reservation.DENIED, Reservation.CANCELLED), default=Reservation.DENIED,
+                            help='State to set to the overlapping reservations (default: denied)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                pairs = get_overlapping_reservation_pairs(cursor)
+            if not pairs:
+                self.stdout.write('No overlapping reservations.')
+                return
+
+            ids = {pk for pair in pairs for pk in pair}
+            reservations = list(
+                Reservation.objects.filter(pk__in=ids).select_for_update()
+                .order_by('created_at', 'pk').values('pk', 'resource_id', 'begin', 'end', 'created_at')
+            )
+            # Keep the earliest created reservation of every overlapping group
+            kept = {}
+            overlapping = []
+            for reservation in reservations:
+                kept_times = kept.setdefault(reservation['resource_id'], [])
+                if any(begin < reservation['end'] and reservation['begin'] < end for begin, end in kept_times):
+                    overlapping.append(reservation)
+                else:
+                    kept_times.append((reservation['begin'], reservation['end']))
+
+            for reservation in overlapping:
+                self.stdout.write('%(pk)s: resource %(resource_id)s, %(begin)s - %(end)s, created %(created_at)s'
+                                  % reservation)
+            self.stdout.write('%d overlapping pairs, %d reservations to %s.' % (
+                len(pairs), len(overlapping), 'deny' if options['state'] == Reservation.DENIED else 'cancel'))
+
+            if options['resolve']:
+                Reservation.objects.filter(pk__in=[r['pk'] for r in overlapping]).update(state=options['state'])
+                self.update_free_intervals(overlapping)
+                logger.info('Set %d overlapping reservations as %s' % (len(overlapping), options['state']))
+
+    def update_free_intervals(self, reservations):
+        # The update above doesn't send the save signals which keep the free intervals up to date
+        resource_ranges = {}
+        for reservation in reservations:
+            begin, end = reservation['begin'], reservation['end']
+            if reservation['resource_id'] in resource_ranges:
+                range_begin, range_end = resource_ranges[reservation['resource_id']]
+                begin, end = min(begin, range_begin), max(end, range_end)
+            resource_ranges[reservation['resource_id']] = (begin, end)
+        for resource in Resource.objects.filter(pk__in=resource_ranges):
+            resource.update_free_intervals(*resource_ranges[resource.pk])
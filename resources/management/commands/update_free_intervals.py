@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from resources.models.resource import Resource
+
+import logging
+
+logger = logging.getLogger()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the free interval index of resources'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pk', type=str, nargs='*', help='Resources pk, all resources if not given')
+
+    def handle(self, *args, **options):
+        resources = Resource.objects.all()
+        if options['pk']:
+            resources = resources.filter(pk__in=options['pk'])
+        logger.info('Updating free intervals of %u resources', resources.count())
+        for resource in resources.iterator():
+            resource.update_free_intervals()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from resources.models.resource import ResourcePublishDate
+
+import logging
+
+logger = logging.getLogger()
+
+
+class Command(BaseCommand):
+    help = 'Set public / reservable fields of resources according to their scheduled publish dates'
+
+    def handle(self, *args, **options):
+        count = ResourcePublishDate.objects.update_states()
+        logger.info('Updated publish states of %u resources', count)
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0158_resource_free_intervals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservationreminder',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Sent at'),
+        ),
+        migrations.AddIndex(
+            model_name='reservationreminder',
+            index=models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['reminder_date'], name='resources_reminder_unsent_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+import resources.models.gistindex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0159_reservationreminder_sent_at'),
+    ]
+
+    operations = [
+        # Reservation validation looks up reservations by duration, so it must be set on all of them
+        migrations.RunSQL(
+            sql='UPDATE resources_reservation SET duration = tstzrange("begin", "end", \'[)\') '
+                'WHERE duration IS NULL',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=resources.models.gistindex.GistIndex(fields=['duration'], name='resources_r_duratio_855f1f_gist'),
+        ),
+    ]
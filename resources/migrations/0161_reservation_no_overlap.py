@@ -0,0 +1,46 @@
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+OVERLAPPING_RESERVATIONS_SQL = """
+    SELECT COUNT(*)
+    FROM resources_reservation r1
+    JOIN resources_reservation r2
+        ON r2.resource_id = r1.resource_id AND r2.id > r1.id AND r2.duration && r1.duration
+    WHERE r1.state NOT IN ('cancelled', 'denied') AND r2.state NOT IN ('cancelled', 'denied')
+"""
+
+
+def check_overlapping_reservations(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(OVERLAPPING_RESERVATIONS_SQL)
+        overlapping = cursor.fetchone()[0]
+    if overlapping:
+        raise RuntimeError(
+            'There are %d pairs of overlapping reservations, which must be resolved before the overlap '
+            'constraint can be added. List them with "manage.py resolve_overlapping_reservations" and deny '
+            'all but the earliest created of them with "manage.py resolve_overlapping_reservations --resolve".'
+            % overlapping
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0160_reservation_duration_gist'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.RunPython(check_overlapping_reservations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(
+                condition=models.Q(('state__in', ('cancelled', 'denied')), _negated=True),
+                expressions=[('resource', django.contrib.postgres.fields.ranges.RangeOperators.EQUAL),
+                             ('duration', django.contrib.postgres.fields.ranges.RangeOperators.OVERLAPS)],
+                name='resources_reservation_no_overlap',
+            ),
+        ),
+    ]
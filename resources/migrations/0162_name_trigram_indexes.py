@@ -0,0 +1,26 @@
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+def name_trigram_index(prefix, lang):
+    return django.contrib.postgres.indexes.GinIndex(
+        django.contrib.postgres.indexes.OpClass(
+            django.db.models.functions.text.Upper('name_%s' % lang), name='gin_trgm_ops'
+        ),
+        name='%s_name_%s_trgm' % (prefix, lang),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0161_reservation_no_overlap'),
+    ]
+
+    operations = [TrigramExtension()] + [
+        migrations.AddIndex(model_name=model_name, index=name_trigram_index(model_name, lang))
+        for model_name in ('resource', 'unit')
+        for lang in ('fi', 'en', 'sv')
+    ]
@@ -0,0 +1,50 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import Value
+
+# Frozen copies of resources.models.resource.SEARCH_CONFIGS and
+# get_resource_search_vector at the time of this migration
+SEARCH_CONFIGS = {'fi': 'finnish', 'sv': 'swedish', 'en': 'english'}
+
+
+def get_resource_search_vector(resource, tags):
+    vector = SearchVector(Value(' '.join(tags)), config='simple', weight='A')
+    for lang, config in SEARCH_CONFIGS.items():
+        related_names = [getattr(obj, 'name_%s' % lang) for obj in (resource.unit, resource.type) if obj]
+        texts = (
+            (getattr(resource, 'name_%s' % lang), 'A'),
+            (' '.join(filter(None, related_names)), 'B'),
+            (getattr(resource, 'description_%s' % lang), 'C'),
+        )
+        for text, weight in texts:
+            vector += SearchVector(Value(text or ''), config=config, weight=weight)
+    return vector
+
+
+def update_search_vectors(apps, schema_editor):
+    Resource = apps.get_model('resources', 'Resource')
+    for resource in Resource.objects.select_related('unit', 'type').prefetch_related('resource_tags'):
+        tags = [tag.label for tag in resource.resource_tags.all()]
+        Resource.objects.filter(pk=resource.pk).update(search_vector=get_resource_search_vector(resource, tags))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0162_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='resource',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='resource_search_vector_gin'),
+        ),
+        migrations.RunPython(update_search_vectors, migrations.RunPython.noop),
+    ]
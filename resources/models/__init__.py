@@ -3,12 +3,12 @@ from .availability import Day, Period, get_opening_hours
 from .reservation import (
     ReservationMetadataField, ReservationMetadataSet, ReservationHomeMunicipalityField, ReservationHomeMunicipalitySet,
     Reservation, RESERVATION_EXTRA_FIELDS,
-    ReservationBulk, ReservationReminder, ReservationQuerySet,
+    ReservationBulk, ReservationReminder, ReservationQuerySet, ReservationValidationContext,
 )
 from .resource import (
     Purpose, Resource, ResourceType, ResourceImage, ResourceEquipment, ResourceGroup,
     ResourceDailyOpeningHours, TermsOfUse, ResourceTag, ResourceUniversalField,
-    ResourceUniversalFormOption, ResourcePublishDate
+    ResourceUniversalFormOption, ResourcePublishDate, ResourceFreeInterval
 )
 from .equipment import Equipment, EquipmentAlias, EquipmentCategory
 from .unit import Unit, UnitAuthorization, UnitIdentifier
@@ -28,6 +28,7 @@ __all__ = [
     'Purpose',
     'RESERVATION_EXTRA_FIELDS',
     'Reservation',
+    'ReservationValidationContext',
     'ReservationMetadataField',
     'ReservationMetadataSet',
     'ReservationHomeMunicipalityField',
@@ -39,6 +40,7 @@ __all__ = [
     'ResourceTag',
     'ResourceAccessibility',
     'ResourceDailyOpeningHours',
+    'ResourceFreeInterval',
     'ResourceEquipment',
     'ResourceGroup',
     'ResourceImage',
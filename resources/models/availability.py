@@ -69,39 +69,72 @@ def get_opening_hours(time_zone, periods, begin, end=None):
             p.priority = 0
     periods.sort(key=lambda x: (-x.priority, x.end - x.start))
 
-    days = list(Day.objects.filter(period__in=periods))
+    # Each date of the range is resolved by the first period covering it.
+    # Dates are handled as offsets from the beginning of the range, and
+    # the days of a period as a weekday-indexed list.
+    day_count = (end - begin).days + 1
+    begin_weekday = begin.weekday()
+    resolved = [False] * day_count
+    days_by_offset = [None] * day_count
+    days_by_period = get_period_days(periods)
     for period in periods:
-        period.range_days = {day.weekday: day for day in days if day.period_id == period.id}
+        weekdays = [None] * 7
+        for day in days_by_period.get(period.id, []):
+            weekdays[day.weekday] = day
+        first = max((period.start - begin).days, 0)
+        last = min((period.end - begin).days, day_count - 1)
+        for offset in range(first, last + 1):
+            if resolved[offset]:
+                continue
+            resolved[offset] = True
+            # Currently the 'closed' field of periods do not
+            # always contain sensible data. Ignore it for now.
+            day = weekdays[(begin_weekday + offset) % 7]
+            if day is not None and not day.closed:
+                days_by_offset[offset] = day
 
-    date = begin
     dates = OrderedDict()
-    while date <= end:
+    for offset, day in enumerate(days_by_offset):
+        date = begin + datetime.timedelta(days=offset)
         opens = None
         closes = None
-        for period in periods:
-            if period.start > date or period.end < date:
-                continue
-            # Currently the 'closed' field of periods do not
-            # always contain sensible data. Ignore it for now.
-            if False and period.closed:
-                break
-            day = period.range_days.get(date.weekday())
-            if day is None or day.closed:
-                break
+        if day is not None:
             opens = combine_datetime(date, day.opens, tz)
             closes = combine_datetime(date, day.closes, tz)
             if opens == closes:
                 # The interval is zero-length
                 opens = None
                 closes = None
-            break
-
         dates[date] = [{'opens': opens, 'closes': closes}]
-        date += datetime.timedelta(days=1)
 
     return dates
 
 
+def get_period_days(periods):
+    """
+    Returns the days of the given periods grouped by period id
+
+    Days prefetched with the periods are used as is, the rest are
+    fetched in a single query.
+
+    :rtype : dict[int, list[Day]]
+    :type periods: list[Period]
+    """
+    days_by_period = {}
+    unfetched = []
+    for period in periods:
+        if 'days' in getattr(period, '_prefetched_objects_cache', {}):
+            days_by_period[period.id] = list(period.days.all())
+        else:
+            unfetched.append(period)
+
+    if unfetched:
+        for day in Day.objects.filter(period__in=unfetched):
+            days_by_period.setdefault(day.period_id, []).append(day)
+
+    return days_by_period
+
+
 class Period(models.Model):
     """
     A period of time to express state of open or closed
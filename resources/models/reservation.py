@@ -5,6 +5,7 @@ import pytz
 
 from django.utils import timezone
 import django.contrib.postgres.fields as pgfields
+from django.contrib.postgres.constraints import ExclusionConstraint
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.gis.db import models
@@ -12,7 +13,10 @@ from django.utils import translation
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q, Value
+from django.db.models.deletion import Collector
+from django.db.models.signals import post_save
 from psycopg2.extras import DateTimeTZRange
 
 from notifications.models import NotificationTemplate, NotificationTemplateException, NotificationType, NotificationTemplateGroup
@@ -20,6 +24,7 @@ from resources.signals import (
     reservation_modified, reservation_confirmed, reservation_cancelled
 )
 from .base import ModifiableModel, NameIdentifiedModel
+from .gistindex import GistIndex
 from .resource import generate_access_code, validate_access_code
 from .resource import Resource
 from .utils import (
@@ -47,6 +52,18 @@ RESERVATION_EXTRA_FIELDS = ('reserver_name', 'reserver_phone_number', 'reserver_
                             ) + RESERVATION_BILLING_FIELDS
 
 
+# Prevents overlapping reservations of a resource, except for cancelled and denied ones
+RESERVATION_OVERLAP_CONSTRAINT = 'resources_reservation_no_overlap'
+
+
+def is_reservation_overlap_error(error):
+    """
+    Check if the given IntegrityError was caused by overlapping reservations
+    """
+    diag = getattr(error.__cause__, 'diag', None)
+    return getattr(diag, 'constraint_name', None) == RESERVATION_OVERLAP_CONSTRAINT
+
+
 class ReservationQuerySet(models.QuerySet):
     def current(self):
         return self.exclude(state__in=(Reservation.CANCELLED, Reservation.DENIED))
@@ -95,6 +112,94 @@ class ReservationQuerySet(models.QuerySet):
             if reservation.has_order():
                 order = reservation.get_order()
                 order.set_state('cancelled', 'Order reservation was cancelled.')
+
+    def create_stack(self, reservations, on_commit=False):
+        """
+        Insert new reservations in a single query
+
+        The post_save signal is sent for each reservation afterwards,
+        and the free intervals of the resources are updated once for
+        the whole stack instead of once per reservation.
+
+        :type reservations: list[Reservation]
+        :param on_commit: Send the signals only after the current transaction commits
+        :rtype: list[Reservation]
+        """
+        for reservation in reservations:
+            reservation.prepare_save()
+        reservations = self.bulk_create(reservations)
+
+        self._send_post_save(reservations, created=True, on_commit=on_commit)
+        self._update_free_intervals((r.resource, r.begin, r.end) for r in reservations)
+
+        return reservations
+
+    def update_stack(self, reservations, fields, on_commit=False):
+        """
+        Update the given fields of existing reservations in a single query
+
+        Like with create_stack(), the post_save signal is sent for each
+        reservation afterwards, and the free intervals are updated once
+        per resource, covering both the original and the new times.
+
+        :type reservations: list[Reservation]
+        :type fields: list[str]
+        :param on_commit: Send the signals only after the current transaction commits
+        :rtype: list[Reservation]
+        """
+        originals = self.model.objects.filter(pk__in=[r.pk for r in reservations]).values_list('pk', 'begin', 'end')
+        original_times = {pk: (begin, end) for pk, begin, end in originals}
+        for reservation in reservations:
+            reservation.prepare_save()
+        self.bulk_update(reservations, list(fields) + ['modified_at', 'duration', 'access_code'])
+
+        self._send_post_save(reservations, created=False, on_commit=on_commit)
+        time_ranges = []
+        for reservation in reservations:
+            time_ranges.append((reservation.resource, reservation.begin, reservation.end))
+            if reservation.pk in original_times:
+                time_ranges.append((reservation.resource, *original_times[reservation.pk]))
+        self._update_free_intervals(time_ranges)
+
+        return reservations
+
+    def delete_stack(self, reservations):
+        """
+        Delete the given reservations with a query per related table
+
+        The delete signals are sent for each reservation, but the free
+        intervals of the resources are updated once for the whole stack.
+
+        :type reservations: list[Reservation]
+        """
+        for reservation in reservations:
+            reservation._skip_free_intervals_update = True
+        collector = Collector(using=self.db)
+        collector.collect(reservations)
+        collector.delete()
+        self._update_free_intervals((r.resource, r.begin, r.end) for r in reservations)
+
+    def _send_post_save(self, reservations, created, on_commit):
+        def send():
+            for reservation in reservations:
+                reservation._skip_free_intervals_update = True
+                post_save.send(sender=self.model, instance=reservation, created=created,
+                               update_fields=None, raw=False, using=self.db)
+
+        if on_commit:
+            transaction.on_commit(send, using=self.db)
+        else:
+            send()
+
+    def _update_free_intervals(self, time_ranges):
+        resource_ranges = {}
+        for resource, begin, end in time_ranges:
+            if resource in resource_ranges:
+                range_begin, range_end = resource_ranges[resource]
+                begin, end = min(begin, range_begin), max(end, range_end)
+            resource_ranges[resource] = (begin, end)
+        for resource, (begin, end) in resource_ranges.items():
+            resource.update_free_intervals(begin, end)
 class ReservationBulkQuerySet(models.QuerySet):
     def current(self):
         return self
@@ -217,6 +322,17 @@ class Reservation(ModifiableModel):
         verbose_name = _("reservation")
         verbose_name_plural = _("reservations")
         ordering = ('id',)
+        indexes = [
+            GistIndex(fields=['duration'])
+        ]
+        constraints = [
+            ExclusionConstraint(
+                name=RESERVATION_OVERLAP_CONSTRAINT,
+                expressions=[('resource', pgfields.RangeOperators.EQUAL),
+                             ('duration', pgfields.RangeOperators.OVERLAPS)],
+                condition=~Q(state__in=('cancelled', 'denied')),
+            ),
+        ]
 
     def _save_dt(self, attr, dt):
         """
@@ -443,6 +559,12 @@ class Reservation(ModifiableModel):
         If this reservation isn't yet saved and it will modify an existing reservation,
         the original reservation need to be provided in kwargs as 'original_reservation', so
         that it can be excluded when checking if the resource is available.
+
+        The checks use a ReservationValidationContext of the resource and the user,
+        which can be provided in kwargs as 'context' if it has already been loaded.
+
+        The collision check can be skipped by providing 'check_collision' as False in
+        kwargs, when the caller handles the violations of the overlap constraint instead.
         """
 
         if 'user' in kwargs:
@@ -450,58 +572,37 @@ class Reservation(ModifiableModel):
         else:
             user = self.user
 
-        user_is_admin = user and self.resource.is_admin(user)
-
         if self.end <= self.begin:
             raise ValidationError(_("You must end the reservation after it has begun"))
 
+        context = kwargs.get('context', None)
+        if context is None:
+            context = ReservationValidationContext(self.resource, user, self.begin, self.end)
+        user_is_admin = user and context.user_is_admin
+
         # Check that begin and end times are on valid time slots.
-        opening_hours = self.resource.get_opening_hours(self.begin.date(), self.end.date())
+        opening_hours = context.opening_hours
         for dt in (self.begin, self.end):
             days = opening_hours.get(dt.date(), [])
             day = next((day for day in days if day['opens'] is not None and day['opens'] <= dt <= day['closes']), None)
             if day and not is_valid_time_slot(dt, self.resource.slot_size, day['opens']):
                 raise ValidationError(_("Begin and end time must match time slots"), code='invalid_time_slot')
 
+        original_reservation = self if self.pk else kwargs.get('original_reservation', None)
+
         # Check if Unit has disallow_overlapping_reservations value of True
-        if (
-            self.resource.unit.disallow_overlapping_reservations and not
-            self.resource.can_create_overlapping_reservations(user) and not
-            isinstance(user, AnonymousUser)
-        ):
-            if self.resource.unit.disallow_overlapping_reservations_per_user:
-                reservations_for_same_unit = Reservation.objects.filter(user=user, resource__unit=self.resource.unit)
-            else:
-                reservations_for_same_unit = Reservation.objects.filter(resource__unit=self.resource.unit)
-
-            original = kwargs.get('original_reservation', None)
-            if original:
-                reservations_for_same_unit = reservations_for_same_unit.exclude(id=original.id)
-
-            valid_reservations_for_same_unit = reservations_for_same_unit.exclude(state=Reservation.CANCELLED)
-            user_has_conflicting_reservations = valid_reservations_for_same_unit.filter(
-                Q(begin__gt=self.begin, begin__lt=self.end)
-                | Q(begin__lt=self.begin, end__gt=self.begin)
-                | Q(begin__gte=self.begin, end__lte=self.end)
-                | Q(begin__lte=self.begin, end__gt=self.end)
+        if context.has_unit_overlap(self.begin, self.end, kwargs.get('original_reservation', None)):
+            raise ValidationError(
+                _('This unit does not allow overlapping reservations for its resources'),
+                code='conflicting_reservation'
             )
 
-            if user_has_conflicting_reservations:
-                raise ValidationError(
-                    _('This unit does not allow overlapping reservations for its resources'),
-                    code='conflicting_reservation'
-                )
-
-        original_reservation = self if self.pk else kwargs.get('original_reservation', None)
-        if self.resource.check_reservation_collision(self.begin, self.end, original_reservation):
+        if kwargs.get('check_collision', True) and context.has_collision(self.begin, self.end, original_reservation):
             raise ValidationError({'period': _("The resource is already reserved for some of the period")}, code='invalid_period_range')
 
-
-        user_unit_auth_level = self.resource.unit.get_highest_authorization_level_for_user(user)
-        is_at_least_viewer = user_unit_auth_level >= UnitAuthorizationLevel.viewer if user_unit_auth_level else None
-        
         if self.resource.cooldown:
-            if not is_at_least_viewer and self.resource.check_cooldown_collision(self.begin, self.end, original_reservation):
+            has_cooldown_collision = context.has_cooldown_collision(self.begin, self.end, original_reservation)
+            if not context.user_is_at_least_viewer and has_cooldown_collision:
                 raise ValidationError({ 'cooldown': _("Cannot be reserved during cooldown") }, code='cooldown_collision')
 
         if not user_is_admin:
@@ -857,7 +958,14 @@ class Reservation(ModifiableModel):
     def send_access_code_created_mail(self):
         self.send_reservation_mail(NotificationType.RESERVATION_ACCESS_CODE_CREATED)
 
-    def save(self, *args, **kwargs):
+    def prepare_save(self):
+        """
+        Set the fields calculated on save
+
+        Called by save(), and separately for reservations that are saved
+        without it, e.g. with bulk_create().
+        """
+        self.modified_at = timezone.now()
         self.duration = DateTimeTZRange(self.begin, self.end, '[)')
 
         if not self.access_code:
@@ -865,9 +973,161 @@ class Reservation(ModifiableModel):
             if self.resource.is_access_code_enabled() and self.resource.generate_access_codes:
                 self.access_code = generate_access_code(access_code_type)
 
+    def save(self, *args, **kwargs):
+        self.prepare_save()
         return super().save(*args, **kwargs)
 
 
+class ReservationValidationContext:
+    """
+    Data for validating reservations of a resource, loaded at once
+
+    Covers the reservations of a single resource and user between the
+    given times. The opening hours are fetched when the context is
+    created and the reservations relevant to the collision, cooldown and
+    unit overlap checks in a single query on first use, so the context can
+    be created before the resource is locked for the reservation.
+
+    Reservations validated against the context can be added to it, so that
+    several new reservations get checked against each other as well as
+    against the existing ones.
+    """
+
+    def __init__(self, resource, user, begin, end):
+        self.resource = resource
+        self.user = user
+        self.begin = begin
+        self.end = end
+        unit = resource.unit
+
+        self.user_is_admin = bool(user and resource.is_admin(user))
+        user_unit_auth_level = self._get_unit_authorization_level(unit, user)
+        self.user_is_at_least_viewer = (
+            user_unit_auth_level >= UnitAuthorizationLevel.viewer if user_unit_auth_level else None)
+
+        # Reservation.clean() and Resource.validate_reservation_period() look up
+        # the hours by dates in different time zones, so include a day of margin
+        self.opening_hours = resource.get_opening_hours(
+            begin.date() - datetime.timedelta(days=1), end.date() + datetime.timedelta(days=1))
+
+        self.check_unit_overlap = bool(
+            unit.disallow_overlapping_reservations and not
+            resource.can_create_overlapping_reservations(user) and not
+            isinstance(user, AnonymousUser)
+        )
+        self._reservations = None
+        self._unit_reservations = None
+
+    @staticmethod
+    def _get_unit_authorization_level(unit, user):
+        """
+        Same as Unit.get_highest_authorization_level_for_user()
+
+        Uses the unit authorizations of the user, which are usually
+        already prefetched.
+        """
+        if not user or not user.is_authenticated or user.is_anonymous:
+            return None
+        if user.is_superuser:
+            return UnitAuthorizationLevel.admin
+        unit_auths = [auth for auth in user.unit_authorizations.all() if auth.subject_id == unit.pk]
+        return max(unit_auths).level if unit_auths else None
+
+    def _load_reservations(self):
+        resource = self.resource
+        unit = resource.unit
+        cooldown = resource.cooldown or datetime.timedelta(0)
+
+        resource_query = Q(
+            resource=resource, end__gte=timezone.now(),
+            duration__overlap=(self.begin - cooldown, self.end + cooldown, '[)'),
+        ) & ~Q(state__in=(Reservation.CANCELLED, Reservation.DENIED))
+        query = resource_query
+        if self.check_unit_overlap:
+            unit_query = Q(resource__unit=unit, duration__overlap=(self.begin, self.end, '[)'))
+            unit_query &= ~Q(state=Reservation.CANCELLED)
+            if unit.disallow_overlapping_reservations_per_user:
+                unit_query &= Q(user=self.user)
+            query |= unit_query
+            in_unit = ExpressionWrapper(unit_query, output_field=BooleanField())
+        else:
+            in_unit = Value(False, output_field=BooleanField())
+
+        reservations = Reservation.objects.filter(query).annotate(
+            in_resource=ExpressionWrapper(resource_query, output_field=BooleanField()),
+            in_unit=in_unit,
+        ).values('id', 'begin', 'end', 'type', 'in_resource', 'in_unit')
+
+        self._reservations = []
+        self._unit_reservations = [] if self.check_unit_overlap else None
+        for values in reservations:
+            if values.pop('in_resource'):
+                self._reservations.append(values)
+            if values.pop('in_unit'):
+                self._unit_reservations.append(values)
+
+    @property
+    def reservations(self):
+        if self._reservations is None:
+            self._load_reservations()
+        return self._reservations
+
+    @property
+    def unit_reservations(self):
+        if self._reservations is None:
+            self._load_reservations()
+        return self._unit_reservations
+
+    def add(self, reservation):
+        values = {'id': reservation.pk, 'begin': reservation.begin, 'end': reservation.end, 'type': reservation.type}
+        self.reservations.append(values)
+        if self.unit_reservations is not None:
+            self.unit_reservations.append(values)
+
+    def _exclude(self, reservations, original_reservation):
+        if not original_reservation or not original_reservation.pk:
+            return reservations
+        return [r for r in reservations if r['id'] != original_reservation.pk]
+
+    def has_collision(self, begin, end, original_reservation=None):
+        """
+        Same as Resource.check_reservation_collision()
+        """
+        return any(
+            r['end'] > begin and r['begin'] < end
+            for r in self._exclude(self.reservations, original_reservation)
+        )
+
+    def has_cooldown_collision(self, begin, end, original_reservation=None):
+        """
+        Same as Resource.check_cooldown_collision()
+        """
+        cooldown_start = begin - self.resource.cooldown
+        cooldown_end = end + self.resource.cooldown
+        return any(
+            cooldown_start < r['begin'] < cooldown_end or
+            cooldown_start < r['end'] < cooldown_end or
+            (r['begin'] < cooldown_start and r['end'] > begin) or
+            (r['begin'] < end and r['end'] > cooldown_end)
+            for r in self._exclude(self.reservations, original_reservation)
+            if r['type'] != Reservation.TYPE_BLOCKED
+        )
+
+    def has_unit_overlap(self, begin, end, original_reservation=None):
+        """
+        Check the disallow_overlapping_reservations rule of the unit
+        """
+        if self.unit_reservations is None:
+            return False
+        return any(
+            begin < r['begin'] < end or
+            (r['begin'] < begin and r['end'] > begin) or
+            (r['begin'] >= begin and r['end'] <= end) or
+            (r['begin'] <= begin and r['end'] > end)
+            for r in self._exclude(self.unit_reservations, original_reservation)
+        )
+
+
 class ReservationMetadataField(models.Model):
     field_name = models.CharField(max_length=100, verbose_name=_('Field name'), unique=True)
 
@@ -999,12 +1259,23 @@ class ReservationHomeMunicipalitySet(ModifiableModel):
             return ["Example1", "Example2"]
         return sample(items, 2)
 class ReservationReminderQuerySet(models.QuerySet):
-    pass
+    def unsent(self):
+        return self.filter(sent_at__isnull=True)
+
+    def due(self, dt=None):
+        """
+        Unsent reminders of confirmed reservations whose reminder date has passed
+        """
+        if dt is None:
+            dt = timezone.now()
+        return self.unsent().filter(reminder_date__lte=dt, reservation__state=Reservation.CONFIRMED)
+
 
 class ReservationReminder(models.Model):
     reservation = models.ForeignKey('Reservation', verbose_name=_('Reservation'), db_index=True, related_name='Reservations',
                                  on_delete=models.CASCADE)
     reminder_date = models.DateTimeField(verbose_name=_('Reminder date'))
+    sent_at = models.DateTimeField(verbose_name=_('Sent at'), null=True, blank=True, editable=False)
 
 
     objects = ReservationReminderQuerySet.as_manager()
@@ -1012,12 +1283,10 @@ class ReservationReminder(models.Model):
     class Meta:
         verbose_name = _('Reservation reminder')
         verbose_name_plural = _('Reservation reminders')
-
-    def get_unix_timestamp(self):
-        unix_epoch = datetime.datetime(year=1970, month=1, day=1, hour=0, minute=0, second=0)
-        time_diff = self.reminder_date.replace(tzinfo=pytz.timezone('Europe/Helsinki')) - unix_epoch.replace(tzinfo=pytz.timezone('Europe/Helsinki'))
-        return int(time_diff.total_seconds())
-
+        indexes = [
+            models.Index(fields=['reminder_date'], name='resources_reminder_unsent_idx',
+                         condition=Q(sent_at__isnull=True)),
+        ]
 
     def remind(self):
         self.reservation.send_reservation_mail(
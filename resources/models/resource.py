@@ -8,7 +8,7 @@ from decimal import Decimal
 
 import arrow
 import django.db.models as dbm
-from django.db.models import Q
+from django.db.models import Q, Value
 from django.apps import apps
 from django.conf import settings
 from django.contrib.gis.db import models
@@ -23,18 +23,20 @@ from six import BytesIO
 from django.utils.text import format_lazy
 from django.utils.translation import pgettext_lazy, gettext_lazy as _
 from django.contrib.postgres.fields import DateTimeRangeField
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models.functions import Upper
 from .gistindex import GistIndex
 from image_cropping import ImageRatioField
 from PIL import Image
-from guardian.shortcuts import get_objects_for_user, get_users_with_perms
-from guardian.core import ObjectPermissionChecker
+from guardian.shortcuts import get_users_with_perms
 
 
 from taggit.managers import TaggableManager
 from taggit.models import CommonGenericTaggedItemBase, TaggedItemBase
 
 from ..auth import (
-    is_authenticated_user, is_general_admin,
+    PermissionSnapshot, is_authenticated_user, is_general_admin,
     is_underage, is_overage
 )
 from ..errors import InvalidImage
@@ -101,6 +103,30 @@ def determine_hours_time_range(begin, end, tz):
     return begin, end
 
 
+# Text search configurations of the translated fields
+SEARCH_CONFIGS = {'fi': 'finnish', 'sv': 'swedish', 'en': 'english'}
+
+
+def get_resource_search_vector(resource, tags):
+    """
+    Return the full-text search vector of a resource
+
+    Names and tags weigh the most, then unit and type names and last the
+    descriptions. Tags are not in any language, so they are not stemmed.
+    """
+    vector = SearchVector(Value(' '.join(tags)), config='simple', weight='A')
+    for lang, config in SEARCH_CONFIGS.items():
+        related_names = [getattr(obj, 'name_%s' % lang) for obj in (resource.unit, resource.type) if obj]
+        texts = (
+            (getattr(resource, 'name_%s' % lang), 'A'),
+            (' '.join(filter(None, related_names)), 'B'),
+            (getattr(resource, 'description_%s' % lang), 'C'),
+        )
+        for text, weight in texts:
+            vector += SearchVector(Value(text or ''), config=config, weight=weight)
+    return vector
+
+
 class ResourceTag(AutoIdentifiedModel):
     label = models.CharField(verbose_name=_('Tag label'), max_length=255)
     resource = models.ForeignKey('Resource', on_delete=models.CASCADE, related_name='resource_tags')
@@ -170,10 +196,17 @@ class TermsOfUse(ModifiableModel, AutoIdentifiedModel):
 
 
 class ResourceQuerySet(models.QuerySet):
-    def visible_for(self, user):
+    def update_search_vectors(self):
+        resources = self.select_related('unit', 'type').prefetch_related('resource_tags')
+        for resource in resources:
+            tags = [tag.label for tag in resource.resource_tags.all()]
+            Resource.objects.filter(pk=resource.pk).update(search_vector=get_resource_search_vector(resource, tags))
+
+    def visible_for(self, user, snapshot=None):
         if is_general_admin(user):
             return self
-        is_in_managed_units = Q(unit__in=Unit.objects.managed_by(user))
+        snapshot = snapshot or PermissionSnapshot(user)
+        is_in_managed_units = Q(unit__in=snapshot.get_managed_unit_ids())
         is_public = Q(_public=True)
         return self.filter(is_in_managed_units | is_public)
 
@@ -187,16 +220,18 @@ class ResourceQuerySet(models.QuerySet):
         units = Unit.objects.managed_by(user)
         return self.filter(unit__in=units)
 
-    def with_perm(self, perm, user):
-        units = get_objects_for_user(user, 'unit:%s' % perm, klass=Unit,
-                                     with_superuser=False)
-        resource_groups = get_objects_for_user(user, 'group:%s' % perm, klass=ResourceGroup,
-                                               with_superuser=False)
-
-        allowed_roles = UNIT_ROLE_PERMISSIONS.get(perm)
-        units_where_role = Unit.objects.by_roles(user, allowed_roles)
+    def with_perm(self, perm, user, snapshot=None):
+        snapshot = snapshot or PermissionSnapshot(user)
+        allowed_roles = UNIT_ROLE_PERMISSIONS.get(perm, ())
+        resource_groups = snapshot.get_object_pks_with_perm('group:%s' % perm, ResourceGroup)
+        if snapshot.has_role_in_all_units(allowed_roles):
+            in_units = Q(unit__isnull=False)
+        else:
+            units = snapshot.get_object_pks_with_perm('unit:%s' % perm, Unit)
+            units |= snapshot.get_unit_ids_with_roles(allowed_roles)
+            in_units = Q(unit__in=units)
 
-        return self.filter(Q(unit__in=list(units) + list(units_where_role)) | Q(groups__in=resource_groups)).distinct()
+        return self.filter(in_units | Q(groups__in=resource_groups)).distinct()
 
     def external(self):
         return self.filter(is_external=True)
@@ -216,16 +251,6 @@ class ResourceQuerySet(models.QuerySet):
     def restore(self):
         self.update(soft_deleted=False)
 
-    def _refresh_publish_date_states(self):
-        """Set resource public / reservable field according to publish_date value"""
-        try:
-            for resource in self:
-                if resource.publish_date:
-                    resource.publish_date._update_states()
-        except:
-            pass
-        return self
-
     def get_publish_dates(self) -> list:
         return [resource.publish_date
                 for resource in self
@@ -239,10 +264,8 @@ class ResourceManager(models.Manager):
     def get_queryset(self, **kwargs):
         if getattr(self, '_include_soft_deleted', False):
             setattr(self, '_include_soft_deleted', False)
-            return super().get_queryset() \
-                    ._refresh_publish_date_states()
-        return super().get_queryset().exclude(soft_deleted=True) \
-            ._refresh_publish_date_states()
+            return super().get_queryset()
+        return super().get_queryset().exclude(soft_deleted=True)
 
     @property
     def with_soft_deleted(self):
@@ -411,12 +434,20 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
 
     soft_deleted = models.BooleanField(verbose_name=_('Soft deleted resource'), default=False, blank=True)
 
+    # Updated on changes to the resource, its unit, type and tags
+    search_vector = SearchVectorField(null=True, editable=False)
+
     objects = ResourceManager.from_queryset(ResourceQuerySet)()
 
     class Meta:
         verbose_name = _("resource")
         verbose_name_plural = _("resources")
         ordering = ('unit', 'name',)
+        # Case-insensitive name searches of the typeahead API
+        indexes = [
+            GinIndex(OpClass(Upper('name_%s' % lang[0]), name='gin_trgm_ops'), name='resource_name_%s_trgm' % lang[0])
+            for lang in settings.LANGUAGES
+        ] + [GinIndex(fields=['search_vector'], name='resource_search_vector_gin')]
 
     def __str__(self):
         return "%s (%s)/%s" % (get_translated(self, 'name'), self.id, self.unit)
@@ -460,7 +491,7 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
                 or self.unit.get_disabled_fields()
         return disabled_fields
 
-    def validate_reservation_period(self, reservation, user, data=None):
+    def validate_reservation_period(self, reservation, user, data=None, opening_hours=None):
         """
         Check that given reservation if valid for given user.
 
@@ -478,6 +509,8 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
         :type reservation: Reservation
         :type user: User
         :type data: dict[str, Object]
+        :param opening_hours: preloaded opening hours covering the reservation
+        :type opening_hours: dict[datetime.date, list[dict[str, datetime.datetime]]] | None
         """
 
         # no restrictions for staff
@@ -519,7 +552,8 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
                 raise ValidationError(_("Reservation start and end must match the given overnight reservation start and end values"))
 
         if not self.can_ignore_opening_hours(user):
-            opening_hours = self.get_opening_hours(begin.date(), end.date())
+            if opening_hours is None:
+                opening_hours = self.get_opening_hours(begin.date(), end.date())
             days = opening_hours.get(begin.date(), None)
             if not is_multiday_reservation and (days is None or not any(day['opens'] and begin >= day['opens'] and end <= day['closes'] for day in days)):
                 raise ValidationError(_("You must start and end the reservation during opening hours"))
@@ -528,7 +562,7 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
             raise ValidationError(_("The maximum reservation length is %(max_period)s") %
                                   {'max_period': humanize_duration(self.max_period)})
 
-    def validate_max_reservations_per_user(self, user):
+    def validate_max_reservations_per_user(self, user, reservation_count=None):
         """
         Check maximum number of active reservations per user per resource.
         If the user has too many reservations raises ValidationError.
@@ -536,13 +570,16 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
         Staff members have no reservation limits.
 
         :type user: User
+        :param reservation_count: number of active reservations of the user, if already known
+        :type reservation_count: int | None
         """
         if self.can_ignore_max_reservations_per_user(user):
             return
 
         max_count = self.max_reservations_per_user
         if max_count is not None:
-            reservation_count = self.reservations.filter(user=user).active().count()
+            if reservation_count is None:
+                reservation_count = self.reservations.filter(user=user).active().count()
             if reservation_count >= max_count:
                 raise ValidationError(_("Maximum number of active reservations for this resource exceeded."))
 
@@ -691,15 +728,60 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
 
         return opening_hours
 
-    def update_opening_hours(self):
+    def update_opening_hours(self, begin=None, end=None, unit_periods=None):
+        """
+        Recalculate the daily opening hours of the resource
+
+        By default all opening hours are recalculated. If `begin` or `end`
+        dates are given, only the opening hours starting on the dates
+        between them (inclusive) are recalculated.
+
+        :type begin: datetime.date | None
+        :type end: datetime.date | None
+        :param unit_periods: periods of the unit, with days prefetched,
+                             when updating several resources of a unit
+        :type unit_periods: list[Period] | None
+        """
+        existing_hours = self._get_existing_opening_hours(begin, end)
+        all_periods = self._get_prioritized_periods(unit_periods)
+        date_range = self._get_periods_date_range(all_periods, begin, end)
+
+        # Assume we delete everything, but remove items from the delete
+        # list if the hours are identical.
+        to_delete = existing_hours
+        to_add = {}
+        if date_range is not None:
+            hours = get_opening_hours(self.unit.time_zone, all_periods, *date_range)
+            to_add = self._diff_opening_hours(to_delete, hours)
+
+        self._save_opening_hours_changes(to_delete, to_add)
+
+        changed = list(to_delete.items()) + list(to_add.items())
+        if changed:
+            self.update_free_intervals(min(opens for opens, closes in changed),
+                                       max(closes for opens, closes in changed))
+
+    def _get_existing_opening_hours(self, begin=None, end=None):
+        """
+        Return the saved opening hours starting on the given dates as a dict of opens -> closes
+        """
         hours = self.opening_hours.order_by('open_between')
+        if begin is not None or end is not None:
+            tz = pytz.timezone(self.unit.time_zone)
+            range_begin, range_end = determine_hours_time_range(begin or end, end or begin, tz)
+            hours = hours.filter(open_between__startswith__gte=range_begin,
+                                 open_between__startswith__lt=range_end)
         existing_hours = {}
         for h in hours:
             assert h.open_between.lower not in existing_hours
             existing_hours[h.open_between.lower] = h.open_between.upper
+        return existing_hours
 
-        unit_periods = list(self.unit.periods.all())
-        resource_periods = list(self.periods.all())
+    def _get_prioritized_periods(self, unit_periods=None):
+        if unit_periods is None:
+            unit_periods = self.unit.periods.prefetch_related('days')
+        unit_periods = list(unit_periods)
+        resource_periods = list(self.periods.prefetch_related('days'))
 
         # Periods set for the resource always carry a higher priority. If
         # nothing is defined for the resource for a given day, use the
@@ -708,32 +790,41 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
             period.priority = 0
         for period in resource_periods:
             period.priority = 1
+        return unit_periods + resource_periods
 
-        earliest_date = None
-        latest_date = None
-        all_periods = unit_periods + resource_periods
-        for period in all_periods:
-            if earliest_date is None or period.start < earliest_date:
-                earliest_date = period.start
-            if latest_date is None or period.end > latest_date:
-                latest_date = period.end
+    def _get_periods_date_range(self, periods, begin=None, end=None):
+        """
+        Return the first and last date of the periods limited to the given dates, or None if there are none
+        """
+        if not periods:
+            return None
+        earliest_date = min(period.start for period in periods)
+        latest_date = max(period.end for period in periods)
+        if begin is not None or end is not None:
+            earliest_date = max(earliest_date, begin or end)
+            latest_date = min(latest_date, end or begin)
+            if earliest_date > latest_date:
+                return None
+        return earliest_date, latest_date
+
+    def _diff_opening_hours(self, to_delete, hours):
+        """
+        Return the calculated opening hours which are not saved yet
 
-        # Assume we delete everything, but remove items from the delete
-        # list if the hours are identical.
-        to_delete = existing_hours
+        The saved opening hours which are also calculated are removed from `to_delete`.
+        """
         to_add = {}
-        if all_periods:
-            hours = get_opening_hours(self.unit.time_zone, all_periods,
-                                      earliest_date, latest_date)
-            for hours_items in hours.values():
-                for h in hours_items:
-                    if not h['opens'] or not h['closes']:
-                        continue
-                    if h['opens'] in to_delete and h['closes'] == to_delete[h['opens']]:
-                            del to_delete[h['opens']]
-                            continue
-                    to_add[h['opens']] = h['closes']
+        for hours_items in hours.values():
+            for h in hours_items:
+                if not h['opens'] or not h['closes']:
+                    continue
+                if h['opens'] in to_delete and h['closes'] == to_delete[h['opens']]:
+                    del to_delete[h['opens']]
+                    continue
+                to_add[h['opens']] = h['closes']
+        return to_add
 
+    def _save_opening_hours_changes(self, to_delete, to_add):
         if to_delete:
             ret = ResourceDailyOpeningHours.objects.filter(
                 open_between__in=[(opens, closes, '[)') for opens, closes in to_delete.items()],
@@ -748,6 +839,73 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
         if add_objs:
             ResourceDailyOpeningHours.objects.bulk_create(add_objs)
 
+    def update_free_intervals(self, begin=None, end=None):
+        """
+        Recalculate the free intervals of the resource
+
+        Free intervals are the parts of the daily opening hours that are
+        not covered by current reservations. Only the opening hours that
+        overlap the given time range are recalculated. If no range is
+        given, all free intervals of the resource are recalculated.
+
+        :type begin: datetime.datetime | None
+        :type end: datetime.datetime | None
+        """
+        hours = self.opening_hours.order_by('open_between')
+        if begin is not None and end is not None:
+            hours = list(hours.filter(open_between__overlap=(begin, end, '[)')))
+            if hours:
+                begin = min(begin, hours[0].open_between.lower)
+                end = max(end, hours[-1].open_between.upper)
+            self.free_intervals.filter(free_between__overlap=(begin, end, '[)')).delete()
+        else:
+            hours = list(hours)
+            self.free_intervals.all().delete()
+
+        if not hours:
+            return
+
+        reservations = list(self.reservations.filter(
+            begin__lt=hours[-1].open_between.upper, end__gt=hours[0].open_between.lower
+        ).current().order_by('begin').values_list('begin', 'end'))
+
+        add_objs = [
+            ResourceFreeInterval(resource=self, free_between=(free_begin, free_end, '[)'))
+            for h in hours
+            for free_begin, free_end in self._get_free_ranges(h.open_between, reservations)
+        ]
+        if add_objs:
+            ResourceFreeInterval.objects.bulk_create(add_objs)
+
+    def _get_free_ranges(self, open_between, reservations):
+        """
+        Return the (begin, end) ranges of the opening hours not covered by the reservations
+
+        :type reservations: list[tuple[datetime.datetime, datetime.datetime]] sorted by begin
+        """
+        current = open_between.lower
+        closes = open_between.upper
+        ranges = []
+        for reservation_begin, reservation_end in reservations:
+            if reservation_begin >= closes:
+                break
+            if reservation_end <= current:
+                continue
+            if reservation_begin > current:
+                ranges.append((current, reservation_begin))
+            current = reservation_end
+            if current >= closes:
+                break
+        if current < closes:
+            ranges.append((current, closes))
+        return ranges
+
+    def _get_permission_snapshot(self, user):
+        snapshot = getattr(self, '_permission_snapshot', None)
+        if snapshot is None or not snapshot.is_for(user):
+            snapshot = PermissionSnapshot(user)
+        return snapshot
+
     def is_admin(self, user):
         """
         Check if the given user is an administrator of this resource.
@@ -757,9 +915,9 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
         """
         # UserFilterBackend and ReservationFilterSet in resources.api.reservation assume the same behaviour,
         # so if this is changed those need to be changed as well.
-        if not self.unit:
+        if not self.unit_id:
             return is_general_admin(user)
-        return self.unit.is_admin(user)
+        return self._get_permission_snapshot(user).is_unit_admin(self.unit_id)
 
     def is_manager(self, user):
         """
@@ -768,9 +926,9 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
         :type user: users.models.User
         :rtype: bool
         """
-        if not self.unit:
+        if not self.unit_id:
             return False
-        return self.unit.is_manager(user)
+        return self._get_permission_snapshot(user).is_unit_manager(self.unit_id)
 
     def is_viewer(self, user):
         """
@@ -779,15 +937,16 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
         :type user: users.models.User
         :rtype: bool
         """
-        if not self.unit:
+        if not self.unit_id:
             return False
-        return self.unit.is_viewer(user)
+        return self._get_permission_snapshot(user).is_unit_viewer(self.unit_id)
 
     def _has_perm(self, user, perm, allow_admin=True):
         if not is_authenticated_user(user):
             return False
 
-        if (self.is_admin(user) and allow_admin) or user.is_superuser:
+        snapshot = self._get_permission_snapshot(user)
+        if (allow_admin and snapshot.is_unit_admin(self.unit_id)) or user.is_superuser:
             return True
 
         if self.min_age and is_underage(user, self.min_age):
@@ -796,39 +955,20 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
         if self.max_age and is_overage(user, self.max_age):
             return False
 
-        if self.unit.is_manager(user) or self.unit.is_admin(user):
+        if snapshot.is_unit_manager(self.unit_id) or snapshot.is_unit_admin(self.unit_id):
             return True
 
-        return self._has_role_perm(user, perm) or self._has_explicit_perm(user, perm, allow_admin)
-
-    def _has_explicit_perm(self, user, perm, allow_admin=True):
-        if hasattr(self, '_permission_checker'):
-            checker = self._permission_checker
-        else:
-            checker = ObjectPermissionChecker(user)
+        return self._has_role_perm(snapshot, perm) or self._has_explicit_perm(snapshot, perm)
 
+    def _has_explicit_perm(self, snapshot, perm):
         # Permissions can be given per-unit
-        if checker.has_perm('unit:%s' % perm, self.unit):
+        if snapshot.has_object_perm('unit:%s' % perm, Unit, self.unit_id):
             return True
         # ... or through Resource Groups
-        resource_group_perms = [checker.has_perm('group:%s' % perm, rg) for rg in self.groups.all()]
-        return any(resource_group_perms)
-
-    def _has_role_perm(self, user, perm):
-        allowed_roles = UNIT_ROLE_PERMISSIONS.get(perm)
-        is_allowed = False
-
-        if (UnitAuthorizationLevel.admin in allowed_roles
-            or UnitGroupAuthorizationLevel.admin in allowed_roles) and not is_allowed:
-            is_allowed = self.is_admin(user)
-
-        if UnitAuthorizationLevel.manager in allowed_roles and not is_allowed:
-            is_allowed = self.is_manager(user)
+        return any(snapshot.has_object_perm('group:%s' % perm, ResourceGroup, rg.pk) for rg in self.groups.all())
 
-        if UnitAuthorizationLevel.viewer in allowed_roles and not is_allowed:
-            is_allowed = self.is_viewer(user)
-
-        return is_allowed
+    def _has_role_perm(self, snapshot, perm):
+        return snapshot.has_role(self.unit_id, UNIT_ROLE_PERMISSIONS.get(perm, ()))
 
     def get_users_with_perm(self, perm):
         users = {u for u in get_users_with_perms(self.unit) if u.has_perm('unit:%s' % perm, self.unit)}
@@ -1057,6 +1197,33 @@ class Resource(ModifiableModel, AutoIdentifiedModel, ValidatedIdentifier):
         self.soft_deleted = False
         return self.save()
 
+
+class ResourcePublishDateQuerySet(models.QuerySet):
+    def public_at(self, dt):
+        """Publish dates whose resource should be public at the given time"""
+        return self.filter(
+            (Q(begin__isnull=True) | Q(begin__lt=dt)) & (Q(end__isnull=True) | Q(end__gt=dt))
+        )
+
+    def with_outdated_states(self, dt=None):
+        """Publish dates whose resource public / reservable fields don't match the given time"""
+        if dt is None:
+            dt = timezone.now()
+        public = Q(pk__in=self.public_at(dt).values('pk'))
+        return self.filter(
+            (public & Q(resource___public=False)) |
+            (~public & Q(resource___public=True)) |
+            ~Q(resource__reservable=dbm.F('reservable'))
+        )
+
+    def update_states(self):
+        """Set resource public / reservable fields of the outdated publish dates"""
+        publish_dates = list(self.with_outdated_states().select_related('resource'))
+        for publish_date in publish_dates:
+            publish_date._update_states()
+        return len(publish_dates)
+
+
 class ResourcePublishDate(models.Model):
     begin = models.DateTimeField(
         verbose_name=_('Begin time'),
@@ -1079,6 +1246,7 @@ class ResourcePublishDate(models.Model):
         on_delete=models.CASCADE
     )
 
+    objects = ResourcePublishDateQuerySet.as_manager()
 
     def clean(self):
         if not self.begin and not self.end:
@@ -1115,7 +1283,6 @@ class ResourcePublishDate(models.Model):
 
     @property
     def public(self):
-        self._update_states()
         return self._get_public()
 
 
@@ -1384,3 +1551,22 @@ class ResourceDailyOpeningHours(models.Model):
             lower = self.open_between.lower
             upper = self.open_between.upper
         return "%s: %s -> %s" % (self.resource, lower, upper)
+
+
+class ResourceFreeInterval(models.Model):
+    """
+    Calculated automatically from the daily opening hours and the
+    current reservations of the resource
+    """
+    resource = models.ForeignKey(
+        Resource, related_name='free_intervals', on_delete=models.CASCADE, db_index=True
+    )
+    free_between = DateTimeRangeField()
+
+    class Meta:
+        indexes = [
+            GistIndex(fields=['free_between'])
+        ]
+
+    def __str__(self):
+        return "%s: %s -> %s" % (self.resource, self.free_between.lower, self.free_between.upper)
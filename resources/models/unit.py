@@ -2,6 +2,8 @@ import pytz
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
 from django.contrib.gis.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models.functions import Upper
 from django.db.models import Q
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -141,6 +143,11 @@ class Unit(ModifiableModel, AutoIdentifiedModel):
         verbose_name_plural = _("units")
         permissions = UNIT_PERMISSIONS
         ordering = ('name',)
+        # Case-insensitive name searches of the typeahead API
+        indexes = [
+            GinIndex(OpClass(Upper('name_%s' % lang[0]), name='gin_trgm_ops'), name='unit_name_%s_trgm' % lang[0])
+            for lang in settings.LANGUAGES
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -168,9 +175,11 @@ class Unit(ModifiableModel, AutoIdentifiedModel):
         """
         return get_opening_hours(self.time_zone, list(self.periods.all()), begin, end)
 
-    def update_opening_hours(self):
-        for res in self.resources.all():
-            res.update_opening_hours()
+    def update_opening_hours(self, begin=None, end=None):
+        # Unit periods are shared by all the resources, so fetch them only once.
+        unit_periods = list(self.periods.prefetch_related('days'))
+        for res in self.resources.select_related('unit'):
+            res.update_opening_hours(begin, end, unit_periods=unit_periods)
 
     def get_tz(self):
         return pytz.timezone(self.time_zone)
@@ -1,4 +1,5 @@
 import base64
+import csv
 import datetime
 from decimal import Decimal, ROUND_HALF_UP
 import struct
@@ -15,6 +16,7 @@ from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.contrib.admin.models import LogEntry, ADDITION, CHANGE, ContentType
+from django.db import transaction
 from django.utils.translation import gettext, ngettext, gettext_lazy as _
 from django.utils.text import format_lazy
 from django.utils import timezone
@@ -113,18 +115,47 @@ def humanize_duration(duration):
 notification_logger = logging.getLogger('respa.notifications')
 
 
+def get_respa_mail_from_address():
+    return (getattr(settings, 'RESPA_MAILS_FROM_ADDRESS', None) or
+            'noreply@%s' % Site.objects.get_current().domain)
+
+
+def deliver_respa_mail(email_address, subject, body, html_body=None, attachments=None, connection=None):
+    """
+    Send a mail immediately, raising on failure
+    """
+    text_content = body
+    msg = EmailMultiAlternatives(subject, text_content, get_respa_mail_from_address(), [email_address],
+                                 attachments=attachments, connection=connection)
+    if html_body:
+        msg.attach_alternative(html_body, 'text/html')
+    msg.send()
+
+
+def deliver_respa_sms(phone_number, subject, short_message, connection=None):
+    """
+    Send a SMS immediately, raising on failure
+    """
+    sms = EmailMultiAlternatives(subject, short_message, get_respa_mail_from_address(),
+                                 [f'{phone_number}@{settings.GSM_NOTIFICATION_ADDRESS}'], connection=connection)
+    sms.send()
+
+
+def is_notification_outbox_enabled():
+    return getattr(settings, 'RESPA_NOTIFICATION_OUTBOX_ENABLED', False)
+
+
 def send_respa_mail(email_address, subject, body, html_body=None, attachments=None) -> RespaNotificationAction:
     if not getattr(settings, 'RESPA_MAILS_ENABLED', False):
         notification_logger.info('Respa mail is not enabled.')
     try:
-        from_address = (getattr(settings, 'RESPA_MAILS_FROM_ADDRESS', None) or
-                        'noreply@%s' % Site.objects.get_current().domain)
-
-        text_content = body
-        msg = EmailMultiAlternatives(subject, text_content, from_address, [email_address], attachments=attachments)
-        if html_body:
-            msg.attach_alternative(html_body, 'text/html')
-        msg.send()
+        if is_notification_outbox_enabled():
+            from notifications.models import NotificationOutboxMessage
+            # A failed insert must not abort the transaction of the caller
+            with transaction.atomic():
+                NotificationOutboxMessage.objects.enqueue_mail(email_address, subject, body, html_body, attachments)
+        else:
+            deliver_respa_mail(email_address, subject, body, html_body, attachments)
         return RespaNotificationAction.EMAIL
     except Exception as exc:
         notification_logger.error('Respa mail error %s', exc)
@@ -134,15 +165,40 @@ def send_respa_sms(phone_number, subject, short_message) -> RespaNotificationAct
     if not getattr(settings, 'RESPA_SMS_ENABLED', False):
         notification_logger.info('Respa SMS is not enabled.')
     try:
-        from_address = (getattr(settings, 'RESPA_MAILS_FROM_ADDRESS', None) or
-                        'noreply@%s' % Site.objects.get_current().domain)
-        sms = EmailMultiAlternatives(subject, short_message, from_address, [f'{phone_number}@{settings.GSM_NOTIFICATION_ADDRESS}'])
-        sms.send()
+        if is_notification_outbox_enabled():
+            from notifications.models import NotificationOutboxMessage
+            # A failed insert must not abort the transaction of the caller
+            with transaction.atomic():
+                NotificationOutboxMessage.objects.enqueue_sms(phone_number, subject, short_message)
+        else:
+            deliver_respa_sms(phone_number, subject, short_message)
         return RespaNotificationAction.SMS
     except Exception as exc:
         notification_logger.error('Respa SMS error %s', exc)
 
 
+def clean_spreadsheet_value(string):
+    """
+    Make a value safe to write into a spreadsheet cell
+
+    Strings starting with characters that would turn them into formulas
+    are stripped of those characters.
+    """
+    if not string:
+        return ''
+
+    if isinstance(string, dict):
+        string = next(iter(string.items()))[1]
+
+    if not isinstance(string, str):
+        return string
+
+    unallowed_characters = ['=', '+', '-', '"', '@']
+    if string[0] in unallowed_characters:
+        string = string[1:]
+    return string
+
+
 def generate_reservation_xlsx(reservations, **kwargs):
     """
     Return reservations in Excel xlsx format
@@ -160,20 +216,7 @@ def generate_reservation_xlsx(reservations, **kwargs):
     :rtype: bytes
     """
     from resources.models import Resource, Reservation, RESERVATION_EXTRA_FIELDS
-    def clean(string):
-        if not string:
-            return ''
-
-        if isinstance(string, dict):
-            string = next(iter(string.items()))[1]
-
-        if not isinstance(string, str):
-            return string
-
-        unallowed_characters = ['=', '+', '-', '"', '@']
-        if string[0] in unallowed_characters:
-            string = string[1:]
-        return string
+    clean = clean_spreadsheet_value
 
     request = kwargs.get('request', None)
     weekdays = kwargs.get('weekdays', None)
@@ -382,6 +425,138 @@ def _build_weekday_string(weekdays):
     from resources.models import Day
     return ', '.join(str(Day.DAYS_OF_WEEK[weekday][1]).capitalize() for weekday in weekdays)
 
+
+def get_reservation_export_headers():
+    from resources.models import Reservation, RESERVATION_EXTRA_FIELDS
+    headers = ['Unit', 'Resource', 'Begin time', 'End time', 'Created at', 'User', 'Comments', 'Staff event']
+    headers = [str(_(header)) for header in headers]
+    headers += [str(Reservation._meta.get_field(field).verbose_name) for field in RESERVATION_EXTRA_FIELDS]
+    return headers
+
+
+def iter_reservation_export_rows(reservations, user, include_block_reservations=False):
+    """
+    Yield the rows of a reservation export
+
+    The rows have the same columns as the reservation listing of
+    `generate_reservation_xlsx`, but they are built straight from the
+    database values of the reservations, which are fetched with a
+    server-side cursor. Permissions are checked once per resource
+    instead of once per reservation.
+
+    :type reservations: resources.models.ReservationQuerySet
+    :rtype: iterator[list]
+    """
+    from resources.auth import PermissionSnapshot
+    from resources.models import Resource, Reservation, RESERVATION_EXTRA_FIELDS
+
+    reservations = reservations.prefetch_related(None)
+    if not include_block_reservations:
+        reservations = reservations.exclude(type=Reservation.TYPE_BLOCKED)
+
+    resources = list(
+        Resource.objects.filter(id__in=reservations.values('resource_id'))
+        .select_related('unit', 'reservation_metadata_set')
+        .prefetch_related('groups', 'reservation_metadata_set__supported_fields')
+    )
+    snapshot = PermissionSnapshot(user)
+
+    resource_info = {}
+    for resource in resources:
+        resource._permission_snapshot = snapshot
+        resource_info[resource.id] = {
+            'unit': resource.unit.name if resource.unit else '',
+            'resource': resource.name,
+            'can_view_user': resource.can_view_reservation_user(user),
+            'can_access_comments': resource.can_access_reservation_comments(user),
+            # see ReservationSerializer.to_representation()
+            'can_access_own_comments': user.is_staff and resource.reservable_by_all_staff,
+            'can_view_extra_fields': resource.can_view_reservation_extra_fields(user),
+            'extra_fields': set(resource.get_supported_reservation_extra_field_names()),
+        }
+
+    extra_field_columns = [Reservation._meta.get_field(field).attname for field in RESERVATION_EXTRA_FIELDS]
+    columns = ['resource_id', 'user_id', 'user__email', 'begin', 'end', 'created_at', 'comments', 'staff_event']
+
+    yield get_reservation_export_headers()
+    rows = reservations.values_list(*(columns + extra_field_columns)).iterator(chunk_size=2000)
+    for row in rows:
+        resource_id, user_id, user_email, begin, end, created_at, comments, staff_event = row[:len(columns)]
+        info = resource_info.get(resource_id)
+        if info is None:
+            continue
+
+        is_own = user.is_authenticated and user_id == user.pk
+        can_view_extra_fields = is_own or info['can_view_extra_fields']
+        if not (info['can_access_comments'] or (is_own and info['can_access_own_comments'])):
+            comments = ''
+        extra_fields = [
+            value if can_view_extra_fields and field in info['extra_fields'] else ''
+            for field, value in zip(RESERVATION_EXTRA_FIELDS, row[len(columns):])
+        ]
+        yield [clean_spreadsheet_value(value) for value in [
+            info['unit'],
+            info['resource'],
+            localtime(begin).replace(tzinfo=None),
+            localtime(end).replace(tzinfo=None),
+            localtime(created_at).replace(tzinfo=None),
+            (user_email or '') if info['can_view_user'] else '',
+            comments,
+            staff_event,
+        ] + extra_fields]
+
+
+def write_reservation_export_xlsx(rows, output):
+    """
+    Write reservation export rows into an xlsx file
+
+    The workbook is written in constant memory mode, so each row is
+    flushed to a temporary file as soon as it has been written.
+
+    :type rows: iterator[list]
+    :param output: file name or a binary file object
+    """
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    sheet_name = format_lazy('{} {}', _('Reservation'), _('Reports'))
+    worksheet = workbook.add_worksheet(str(sheet_name).capitalize())
+    header_format = workbook.add_format({'bold': True})
+    date_format = workbook.add_format({'num_format': 'dd.mm.yyyy hh:mm', 'align': 'left'})
+
+    for row_number, row in enumerate(rows):
+        if row_number == 0:
+            for column, header in enumerate(row):
+                worksheet.set_column(column, column, max(len(header) + 10, 25))
+                worksheet.write(row_number, column, header, header_format)
+            continue
+        for column, value in enumerate(row):
+            if isinstance(value, datetime.datetime):
+                worksheet.write_datetime(row_number, column, value, date_format)
+            else:
+                worksheet.write(row_number, column, value)
+    workbook.close()
+
+
+def iter_reservation_export_csv(rows):
+    """
+    Yield reservation export rows as lines of CSV
+
+    :type rows: iterator[list]
+    :rtype: iterator[str]
+    """
+    class Echo:
+        def write(self, value):
+            return value
+
+    writer = csv.writer(Echo())
+    # byte order mark, so that spreadsheet programs detect the encoding
+    yield '\ufeff'
+    for row in rows:
+        yield writer.writerow([
+            value.strftime('%d.%m.%Y %H:%M') if isinstance(value, datetime.datetime) else value
+            for value in row
+        ])
+
+
 def get_object_or_none(cls, **kwargs):
     try:
         return cls.objects.get(**kwargs)
@@ -469,32 +644,56 @@ def format_dt_range_alt(language: str, begin, end) -> str:
     return res
 
 
+def build_reservation_ical_event(reservation):
+    event = Event()
+    begin_utc = timezone.localtime(reservation.begin, timezone.utc)
+    end_utc = timezone.localtime(reservation.end, timezone.utc)
+    event['uid'] = 'respa_reservation_{}'.format(reservation.id)
+    event['dtstart'] = vDatetime(begin_utc)
+    event['dtend'] = vDatetime(end_utc)
+    if reservation.created_at:
+        event['dtstamp'] = vDatetime(reservation.created_at)
+
+    event['summary'] = vText(reservation.resource.name)
+
+    if reservation.reserver_email_address:
+        attendee = vCalAddress(f'MAILTO:{reservation.reserver_email_address}')
+        attendee.params['cn'] = vText(reservation.reserver_name)
+        event.add('attendee', attendee, encode=0)
+    return event
+
+
+def build_reservations_ical_calendar():
+    cal = Calendar()
+    cal.add('prodid', '-//Varaamo Turku//')
+    cal.add('version', '2.0')
+    return cal
+
+
+def iter_reservations_ical_file(reservations):
+    """
+    Yield iCalendar file containing given reservations in chunks
+
+    The chunks add up to the same file as `build_reservations_ical_file`
+    returns, without keeping all the events in memory at once.
+    """
+    end = b'END:VCALENDAR\r\n'
+    empty_calendar = build_reservations_ical_calendar().to_ical()
+    assert empty_calendar.endswith(end)
+    yield empty_calendar[:-len(end)]
+    for reservation in reservations:
+        yield build_reservation_ical_event(reservation).to_ical()
+    yield end
+
+
 def build_reservations_ical_file(reservations):
     """
     Return iCalendar file containing given reservations
     """
 
-    cal = Calendar()
-    cal.add('prodid', '-//Varaamo Turku//')
-    cal.add('version', '2.0')
+    cal = build_reservations_ical_calendar()
     for reservation in reservations:
-        event = Event()
-        begin_utc = timezone.localtime(reservation.begin, timezone.utc)
-        end_utc = timezone.localtime(reservation.end, timezone.utc)
-        event['uid'] = 'respa_reservation_{}'.format(reservation.id)
-        event['dtstart'] = vDatetime(begin_utc)
-        event['dtend'] = vDatetime(end_utc)
-        if reservation.created_at:
-            event['dtstamp'] = vDatetime(reservation.created_at)
-
-        event['summary'] = vText(reservation.resource.name)
-
-        if reservation.reserver_email_address:
-            attendee = vCalAddress(f'MAILTO:{reservation.reserver_email_address}')
-            attendee.params['cn'] = vText(reservation.reserver_name)
-            event.add('attendee', attendee, encode=0)
-
-        cal.add_component(event)
+        cal.add_component(build_reservation_ical_event(reservation))
     return cal.to_ical()
 
 
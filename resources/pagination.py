@@ -1,4 +1,168 @@
-from rest_framework.pagination import PageNumberPagination, _positive_int
+import base64
+import datetime
+import json
+from collections import OrderedDict
+
+from django.db import connections
+from django.db.models import Q
+from modeltranslation.utils import build_localized_fieldname, get_language
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on a unique ordering
+
+    The cursor holds the ordering values of the last object of the page,
+    so the next page is fetched with a range condition on an index
+    instead of an ever growing OFFSET. An estimate of the total count
+    from the query planner is included with `?count=estimate`.
+
+    The last field of the ordering must be unique and not null. The other
+    fields are sorted ascending with nulls last.
+    """
+    ordering = ('id',)
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, request):
+        return self.ordering
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True, cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request)
+        page_size = self.get_page_size(request)
+        reverse, values = self.decode_cursor(request)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'estimate':
+            self.count = self.get_estimated_count(queryset)
+
+        if reverse:
+            queryset = queryset.order_by(*['-' + field for field in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if values is not None:
+            queryset = queryset.filter(self.get_keyset_filter(self.ordering, values, reverse))
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results and (has_more if not reverse else values is not None):
+            self.next_position = self.get_position(results[-1])
+        if results and (has_more if reverse else values is not None):
+            self.previous_position = self.get_position(results[0])
+        return results
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_link(self.next_position, reverse=False)
+        response['previous'] = self.get_link(self.previous_position, reverse=True)
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {
+                    'type': 'integer',
+                    'example': 123,
+                },
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+    def get_keyset_filter(self, fields, values, reverse):
+        """
+        Returns the condition for objects after the given ordering values
+
+        With `reverse` set, the condition is for the objects before them.
+        """
+        field, value = fields[0], values[0]
+        lookup = '__lt' if reverse else '__gt'
+        if len(fields) == 1:
+            return Q(**{field + lookup: value})
+
+        ties = self.get_keyset_filter(fields[1:], values[1:], reverse)
+        if value is None:
+            ties &= Q(**{field + '__isnull': True})
+            return Q(**{field + '__isnull': False}) | ties if reverse else ties
+
+        ties &= Q(**{field: value})
+        following = Q(**{field + lookup: value})
+        if not reverse:
+            following |= Q(**{field + '__isnull': True})
+        return following | ties
+
+    def get_position(self, instance):
+        values = []
+        for field in self.ordering:
+            value = instance
+            for attr in field.split('__'):
+                value = getattr(value, attr) if value is not None else None
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                value = value.isoformat()
+            values.append(value)
+        return values
+
+    def get_link(self, position, reverse):
+        if position is None:
+            return None
+        cursor = base64.urlsafe_b64encode(json.dumps([reverse, position]).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return False, None
+
+        try:
+            reverse, values = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return bool(reverse), values
+
+    def get_estimated_count(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
 
 
 class DefaultPagination(PageNumberPagination):
@@ -6,21 +170,65 @@ class DefaultPagination(PageNumberPagination):
     page_size_query_param = 'page_size'  # Allow client to override, using `?page_size=xxx
     max_page_size = 500
 
+    # Cursor pagination used instead with `?pagination=cursor`
+    keyset_pagination_class = None
+    pagination_query_param = 'pagination'
+
+    def use_keyset_pagination(self, request):
+        if self.keyset_pagination_class is None:
+            return False
+        return (request.query_params.get(self.pagination_query_param) == 'cursor' or
+                self.keyset_pagination_class.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_paginator = None
+        if self.use_keyset_pagination(request):
+            self.keyset_paginator = self.keyset_pagination_class()
+            self.keyset_paginator.page_size = self.page_size
+            self.keyset_paginator.max_page_size = self.get_max_page_size(request)
+            return self.keyset_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if getattr(self, 'keyset_paginator', None) is not None:
+            return self.keyset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_max_page_size(self, request):
+        return self.max_page_size
+
 
 class PurposePagination(DefaultPagination):
     page_size = 40
 
 
+class ReservationKeysetPagination(KeysetPagination):
+    ordering = ('begin', 'id')
+
+
+class ResourceKeysetPagination(KeysetPagination):
+    def get_ordering(self, request):
+        return (build_localized_fieldname('name', get_language()), 'id')
+
+
+class ResourcePagination(DefaultPagination):
+    keyset_pagination_class = ResourceKeysetPagination
+
+
 class ReservationPagination(DefaultPagination):
+    keyset_pagination_class = ReservationKeysetPagination
+
+    def get_max_page_size(self, request):
+        if request.query_params.get('format', '').lower() == 'xlsx':
+            return 50000
+        return self.max_page_size
+
     def get_page_size(self, request):
         if self.page_size_query_param:
-            cutoff = self.max_page_size
-            if request.query_params.get('format', '').lower() == 'xlsx':
-                cutoff = 50000
             try:
                 return _positive_int(
                     request.query_params[self.page_size_query_param],
-                    strict=True, cutoff=cutoff
+                    strict=True, cutoff=self.get_max_page_size(request)
                 )
             except (KeyError, ValueError):
                 pass
@@ -1,5 +1,9 @@
 import django.dispatch
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 reservation_confirmed = django.dispatch.Signal(['instance', 'user'])
 reservation_modified = django.dispatch.Signal(['instance', 'user'])
@@ -25,3 +29,70 @@ def handle_reservation_modified(sender, instance, user, **kwargs):
 
     if instance.resource.configuration:
         instance.resource.configuration.handle_modify(instance)
+
+
+def _as_aware_datetime(value):
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+@receiver(pre_save, sender='resources.Reservation', dispatch_uid='resources-free-intervals-pre-save')
+def store_reservation_original_times(sender, instance, **kwargs):
+    original = None
+    if instance.pk:
+        original = sender.objects.filter(pk=instance.pk).values_list('resource_id', 'begin', 'end').first()
+    instance._original_times = original
+
+
+@receiver(post_save, sender='resources.Reservation', dispatch_uid='resources-free-intervals-save')
+def handle_reservation_save(sender, instance, **kwargs):
+    if getattr(instance, '_skip_free_intervals_update', False):
+        # updated by the caller, e.g. ReservationQuerySet.create_stack()
+        return
+    begin, end = _as_aware_datetime(instance.begin), _as_aware_datetime(instance.end)
+    original = getattr(instance, '_original_times', None)
+    if original:
+        original_resource_id, original_begin, original_end = original
+        if original_resource_id != instance.resource_id:
+            Resource = apps.get_model('resources', 'Resource')
+            original_resource = Resource.objects.with_soft_deleted.get(pk=original_resource_id)
+            original_resource.update_free_intervals(original_begin, original_end)
+        else:
+            begin, end = min(begin, original_begin), max(end, original_end)
+    instance.resource.update_free_intervals(begin, end)
+
+
+@receiver(post_delete, sender='resources.Reservation', dispatch_uid='resources-free-intervals-delete')
+def handle_reservation_delete(sender, instance, **kwargs):
+    if getattr(instance, '_skip_free_intervals_update', False):
+        # updated by the caller, e.g. ReservationQuerySet.delete_stack()
+        return
+    instance.resource.update_free_intervals(_as_aware_datetime(instance.begin), _as_aware_datetime(instance.end))
+
+
+@receiver(post_save, sender='resources.Resource', dispatch_uid='resources-search-vector-resource')
+def handle_resource_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sender.objects.filter(pk=instance.pk).update_search_vectors()
+
+
+@receiver(post_save, sender='resources.Unit', dispatch_uid='resources-search-vector-unit')
+def handle_unit_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        apps.get_model('resources', 'Resource').objects.filter(unit=instance).update_search_vectors()
+
+
+@receiver(post_save, sender='resources.ResourceType', dispatch_uid='resources-search-vector-type')
+def handle_resource_type_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        apps.get_model('resources', 'Resource').objects.filter(type=instance).update_search_vectors()
+
+
+@receiver(post_save, sender='resources.ResourceTag', dispatch_uid='resources-search-vector-tag-save')
+@receiver(post_delete, sender='resources.ResourceTag', dispatch_uid='resources-search-vector-tag-delete')
+def handle_resource_tag_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        apps.get_model('resources', 'Resource').objects.filter(pk=instance.resource_id).update_search_vectors()
@@ -16,8 +16,14 @@ from resources.models import ReservationMetadataSet, ReservationMetadataField
 from users.models import LoginMethod
 from munigeo.models import Municipality
 from maintenance.models import MaintenanceMessage, MaintenanceMode
+from resources.api.cache import get_response_cache
 from .utils import get_test_image_data, get_test_image_payload
 
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    get_response_cache().clear()
+
+
 @pytest.fixture
 def api_client() -> APIClient:
     return APIClient()
@@ -95,3 +95,42 @@ def test_opening_hours(resource_in_unit):
     assert_hours(tz, hours, date(2015, 1, 1), '10:00', '14:00')
     assert_hours(tz, hours, date(2015, 1, 2), '10:00', '14:00')
     assert_hours(tz, hours, date(2015, 1, 3), None)
+
+
+@pytest.mark.django_db
+def test_incremental_opening_hours_update(resource_in_unit):
+    unit = resource_in_unit.unit
+    tz = unit.get_tz()
+
+    p1 = Period.objects.create(start=date(2015, 1, 1), end=date(2015, 12, 31),
+                               unit=unit, name='regular hours')
+    for weekday in range(0, 7):
+        Day.objects.create(period=p1, weekday=weekday,
+                           opens=datetime.time(8, 0),
+                           closes=datetime.time(18, 0))
+    unit.update_opening_hours()
+
+    # Only the dates of the changed period get recalculated
+    p2 = Period.objects.create(start=date(2015, 6, 8), end=date(2015, 6, 14),
+                               resource=resource_in_unit, name='short week')
+    for weekday in range(0, 7):
+        Day.objects.create(period=p2, weekday=weekday,
+                           opens=datetime.time(12, 0),
+                           closes=datetime.time(14, 0))
+    resource_in_unit.update_opening_hours(date(2015, 6, 8), date(2015, 6, 14))
+
+    begin = tz.localize(datetime.datetime(2015, 6, 1))
+    end = begin + datetime.timedelta(days=30)
+    hours = resource_in_unit.get_opening_hours(begin, end)
+    assert_hours(tz, hours, date(2015, 6, 7), '08:00', '18:00')
+    assert_hours(tz, hours, date(2015, 6, 8), '12:00', '14:00')
+    assert_hours(tz, hours, date(2015, 6, 14), '12:00', '14:00')
+    assert_hours(tz, hours, date(2015, 6, 15), '08:00', '18:00')
+    assert resource_in_unit.opening_hours.count() == 365
+
+    # Removing the period restores the unit hours for those dates
+    p2.delete()
+    resource_in_unit.update_opening_hours(date(2015, 6, 8), date(2015, 6, 14))
+    hours = resource_in_unit.get_opening_hours(begin, end)
+    assert_hours(tz, hours, date(2015, 6, 10), '08:00', '18:00')
+    assert resource_in_unit.opening_hours.count() == 365
@@ -0,0 +1,52 @@
+import datetime
+
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+from icalendar import Calendar
+
+from resources.models import Reservation
+from resources.models.utils import build_reservations_ical_file, iter_reservations_ical_file
+
+
+@pytest.fixture
+def feed_reservations(resource_in_unit, user):
+    begin = timezone.now().replace(microsecond=0) + datetime.timedelta(days=1)
+    return [
+        Reservation.objects.create(
+            resource=resource_in_unit, user=user, state=Reservation.CONFIRMED,
+            begin=begin + datetime.timedelta(hours=i), end=begin + datetime.timedelta(hours=i, minutes=30),
+            reserver_email_address='test@example.com', reserver_name='Test User',
+        )
+        for i in range(3)
+    ]
+
+
+@pytest.mark.django_db
+def test_streamed_ical_file_matches_built_file(feed_reservations):
+    assert b''.join(iter_reservations_ical_file(feed_reservations)) == build_reservations_ical_file(feed_reservations)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('streaming_threshold', (500, 0))
+def test_ical_feed_conditional_requests(api_client, user, feed_reservations, settings, streaming_threshold):
+    settings.RESPA_ICAL_FEED_STREAMING_THRESHOLD = streaming_threshold
+    url = reverse('ical-feed', kwargs={'ical_token': user.get_or_create_ical_token()})
+
+    response = api_client.get(url)
+    assert response.status_code == 200
+    content = b''.join(response.streaming_content) if response.streaming else response.content
+    assert len(Calendar.from_ical(content).walk('vevent')) == 3
+    etag = response['ETag']
+    assert not response.has_header('Last-Modified')
+
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    feed_reservations[0].state = Reservation.CANCELLED
+    feed_reservations[0].save()
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    content = b''.join(response.streaming_content) if response.streaming else response.content
+    assert len(Calendar.from_ical(content).walk('vevent')) == 2
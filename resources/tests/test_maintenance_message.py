@@ -4,6 +4,8 @@ import datetime
 from django.utils import timezone
 from django.urls import reverse
 
+from maintenance.models import MaintenanceMode, is_maintenance_mode_active
+
 LIST_URL = reverse('announcements-list')
 
 
@@ -46,3 +48,34 @@ def test_maintenance_message_is_maintenance_mode_on_when_off(client, maintenance
     message = results[0]
     assert message != None
     assert message['is_maintenance_mode_on'] == False
+
+
+@pytest.mark.django_db
+def test_maintenance_mode_is_looked_up_once_per_context(api_client, resource_in_unit, resource_in_unit2,
+                                                        maintenance_mode, django_assert_max_num_queries):
+    response = api_client.get(reverse('resource-list'))
+    assert response.status_code == 200
+    assert all(resource['reservable'] is False for resource in response.data['results'])
+
+    context = {}
+    with django_assert_max_num_queries(1):
+        for _ in range(3):
+            assert is_maintenance_mode_active(context) is True
+    MaintenanceMode.objects.all().delete()
+    assert is_maintenance_mode_active(context) is True
+    assert is_maintenance_mode_active() is False
+
+
+@pytest.mark.django_db
+def test_maintenance_mode_is_cached_until_changed(settings, maintenance_message, django_assert_num_queries):
+    settings.RESPA_MAINTENANCE_MODE_CACHE_TIMEOUT = 10
+    assert is_maintenance_mode_active() is False
+    with django_assert_num_queries(0):
+        assert is_maintenance_mode_active() is False
+
+    now = timezone.now()
+    MaintenanceMode.objects.create(start=now - datetime.timedelta(hours=1), end=now + datetime.timedelta(hours=1),
+                                   maintenance_message=maintenance_message)
+    assert is_maintenance_mode_active() is True
+    MaintenanceMode.objects.all().delete()
+    assert is_maintenance_mode_active() is False
@@ -135,4 +135,41 @@ def test_non_public_purpose_visibility(api_client, purpose, user, user_with_perm
     resp = api_client.get(list_url)
     assert resp.status_code == 200
     assert resp.data['count'] == 1
-    
\ No newline at end of file
+    
+
+@pytest.mark.django_db
+def test_purpose_list_is_cached(api_client, settings, purpose, list_url, django_assert_num_queries):
+    settings.RESPA_API_CACHE = 'default'
+    response = api_client.get(list_url)
+    assert response.status_code == 200
+    etag = response['ETag']
+
+    with django_assert_num_queries(0):
+        response = api_client.get(list_url)
+    assert response.status_code == 200
+    assert response['ETag'] == etag
+    assert response.data['results'][0]['id'] == purpose.id
+
+    response = api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    purpose.name_en = 'changed purpose'
+    purpose.save()
+    response = api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    assert response.data['results'][0]['name']['en'] == 'changed purpose'
+
+
+@pytest.mark.django_db
+def test_purpose_list_is_not_cached_without_shared_cache(api_client, settings, purpose, list_url):
+    settings.RESPA_API_CACHE = None
+    response = api_client.get(list_url)
+    assert response.status_code == 200
+    assert not response.has_header('ETag')
+
+    purpose.name_en = 'changed purpose'
+    purpose.save()
+    response = api_client.get(list_url)
+    assert not response.has_header('ETag')
+    assert response.data['results'][0]['name']['en'] == 'changed purpose'
@@ -2,7 +2,9 @@ import datetime
 import pytest
 
 import arrow
+from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django.utils.translation import activate
 from django.test import TestCase
 from django.utils import timezone
@@ -21,6 +23,7 @@ from resources.models import (
     ReservationHomeMunicipalityField,
     ReservationHomeMunicipalitySet,
 )
+from resources.models.reservation import is_reservation_overlap_error
 
 
 class ReservationTestCase(TestCase):
@@ -188,6 +191,71 @@ def test_admin_may_bypass_min_period(resource_with_opening_hours, user):
         reservation.clean()
     assert error.value.code == 'invalid_time_slot'
 
+@freeze_time('2115-04-02')
+@pytest.mark.django_db
+def test_clean_loads_validation_data_at_once(resource_with_opening_hours, user, django_assert_num_queries):
+    resource_with_opening_hours.cooldown = datetime.timedelta(hours=1)
+    resource_with_opening_hours.save()
+
+    tz = timezone.get_current_timezone()
+    begin = tz.localize(datetime.datetime(2115, 6, 1, 10, 0, 0))
+    Reservation.objects.create(
+        resource=resource_with_opening_hours, begin=begin, end=begin + datetime.timedelta(hours=1),
+        user=user, state=Reservation.CONFIRMED,
+    )
+
+    resource = Resource.objects.select_related('unit').get(pk=resource_with_opening_hours.pk)
+    user = get_user_model().objects.prefetch_related(
+        'unit_authorizations', 'unit_group_authorizations').get(pk=user.pk)
+
+    # opening hours and reservations
+    with django_assert_num_queries(2):
+        with pytest.raises(ValidationError) as error:
+            Reservation(resource=resource, begin=begin, end=begin + datetime.timedelta(hours=1), user=user).clean()
+    assert 'period' in error.value.message_dict
+
+    with django_assert_num_queries(2):
+        with pytest.raises(ValidationError) as error:
+            Reservation(
+                resource=resource, user=user,
+                begin=begin + datetime.timedelta(hours=1), end=begin + datetime.timedelta(hours=2),
+            ).clean()
+    assert 'cooldown' in error.value.message_dict
+
+    Reservation(
+        resource=resource, user=user,
+        begin=begin + datetime.timedelta(hours=2), end=begin + datetime.timedelta(hours=3),
+    ).clean()
+
+
+@pytest.mark.django_db
+def test_overlapping_reservations_are_prevented_in_database(resource_in_unit, user):
+    tz = timezone.get_current_timezone()
+    begin = tz.localize(datetime.datetime(2115, 6, 1, 10, 0, 0))
+    Reservation.objects.create(
+        resource=resource_in_unit, begin=begin, end=begin + datetime.timedelta(hours=2),
+        user=user, state=Reservation.CONFIRMED,
+    )
+
+    with pytest.raises(IntegrityError) as error:
+        with transaction.atomic():
+            Reservation.objects.create(
+                resource=resource_in_unit, user=user, state=Reservation.REQUESTED,
+                begin=begin + datetime.timedelta(hours=1), end=begin + datetime.timedelta(hours=3),
+            )
+    assert is_reservation_overlap_error(error.value)
+
+    # adjacent, cancelled and denied reservations are allowed
+    Reservation.objects.create(
+        resource=resource_in_unit, user=user, state=Reservation.CONFIRMED,
+        begin=begin + datetime.timedelta(hours=2), end=begin + datetime.timedelta(hours=3),
+    )
+    for state in (Reservation.CANCELLED, Reservation.DENIED):
+        Reservation.objects.create(
+            resource=resource_in_unit, begin=begin, end=begin + datetime.timedelta(hours=2), user=user, state=state,
+        )
+
+
 @pytest.mark.django_db
 def test_reservation_home_municipality_field_str():
     home_municipality_field = ReservationHomeMunicipalityField.objects.create(name='test municipality')
@@ -224,3 +292,35 @@ def test_reservation_notification_template_takes_place_virtually(resource_in_uni
         assert 'virtual_address' in context
     else:
         assert 'virtual_address' not in context
+
+
+@pytest.mark.django_db
+def test_handle_reminders(resource_in_unit, user):
+    from django.core.management import call_command
+    from resources.models import ReservationReminder
+
+    now = timezone.now()
+    reminders = {}
+    for i, (name, state, reminder_date) in enumerate((
+        ('due', Reservation.CONFIRMED, now - datetime.timedelta(hours=1)),
+        ('future', Reservation.CONFIRMED, now + datetime.timedelta(hours=1)),
+        ('requested', Reservation.REQUESTED, now - datetime.timedelta(hours=1)),
+        ('cancelled', Reservation.CANCELLED, now - datetime.timedelta(hours=1)),
+    )):
+        begin = reminder_date + datetime.timedelta(days=1, hours=2 * i)
+        reservation = Reservation.objects.create(
+            resource=resource_in_unit, user=user, state=state,
+            begin=begin, end=begin + datetime.timedelta(hours=1),
+        )
+        reminders[name] = ReservationReminder.objects.create(reservation=reservation, reminder_date=reminder_date)
+
+    call_command('handle_reminders')
+
+    assert not ReservationReminder.objects.filter(id=reminders['cancelled'].id).exists()
+    sent = set(ReservationReminder.objects.filter(sent_at__isnull=False).values_list('id', flat=True))
+    assert sent == {reminders['due'].id}
+
+    # Sent reminders are not sent again
+    sent_at = ReservationReminder.objects.get(id=reminders['due'].id).sent_at
+    call_command('handle_reminders')
+    assert ReservationReminder.objects.get(id=reminders['due'].id).sent_at == sent_at
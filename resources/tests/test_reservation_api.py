@@ -152,11 +152,11 @@ def reservation2(resource_in_unit2, user):
 
 @pytest.fixture
 def reservation3(resource_in_unit2, user2):
-    # the same as reservation2 but different user
+    # the same as reservation2 but different user and time
     return Reservation.objects.create(
         resource=resource_in_unit2,
-        begin='2115-04-05T09:00:00+02:00',
-        end='2115-04-05T10:00:00+02:00',
+        begin='2115-04-05T10:00:00+02:00',
+        end='2115-04-05T11:00:00+02:00',
         user=user2,
         event_subject='not so fancy event',
         host_name='markku',
@@ -888,6 +888,22 @@ def test_reservation_can_be_modified_by_overlapping_reservation(api_client, rese
     assert reservation.end == dateparse.parse_datetime('2115-04-04T11:00:00+02:00')
 
 
+@pytest.mark.django_db
+def test_overlapping_reservation_is_rejected(user_api_client, resource_in_unit, reservation, reservation_data,
+                                             list_url):
+    """
+    Tests that a new reservation overlapping an existing one is rejected by the overlap constraint.
+    """
+    resource_in_unit.max_reservations_per_user = None
+    resource_in_unit.save()
+    reservation_data['begin'] = '2115-04-04T09:00:00+02:00'
+    reservation_data['end'] = '2115-04-04T10:00:00+02:00'
+    response = user_api_client.post(list_url, data=reservation_data, HTTP_ACCEPT_LANGUAGE='en')
+    assert response.status_code == 400
+    assert 'already reserved' in str(response.data['period'][0])
+    assert Reservation.objects.count() == 1
+
+
 @pytest.mark.parametrize('perm_type', ['unit', 'resource_group'])
 @pytest.mark.django_db
 def test_non_reservable_resource_restrictions(
@@ -1121,6 +1137,41 @@ def test_reservation_time_filters(api_client, list_url, reservation, resource_in
     assert {reservation.id, reservation2.id}.issubset(set(res['id'] for res in response.data['results']))
 
 
+@pytest.mark.django_db
+def test_reservation_cursor_pagination(api_client, list_url, reservation, resource_in_unit, resource_in_unit2, user):
+    for day in (5, 6):
+        for resource in (resource_in_unit, resource_in_unit2):
+            Reservation.objects.create(
+                resource=resource,
+                begin=dateparse.parse_datetime('2115-04-0%dT11:00:00+02:00' % day),
+                end=dateparse.parse_datetime('2115-04-0%dT12:00:00+02:00' % day),
+                user=user,
+                state=Reservation.CONFIRMED,
+            )
+    expected_ids = list(Reservation.objects.order_by('begin', 'id').values_list('id', flat=True))
+    assert len(expected_ids) == 5
+
+    response = api_client.get(list_url, {'pagination': 'cursor', 'page_size': 2, 'count': 'estimate'})
+    assert response.status_code == 200
+    assert isinstance(response.data['count'], int)
+    assert response.data['previous'] is None
+
+    pages = [[res['id'] for res in response.data['results']]]
+    while response.data['next']:
+        response = api_client.get(response.data['next'])
+        assert response.status_code == 200
+        assert 'count' not in response.data
+        pages.append([res['id'] for res in response.data['results']])
+    assert pages == [expected_ids[0:2], expected_ids[2:4], expected_ids[4:]]
+
+    response = api_client.get(response.data['previous'])
+    assert response.status_code == 200
+    assert [res['id'] for res in response.data['results']] == expected_ids[2:4]
+
+    response = api_client.get(list_url, {'cursor': 'invalid'})
+    assert response.status_code == 404
+
+
 @pytest.mark.parametrize("input_hours,input_mins,expected", [
     (2, 30, '2 hours 30 minutes'),
     (1, 30, '1 hour 30 minutes'),
@@ -1171,6 +1222,40 @@ def test_reservation_excels(staff_api_client, list_url, detail_url, reservation,
     assert len(response.content) > 0
 
 
+@pytest.mark.django_db
+def test_reservation_export(api_client, unit_manager_api_client, list_url, reservation, user):
+    reservation.comments = '=secret comment'
+    reservation.save()
+    export_url = list_url + 'export/'
+
+    response = unit_manager_api_client.get(export_url, {'export_format': 'csv'}, HTTP_ACCEPT_LANGUAGE='en')
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == 'attachment; filename=reservations.csv'
+    lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith('Unit,Resource,Begin time,End time,Created at,User,Comments,Staff event,')
+    assert reservation.resource.name in lines[1]
+    assert user.email in lines[1]
+    assert 'secret comment' in lines[1]
+    assert '=secret comment' not in lines[1]
+
+    # anonymous users see neither the user nor the comments of others' reservations
+    response = api_client.get(export_url, {'export_format': 'csv'})
+    assert response.status_code == 200
+    lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+    assert len(lines) == 2
+    assert user.email not in lines[1]
+    assert 'secret comment' not in lines[1]
+
+    response = unit_manager_api_client.get(export_url, HTTP_ACCEPT_LANGUAGE='en')
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == 'attachment; filename=reservations.xlsx'
+    assert b''.join(response.streaming_content).startswith(b'PK')
+
+    response = unit_manager_api_client.get(export_url, {'export_format': 'pdf'})
+    assert response.status_code == 400
+
+
 @pytest.mark.parametrize('need_manual_confirmation, expected_state', [
     (False, Reservation.CONFIRMED),
     (True, Reservation.REQUESTED)
@@ -3577,6 +3662,47 @@ def test_recurring_reservation_bad_period(
     response = staff_api_client.post(recurring_url, data=recurring_reservation_data, format='json')
     assert response.status_code == 400
 
+
+@pytest.mark.django_db
+def test_recurring_reservation_collisions(
+    resource_in_unit4_1, recurring_reservation_data,
+    staff_api_client, staff_user, user, recurring_url):
+    UnitAuthorization.objects.create(subject=resource_in_unit4_1.unit,
+                                     level=UnitAuthorizationLevel.manager, authorized=staff_user)
+    recurring_reservation_data['reserver_name'] = 'Recurring reservation'
+    reservation_stack = recurring_reservation_data['reservation_stack']
+
+    # colliding with another reservation of the same stack
+    recurring_reservation_data['reservation_stack'] = reservation_stack + [reservation_stack[1]]
+    response = staff_api_client.post(recurring_url, data=recurring_reservation_data, format='json')
+    assert response.status_code == 400
+    assert Reservation.objects.count() == 0
+
+    # colliding with an existing reservation
+    Reservation.objects.create(
+        resource=resource_in_unit4_1,
+        begin=dateparse.parse_datetime('2115-04-06T11:30:00+02:00'),
+        end=dateparse.parse_datetime('2115-04-06T12:30:00+02:00'),
+        user=user,
+        state=Reservation.CONFIRMED,
+    )
+    recurring_reservation_data['reservation_stack'] = reservation_stack
+    response = staff_api_client.post(recurring_url, data=recurring_reservation_data, format='json')
+    assert response.status_code == 400
+    assert Reservation.objects.count() == 1
+
+    recurring_reservation_data['reservation_stack'] = reservation_stack[:2]
+    response = staff_api_client.post(recurring_url, data=recurring_reservation_data, format='json')
+    assert response.status_code == 201
+    reservations = list(ReservationBulk.objects.get().reservations.all())
+    assert len(reservations) == 2
+    for reservation in reservations:
+        assert reservation.state == Reservation.CONFIRMED
+        assert reservation.duration.lower == reservation.begin
+        assert reservation.duration.upper == reservation.end
+        assert not resource_in_unit4_1.free_intervals.filter(
+            free_between__overlap=(reservation.begin, reservation.end, '[)')).exists()
+
 @pytest.mark.django_db
 def test_recurring_reservation_reminders(
     resource_in_unit4_1, recurring_reservation_data,
@@ -5,11 +5,14 @@ import datetime
 from django.core.files.base import ContentFile
 from django.core.exceptions import ValidationError
 from django.utils.translation import activate
+from freezegun import freeze_time
+from guardian.shortcuts import assign_perm
 from PIL import Image, UnidentifiedImageError
 
+from resources.auth import PermissionSnapshot
 from resources.enums import UnitAuthorizationLevel, UnitGroupAuthorizationLevel
 from resources.errors import InvalidImage
-from resources.models import ResourceImage, Resource
+from resources.models import Day, Period, Reservation, ResourceImage, Resource, ResourcePublishDate
 from resources.tests.utils import create_resource_image, get_test_image_data, get_field_errors
 
 
@@ -194,6 +197,35 @@ def test_queryset_with_perm(resource_in_unit, user):
     assert resource_in_unit in resources
 
 
+@pytest.mark.django_db
+def test_permission_snapshot(resource_in_unit, resource_in_unit2, resource_group, user,
+                             django_assert_max_num_queries):
+    user.unit_authorizations.create(
+        authorized=user,
+        level=UnitAuthorizationLevel.viewer,
+        subject=resource_in_unit.unit
+    )
+    assign_perm('group:can_approve_reservation', user, resource_group)
+
+    resources = list(Resource.objects.filter(pk__in=(resource_in_unit.pk, resource_in_unit2.pk)).
+                     prefetch_related('groups'))
+    snapshot = PermissionSnapshot(user)
+    for resource in resources:
+        resource._permission_snapshot = snapshot
+
+    # Unit authorizations, unit group authorizations, content types and user and group object permissions
+    with django_assert_max_num_queries(5):
+        for resource in resources:
+            resource.is_admin(user)
+            resource.is_viewer(user)
+            resource.can_modify_reservations(user)
+            resource.can_approve_reservations(user)
+    assert resources[0].is_viewer(user) and not resources[1].is_viewer(user)
+    assert resources[0].can_modify_reservations(user) and not resources[1].can_modify_reservations(user)
+    assert resources[0].can_approve_reservations(user) and not resources[1].can_approve_reservations(user)
+    assert list(Resource.objects.with_perm('can_approve_reservation', user, snapshot=snapshot)) == [resource_in_unit]
+
+
 @pytest.mark.django_db
 def test_soft_delete_and_restore_resource(resource_in_unit):
     pk = resource_in_unit.pk
@@ -202,3 +234,74 @@ def test_soft_delete_and_restore_resource(resource_in_unit):
     assert Resource.objects.with_soft_deleted.filter(pk=pk).count() == 1
     resource_in_unit.restore()
     assert Resource.objects.filter(pk=pk).count() == 1
+
+
+@pytest.mark.django_db
+def test_free_intervals_follow_reservations(resource_in_unit, user):
+    tz = resource_in_unit.unit.get_tz()
+    period = Period.objects.create(start=datetime.date(2115, 4, 1), end=datetime.date(2115, 4, 30),
+                                   resource=resource_in_unit)
+    for weekday in range(0, 7):
+        Day.objects.create(period=period, weekday=weekday, opens=datetime.time(8, 0), closes=datetime.time(16, 0))
+    resource_in_unit.update_opening_hours()
+
+    def get_free_intervals():
+        free_intervals = resource_in_unit.free_intervals.filter(
+            free_between__overlap=(tz.localize(datetime.datetime(2115, 4, 8)),
+                                   tz.localize(datetime.datetime(2115, 4, 9)), '[)')
+        ).order_by('free_between')
+        return [
+            (x.free_between.lower.astimezone(tz).time(), x.free_between.upper.astimezone(tz).time())
+            for x in free_intervals
+        ]
+
+    assert get_free_intervals() == [(datetime.time(8, 0), datetime.time(16, 0))]
+
+    reservation = Reservation.objects.create(
+        resource=resource_in_unit,
+        begin=tz.localize(datetime.datetime(2115, 4, 8, 10, 0)),
+        end=tz.localize(datetime.datetime(2115, 4, 8, 11, 0)),
+        user=user,
+    )
+    assert get_free_intervals() == [
+        (datetime.time(8, 0), datetime.time(10, 0)),
+        (datetime.time(11, 0), datetime.time(16, 0)),
+    ]
+
+    reservation.begin = tz.localize(datetime.datetime(2115, 4, 8, 14, 0))
+    reservation.end = tz.localize(datetime.datetime(2115, 4, 8, 16, 0))
+    reservation.save()
+    assert get_free_intervals() == [(datetime.time(8, 0), datetime.time(14, 0))]
+
+    reservation.set_state(Reservation.CANCELLED, user)
+    assert get_free_intervals() == [(datetime.time(8, 0), datetime.time(16, 0))]
+
+    reservation.state = Reservation.CONFIRMED
+    reservation.save()
+    assert get_free_intervals() == [(datetime.time(8, 0), datetime.time(14, 0))]
+    reservation.delete()
+    assert get_free_intervals() == [(datetime.time(8, 0), datetime.time(16, 0))]
+
+
+@pytest.mark.django_db
+def test_update_resource_publish_states(resource_with_reservable_publish_date):
+    pk = resource_with_reservable_publish_date.pk
+
+    with freeze_time('2100-12-12T08:00:00'):
+        assert not ResourcePublishDate.objects.with_outdated_states().exists()
+        assert ResourcePublishDate.objects.update_states() == 0
+        assert Resource.objects.get(pk=pk)._public
+
+    with freeze_time('2100-12-14T08:00:00'):
+        # Accessing resources must not change their state
+        assert Resource.objects.get(pk=pk)._public
+        assert ResourcePublishDate.objects.with_outdated_states().exists()
+        assert ResourcePublishDate.objects.update_states() == 1
+        assert not Resource.objects.with_soft_deleted.get(pk=pk)._public
+        assert ResourcePublishDate.objects.update_states() == 0
+
+    with freeze_time('2100-12-12T08:00:00'):
+        assert ResourcePublishDate.objects.update_states() == 1
+        resource = Resource.objects.get(pk=pk)
+        assert resource._public
+        assert resource.reservable
@@ -19,7 +19,7 @@ from ..enums import UnitAuthorizationLevel, UnitGroupAuthorizationLevel
 from resources.models import (
     Day, Equipment, Period, Reservation,
     ReservationMetadataSet, ResourceEquipment,
-    ResourceType, Unit, UnitGroup
+    ResourceFreeInterval, ResourceTag, ResourceType, Unit, UnitGroup
 )
 from .utils import (
     assert_response_objects, check_only_safe_methods_allowed, 
@@ -438,6 +438,42 @@ def test_filtering_by_is_favorite(list_url, api_client, staff_api_client, staff_
     assert response.data['results'][0]['id'] == resource_in_unit2.id
 
 
+@pytest.mark.django_db
+def test_resource_cursor_pagination(list_url, api_client, resource_in_unit, resource_in_unit2, resource_in_unit3):
+    resource_in_unit3.name_fi = resource_in_unit.name_fi
+    resource_in_unit3.save()
+    expected_ids = list(Resource.objects.order_by('name_fi', 'id').values_list('id', flat=True))
+
+    response = api_client.get(list_url, {'pagination': 'cursor', 'page_size': 1}, HTTP_ACCEPT_LANGUAGE='fi')
+    assert response.status_code == 200
+    ids = [resource['id'] for resource in response.data['results']]
+    while response.data['next']:
+        response = api_client.get(response.data['next'], HTTP_ACCEPT_LANGUAGE='fi')
+        assert response.status_code == 200
+        ids += [resource['id'] for resource in response.data['results']]
+    assert ids == expected_ids
+
+
+@pytest.mark.django_db
+def test_tags_and_is_favorite_in_list(list_url, api_client, staff_api_client, staff_user, resource_in_unit,
+                                      resource_in_unit2):
+    staff_user.favorite_resources.add(resource_in_unit2)
+    ResourceTag.objects.create(resource=resource_in_unit, label='sauna')
+    resource_in_unit.tags.add('sauna', 'lake')
+
+    response = staff_api_client.get(list_url)
+    assert response.status_code == 200
+    results = {resource['id']: resource for resource in response.data['results']}
+    assert sorted(results[resource_in_unit.id]['tags']) == ['lake', 'sauna']
+    assert results[resource_in_unit2.id]['tags'] == []
+    assert results[resource_in_unit.id]['is_favorite'] is False
+    assert results[resource_in_unit2.id]['is_favorite'] is True
+
+    response = api_client.get(list_url)
+    assert response.status_code == 200
+    assert not any(resource['is_favorite'] for resource in response.data['results'])
+
+
 @pytest.mark.django_db
 def test_api_resource_reservation_feedback_url_get(api_client, resource_in_unit, detail_url):
     """Tests that reservation feedback url is included in get response"""
@@ -618,6 +654,29 @@ def test_resource_type_filter(api_client, resource_in_unit, resource_in_unit2, r
     assert {resource['id'] for resource in response.data['results']} == {resource_in_unit.id, resource_in_unit2.id}
 
 
+@pytest.mark.django_db
+def test_resource_search(api_client, resource_in_unit, resource_in_unit2, test_unit, list_url):
+    resource_in_unit.name_en = 'Big sauna'
+    resource_in_unit.description_fi = 'Saunassa on takka'
+    resource_in_unit.save()
+    ResourceTag.objects.create(label='lakeside', resource=resource_in_unit2)
+
+    def search(query):
+        response = api_client.get(list_url, {'search': query})
+        assert response.status_code == 200
+        return [resource['id'] for resource in response.data['results']]
+
+    assert search('sauna') == [resource_in_unit.id]
+    assert search('sau') == [resource_in_unit.id]
+    assert search('takka') == [resource_in_unit.id]
+    assert search('lakeside') == [resource_in_unit2.id]
+    assert search('unit 2') == [resource_in_unit2.id]
+
+    test_unit.name_fi = 'Rantakeskus'
+    test_unit.save()
+    assert search('rantakeskus') == [resource_in_unit.id]
+
+
 @pytest.mark.django_db
 def test_resource_equipment_filter(api_client, resource_in_unit, resource_in_unit2, resource_in_unit3,
                                    equipment_category, resource_equipment, list_url):
@@ -745,16 +804,16 @@ def test_resource_available_between_filter_constraints(user_api_client, list_url
     assert 'available_between takes two or three comma-separated values.' in str(response.data)
 
     response = user_api_client.get(list_url, {
-        'available_between': '2115-04-08T00:00:00+02:00,2115-04-09T00:00:00+02:00'
+        'available_between': '2115-04-09T00:00:00+02:00,2115-04-08T00:00:00+02:00'
     })
     assert response.status_code == 400
-    assert 'available_between timestamps must be on the same day.' in str(response.data)
+    assert 'available_between start must not be after its end.' in str(response.data)
 
     response = user_api_client.get(list_url, {
-        'available_between': '2115-04-08T00:00:00+02:00,2115-04-09T00:00:00+02:00,60'
+        'available_between': '2115-04-09T00:00:00+02:00,2115-04-08T00:00:00+02:00,60'
     })
     assert response.status_code == 400
-    assert 'available_between timestamps must be on the same day.' in str(response.data)
+    assert 'available_between start must not be after its end.' in str(response.data)
 
     response = user_api_client.get(list_url, {
         'available_between': '2115-04-08T00:00:00+02:00,2115-04-08T00:00:00+02:00,xyz'
@@ -878,6 +937,58 @@ def test_available_between_with_period(list_url, resource_in_unit, resource_in_u
     assert_response_objects(response, expected_resources)
 
 
+@pytest.mark.django_db
+def test_available_between_multiple_days(list_url, resource_in_unit, resource_in_unit2, user, user_api_client):
+    for resource in (resource_in_unit, resource_in_unit2):
+        p1 = Period.objects.create(start=datetime.date(2115, 4, 1),
+                                   end=datetime.date(2115, 4, 30),
+                                   resource=resource)
+        for weekday in range(0, 7):
+            Day.objects.create(period=p1, weekday=weekday,
+                               opens=datetime.time(8, 0),
+                               closes=datetime.time(16, 0))
+        resource.update_opening_hours()
+
+    # resource_in_unit is fully booked on the 8th and has free time only on the 9th
+    Reservation.objects.create(
+        resource=resource_in_unit,
+        begin='2115-04-08T08:00:00+02:00',
+        end='2115-04-08T16:00:00+02:00',
+        user=user,
+    )
+    Reservation.objects.create(
+        resource=resource_in_unit,
+        begin='2115-04-09T08:00:00+02:00',
+        end='2115-04-09T15:00:00+02:00',
+        user=user,
+    )
+
+    params = {'available_between': '2115-04-08T08:00:00+02:00,2115-04-09T16:00:00+02:00,60'}
+    response = user_api_client.get(list_url, params)
+    assert response.status_code == 200
+    assert_response_objects(response, [resource_in_unit, resource_in_unit2])
+
+    params = {'available_between': '2115-04-08T08:00:00+02:00,2115-04-09T16:00:00+02:00,120'}
+    response = user_api_client.get(list_url, params)
+    assert response.status_code == 200
+    assert_response_objects(response, resource_in_unit2)
+
+    # the daily free intervals are separated by closing times
+    params = {'available_between': '2115-04-10T12:00:00+02:00,2115-04-11T12:00:00+02:00'}
+    response = user_api_client.get(list_url, params)
+    assert response.status_code == 200
+    assert_response_objects(response, [])
+
+    # consecutive free intervals make up continuous free time
+    ResourceFreeInterval.objects.create(
+        resource=resource_in_unit2,
+        free_between=('2115-04-10T16:00:00+02:00', '2115-04-11T08:00:00+02:00', '[)'),
+    )
+    response = user_api_client.get(list_url, params)
+    assert response.status_code == 200
+    assert_response_objects(response, resource_in_unit2)
+
+
 @pytest.mark.django_db
 def test_filtering_free_of_charge(list_url, api_client, resource_in_unit,
                                   resource_in_unit2, resource_in_unit3):
@@ -89,3 +89,39 @@ def test_typeahead_api_full_response(rf, typeahead_test_objects, typeahead_view)
     # Check that we get more data than with the non-full mode for resources:
     assert all(key in response_data["resource"][0] for key in ("id", "type", "name", "unit"))
     assert all(key in response_data["unit"][0] for key in ("id", "time_zone", "name", "phone"))
+
+
+@pytest.mark.django_db
+def test_typeahead_api_ranks_prefix_matches_first(rf, typeahead_test_objects, typeahead_view, space_resource_type):
+    unit = typeahead_test_objects["unit"]
+    other = Resource.objects.create(
+        unit=unit, type=space_resource_type, authentication="none", name="Sauna a tupa"
+    )
+    exact = Resource.objects.create(
+        unit=unit, type=space_resource_type, authentication="none", name="Sauna tupa"
+    )
+    response = typeahead_view(request=rf.get("/", {"input": "sauna tupa", "types": "resource"}))
+    response.render()
+    response_data = json.loads(force_str(response.content))
+    assert [obj["id"] for obj in response_data["resource"]] == [exact.id, other.id]
+
+    exact.name_en = "Zeta sauna"
+    exact.save()
+    response = typeahead_view(request=rf.get("/", {"input": "zeta", "types": "resource"}))
+    assert_response_contains(response, '"id":"%s"' % exact.id)
+
+
+@pytest.mark.django_db
+def test_typeahead_api_results_are_cached(rf, settings, typeahead_test_objects, typeahead_view,
+                                         django_assert_num_queries):
+    settings.RESPA_API_CACHE = 'default'
+    sauna = typeahead_test_objects["sauna"]
+    typeahead_view(request=rf.get("/", {"input": "testi", "types": "resource"}))
+    with django_assert_num_queries(0):
+        response = typeahead_view(request=rf.get("/", {"input": "testi", "types": "resource"}))
+    assert_response_contains(response, '"id":"%s"' % sauna.id)
+
+    sauna.name = "Konferenssisauna"
+    sauna.save()
+    response = typeahead_view(request=rf.get("/", {"input": "testi", "types": "resource"}))
+    assert_response_does_not_contain(response, '"id":"%s"' % sauna.id)
@@ -223,7 +223,7 @@ def test_is_reservation_metadata_or_times_different_when_meta_changes(resource_w
     reservation_a = Reservation.objects.create(resource=resource_with_metadata, **get_reservation_extradata)
     new_data = {'reserver_name': 'new name'}
     updated_extradata = {**get_reservation_extradata, **new_data}
-    reservation_b = Reservation.objects.create(resource=resource_with_metadata, **updated_extradata)
+    reservation_b = Reservation(resource=resource_with_metadata, **updated_extradata)
     assert is_reservation_metadata_or_times_different(reservation_a, reservation_b) == True
 
 
@@ -235,7 +235,7 @@ def test_is_reservation_metadata_or_times_different_when_time_changes(resource_w
     reservation_a = Reservation.objects.create(resource=resource_with_metadata, **get_reservation_extradata)
     new_data = {'end': '2022-02-02T14:30:00+02:00'}
     updated_extradata = {**get_reservation_extradata, **new_data}
-    reservation_b = Reservation.objects.create(resource=resource_with_metadata, **updated_extradata)
+    reservation_b = Reservation(resource=resource_with_metadata, **updated_extradata)
     assert is_reservation_metadata_or_times_different(reservation_a, reservation_b) == True
 
 
@@ -245,7 +245,7 @@ def test_is_reservation_metadata_or_times_different_when_no_changes(resource_wit
     Tests that the function returns False when there are no changes.
     '''
     reservation_a = Reservation.objects.create(resource=resource_with_metadata, **get_reservation_extradata)
-    reservation_b = Reservation.objects.create(resource=resource_with_metadata, **get_reservation_extradata)
+    reservation_b = Reservation(resource=resource_with_metadata, **get_reservation_extradata)
     assert is_reservation_metadata_or_times_different(reservation_a, reservation_b) == False
 
 
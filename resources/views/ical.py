@@ -1,11 +1,22 @@
+import datetime
+import hashlib
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
-from rest_framework.response import Response
+from django.db.models import Count, Max, Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from rest_framework.views import APIView
 from rest_framework import renderers
 
 from resources.models import Reservation
-from resources.models.utils import build_reservations_ical_file
+from resources.models.utils import iter_reservations_ical_file
+
+ICAL_CONTENT_TYPE = 'text/calendar; charset=utf-8'
 
 
 class ICalRenderer(renderers.BaseRenderer):
@@ -19,6 +30,11 @@ class ICalRenderer(renderers.BaseRenderer):
 class ICalFeedView(APIView):
     """
     Fetch a user's reservations in iCalendar format
+
+    Feeds are cached and support conditional requests with ETags, since
+    calendar clients poll them often. Feeds of many reservations are
+    streamed. No Last-Modified header is sent, since reservations which
+    are deleted or drop out of the feed don't change any modification time.
     """
 
     renderer_classes = (ICalRenderer, )
@@ -29,7 +45,51 @@ class ICalFeedView(APIView):
             user = User.objects.get(ical_token=ical_token)
         except User.DoesNotExist:
             raise PermissionDenied
-        reservations = Reservation.objects.filter(user=user).active()
-        ical_file = build_reservations_ical_file(reservations)
-        response = Response(ical_file)
+
+        feed_filter = self.get_feed_filter()
+        reservations = Reservation.objects.filter(user=user)
+        # Any change to the user's reservations updates their modification time,
+        # including cancellations which drop them from the feed. The count covers
+        # deleted reservations and reservations which get too old for the feed.
+        state = reservations.aggregate(
+            last_modified=Max('modified_at'),
+            resource_last_modified=Max('resource__modified_at', filter=feed_filter),
+            count=Count('id', filter=feed_filter),
+        )
+        etag = quote_etag(hashlib.md5(
+            '{}:{}:{}:{}'.format(user.pk, state['count'], state['last_modified'], state['resource_last_modified'])
+            .encode()).hexdigest())
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.get_feed_response(
+                reservations.filter(feed_filter).select_related('resource').order_by('begin', 'id'),
+                state['count'], cache_key='ical_feed:{}'.format(etag.strip('"')),
+            )
+        response['ETag'] = etag
         return response
+
+    def get_feed_filter(self):
+        past_days = getattr(settings, 'RESPA_ICAL_FEED_PAST_DAYS', 0)
+        feed_filter = Q(end__gte=timezone.now() - datetime.timedelta(days=past_days))
+        return feed_filter & ~Q(state__in=(Reservation.CANCELLED, Reservation.DENIED))
+
+    def get_feed_response(self, reservations, count, cache_key):
+        ical_file = cache.get(cache_key)
+        if ical_file is not None:
+            return HttpResponse(ical_file, content_type=ICAL_CONTENT_TYPE)
+
+        timeout = getattr(settings, 'RESPA_ICAL_FEED_CACHE_TIMEOUT', 3600)
+        if count <= getattr(settings, 'RESPA_ICAL_FEED_STREAMING_THRESHOLD', 500):
+            ical_file = b''.join(iter_reservations_ical_file(reservations))
+            cache.set(cache_key, ical_file, timeout)
+            return HttpResponse(ical_file, content_type=ICAL_CONTENT_TYPE)
+
+        def stream():
+            chunks = []
+            for chunk in iter_reservations_ical_file(reservations.iterator()):
+                chunks.append(chunk)
+                yield chunk
+            cache.set(cache_key, b''.join(chunks), timeout)
+
+        return StreamingHttpResponse(stream(), content_type=ICAL_CONTENT_TYPE)
@@ -33,6 +33,13 @@ env = environ.Env(
     INTERNAL_IPS=(list, []),
     SMS_ENABLED=(bool, False),
     MAIL_ENABLED=(bool, False),
+    NOTIFICATION_OUTBOX_ENABLED=(bool, False),
+    ICAL_FEED_PAST_DAYS=(int, 0),
+    ICAL_FEED_CACHE_TIMEOUT=(int, 3600),
+    ICAL_FEED_STREAMING_THRESHOLD=(int, 500),
+    API_CACHE_URL=(str, ''),
+    API_CACHE_TIMEOUT=(int, 300),
+    MAINTENANCE_MODE_CACHE_TIMEOUT=(int, 10),
     MAIL_DEFAULT_FROM=(str, ''),
     MAIL_MAILGUN_KEY=(str, ''),
     MAIL_MAILGUN_DOMAIN=(str, ''),
@@ -68,6 +75,7 @@ env = environ.Env(
     GSM_NOTIFICATION_ADDRESS=(str, ''),
     OUTLOOK_EMAIL_DOMAIN=(str, ''),
     OUTLOOK_POLLING_RATE=(float, 5.0),
+    OUTLOOK_POLLING_WORKERS=(int, 4),
     HELUSERS_PROVIDER=(str, 'helusers.providers.helsinki'),
     HELUSERS_SOCIALACCOUNT_ADAPTER=(str, 'helusers.adapter.SocialAccountAdapter'),
     AUTHENTICATION_CLASSES=(list, ['respa.providers.turku_oidc.jwt.JWTAuthentication']),
@@ -91,6 +99,8 @@ env = environ.Env(
     O365_CALLBACK_URL=(str, None),
     O365_SYNC_DAYS_BACK=(int, 8),
     O365_SYNC_DAYS_FORWARD=(int, 92),
+    O365_SYNC_WORKERS=(int, 4),
+    O365_SYNC_MIN_INTERVAL=(int, 10),
     O365_CALENDAR_AVAILABILITY_EVENT_PREFIX=(str, "Varattavissa Varaamo"),
     O365_CALENDAR_RESERVATION_EVENT_PREFIX=(str, "Varaus Varaamo"),
     O365_CALENDAR_RESERVER_INFO_MARK=(str, "Varaaja:"),
@@ -445,6 +455,7 @@ SESSION_COOKIE_NAME = '%s-sessionid' % env.str('COOKIE_PREFIX')
 GSM_NOTIFICATION_ADDRESS = env('GSM_NOTIFICATION_ADDRESS')
 OUTLOOK_EMAIL_DOMAIN = env('OUTLOOK_EMAIL_DOMAIN')
 OUTLOOK_POLLING_RATE = env('OUTLOOK_POLLING_RATE')
+OUTLOOK_POLLING_WORKERS = env('OUTLOOK_POLLING_WORKERS')
 
 O365_CLIENT_ID=env('O365_CLIENT_ID')
 O365_CLIENT_SECRET=env('O365_CLIENT_SECRET')
@@ -455,6 +466,8 @@ O365_NOTIFICATION_URL=env('O365_NOTIFICATION_URL')
 O365_CALLBACK_URL=env('O365_CALLBACK_URL')
 O365_SYNC_DAYS_FORWARD=env('O365_SYNC_DAYS_FORWARD')
 O365_SYNC_DAYS_BACK=env('O365_SYNC_DAYS_BACK')
+O365_SYNC_WORKERS=env('O365_SYNC_WORKERS')
+O365_SYNC_MIN_INTERVAL=env('O365_SYNC_MIN_INTERVAL')
 O365_CALENDAR_AVAILABILITY_EVENT_PREFIX=env('O365_CALENDAR_AVAILABILITY_EVENT_PREFIX')
 O365_CALENDAR_RESERVATION_EVENT_PREFIX=env('O365_CALENDAR_RESERVATION_EVENT_PREFIX')
 O365_CALENDAR_RESERVER_INFO_MARK=env('O365_CALENDAR_RESERVER_INFO_MARK')
@@ -471,6 +484,20 @@ THUMBNAIL_PROCESSORS = (
 RESPA_SMS_ENABLED = env('SMS_ENABLED')
 RESPA_MAILS_ENABLED = env('MAIL_ENABLED')
 RESPA_MAILS_FROM_ADDRESS = env('MAIL_DEFAULT_FROM')
+RESPA_NOTIFICATION_OUTBOX_ENABLED = env('NOTIFICATION_OUTBOX_ENABLED')
+RESPA_ICAL_FEED_PAST_DAYS = env('ICAL_FEED_PAST_DAYS')
+RESPA_ICAL_FEED_CACHE_TIMEOUT = env('ICAL_FEED_CACHE_TIMEOUT')
+RESPA_ICAL_FEED_STREAMING_THRESHOLD = env('ICAL_FEED_STREAMING_THRESHOLD')
+RESPA_API_CACHE_TIMEOUT = env('API_CACHE_TIMEOUT')
+RESPA_MAINTENANCE_MODE_CACHE_TIMEOUT = env('MAINTENANCE_MODE_CACHE_TIMEOUT')
+# API responses are cached only in a cache shared by all the processes
+RESPA_API_CACHE = None
+if env('API_CACHE_URL'):
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'api': env.cache_url('API_CACHE_URL'),
+    }
+    RESPA_API_CACHE = 'api'
 RESPA_CATERINGS_ENABLED = False
 RESPA_COMMENTS_ENABLED = False
 RESPA_DOCX_TEMPLATE = os.path.join(BASE_DIR, 'reports', 'data', 'default.docx')
@@ -18,5 +18,7 @@ STRONG_AUTH_CLAIMS=('very_strong_auth', )
 HELUSERS_PROVIDER = 'helusers.providers.helsinki'
 RESPA_PAYMENTS_BAMBORA_TOKEN_VALID_DAYS = 3
 RESPA_PAYMENTS_PAYMENT_REQUESTED_WAITING_TIME = 24
+# Maintenance modes of the test fixtures are rolled back without signals
+RESPA_MAINTENANCE_MODE_CACHE_TIMEOUT = 0
 SIMPLE_JWT['AUDIENCE'] = 'https://dummy-aud.respa.turku.fi'
 SIMPLE_JWT['SIGNING_KEY'] = 'very-secret-signing-key'
\ No newline at end of file
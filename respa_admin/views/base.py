@@ -45,10 +45,18 @@ class PeriodMixin():
 
     def save_period_formset(self, period_formset):
         try:
+            old_periods = self._get_period_snapshot()
             self._delete_extra_periods_days(period_formset)
             period_formset.instance = self.object
             period_formset.save()
-            self.object.update_opening_hours()
+            if not old_periods:
+                # Nothing to compare against, e.g. a newly created resource
+                # which gets its opening hours from the unit periods.
+                self.object.update_opening_hours()
+            else:
+                changed_range = self._get_changed_date_range(old_periods, self._get_period_snapshot())
+                if changed_range:
+                    self.object.update_opening_hours(*changed_range)
         except exceptions.ValidationError as exc:
             period_formset.errors.extend(exc.messages)
             raise
@@ -65,6 +73,42 @@ class PeriodMixin():
             period.days.forms.append(temp_day_form)
         return period_formset
 
+    def _get_period_snapshot(self):
+        """
+        Returns the periods of the object and their days as comparable values,
+        keyed by period id.
+        """
+        if not self.object.pk:
+            return {}
+        period_filter_args = {self.object._meta.model_name: self.object}
+        periods = Period.objects.filter(**period_filter_args).prefetch_related('days')
+        return {
+            period.id: (
+                period.start, period.end,
+                [(day.id, day.weekday, day.opens, day.closes, day.closed)
+                 for day in sorted(period.days.all(), key=lambda day: day.id)],
+            )
+            for period in periods
+        }
+
+    def _get_changed_date_range(self, old_periods, new_periods):
+        """
+        Returns the first and last date covered by the periods that were
+        added, removed or modified, or None if nothing was changed.
+        """
+        dates = []
+        for period_id in old_periods.keys() | new_periods.keys():
+            old = old_periods.get(period_id)
+            new = new_periods.get(period_id)
+            if old == new:
+                continue
+            for period in (old, new):
+                if period:
+                    dates.extend(period[:2])
+        if not dates:
+            return None
+        return min(dates), max(dates)
+
     def _delete_extra_periods_days(self, period_formset_with_days):
         data = period_formset_with_days.data
         period_ids = self.get_formset_ids('periods', data)
@@ -3,15 +3,21 @@ Download Exchange events into Respa as reservations.
 """
 import datetime
 import logging
-import iso8601
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
+import iso8601
 from lxml import etree
+from django.conf import settings
+from django.db import IntegrityError, connections
 from django.db.transaction import atomic
 from django.utils.timezone import now
 
 from sentry_sdk import configure_scope, push_scope, capture_message
 
-from resources.models.reservation import Reservation
+from resources.models.reservation import Reservation, is_reservation_overlap_error
 from respa_exchange.ews.calendar import GetCalendarItemsRequest, FindCalendarItemsRequest
 from respa_exchange.ews.user import ResolveNamesRequest
 from respa_exchange.ews.objs import ItemID
@@ -21,6 +27,10 @@ from respa_exchange.models import ExchangeReservation, ExchangeUser, \
 
 log = logging.getLogger(__name__)
 
+# Organizer lookups create and update ExchangeUsers, so concurrent
+# downloads do them one at a time.
+_organizer_lock = threading.Lock()
+
 
 def element_to_string(elem):
     return etree.tostring(elem, pretty_print=True, encoding=str)
@@ -223,14 +233,36 @@ def _find_exchange_user_by_mailbox(ex_resource, mailbox, last_updated_at=None):
     return ex_user
 
 
-def _determine_organizer(ex_resource, calendar_item):
+class MailboxUserCache:
+    """
+    Maps organizer mailboxes to ExchangeUsers during a sync, so that each
+    mailbox is looked up, and resolved from EWS, only once. A mailbox is
+    looked up again for items updated after its user was.
+    """
+
+    def __init__(self):
+        self._users = {}
+
+    def get(self, ex_resource, mailbox, last_updated_at=None):
+        key = (ex_resource.exchange_id, etree.tostring(mailbox, with_tail=False))
+        ex_user = self._users.get(key)
+        if key not in self._users or self._is_outdated(ex_user, last_updated_at):
+            ex_user = self._users[key] = _find_exchange_user_by_mailbox(ex_resource, mailbox, last_updated_at)
+        return ex_user
+
+    def _is_outdated(self, ex_user, last_updated_at):
+        return (ex_user is not None and last_updated_at is not None and ex_user.updated_at is not None and
+                last_updated_at > ex_user.updated_at)
+
+
+def _determine_organizer(ex_resource, calendar_item, user_cache):
     item_updated_at = calendar_item.get('updated_at')
     organizer = calendar_item.find('t:Organizer', namespaces=NAMESPACES)
     if organizer is None:
         return None
 
     mailbox = organizer.find('t:Mailbox', namespaces=NAMESPACES)
-    ex_user = _find_exchange_user_by_mailbox(ex_resource, mailbox, item_updated_at)
+    ex_user = user_cache.get(ex_resource, mailbox, item_updated_at)
     if ex_user is None:
         return None
 
@@ -245,12 +277,12 @@ def _determine_organizer(ex_resource, calendar_item):
         if first_attendee is None:
             return None
         mailbox = first_attendee.find('t:Mailbox', namespaces=NAMESPACES)
-        ex_user = _find_exchange_user_by_mailbox(ex_resource, mailbox, item_updated_at)
+        ex_user = user_cache.get(ex_resource, mailbox, item_updated_at)
 
     return ex_user
 
 
-def _parse_item_props(ex_resource, item):
+def _parse_item_props(ex_resource, item, user_cache=None):
     item_props = dict(
         start=iso8601.parse_date(item.find('t:Start', namespaces=NAMESPACES).text),
         end=iso8601.parse_date(item.find('t:End', namespaces=NAMESPACES).text),
@@ -263,7 +295,8 @@ def _parse_item_props(ex_resource, item):
         if el.text:
             item_props['updated_at'] = iso8601.parse_date(el.text)
 
-    organizer = _determine_organizer(ex_resource, item)
+    with _organizer_lock:
+        organizer = _determine_organizer(ex_resource, item, user_cache or MailboxUserCache())
     if organizer is None:
         # The DisplayTo field appears to usually (?) contain the
         # name of the reserver.
@@ -303,103 +336,323 @@ def fetch_reservation_data(ex_reservation):
     return items[0]
 
 
-@atomic
-def sync_from_exchange(ex_resource, future_days=365, no_op=False):
+class ExchangeSessionPool:
+    """
+    A pool of EWS sessions, so that concurrent downloads each use their own
+    session while reusing authenticated connections.
     """
-    Synchronize from Exchange to Respa
 
-    Synchronizes current and future events for the given Exchange resource into
-    the relevant Respa resource as reservations.
+    def __init__(self):
+        self._idle_sessions = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self, exchange):
+        """
+        Borrow a session of the given Exchange configuration for the duration of the block.
+
+        :type exchange: respa_exchange.models.ExchangeConfiguration
+        :rtype: respa_exchange.ews.session.ExchangeSession
+        """
+        with self._lock:
+            sessions = self._idle_sessions[exchange.pk]
+            session = sessions.pop() if sessions else None
+        if session is None:
+            session = exchange.create_ews_session()
+        try:
+            yield session
+        finally:
+            with self._lock:
+                self._idle_sessions[exchange.pk].append(session)
+
+
+class ExchangeDownload:
+    """
+    Calendar items downloaded from Exchange for a resource.
 
-    :param ex_resource: The Exchange resource to sync
-    :type ex_resource: respa_exchange.models.ExchangeResource
-    :param future_days: How many days into the future to look
-    :type future_days: int
-    :param no_op: If True, do not save the reservations
-    :type no_op: bool
+    :ivar hashes: Item ID hashes of all the items in the period
+    :ivar changed_items: New and changed items, as (ItemID, item props) pairs
     """
 
-    # To avoid race conditions with the Respa API processes, we lock the
-    # resource on database level before starting sync.
-    ex_resource = ExchangeResource.objects.select_for_update().get(id=ex_resource.id)
+    def __init__(self, start_date, end_date):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.hashes = set()
+        self.changed_items = []
 
-    if not ex_resource.sync_to_respa and not no_op:
-        return
-    start_date = now().replace(hour=0, minute=0, second=0)
-    end_date = start_date + datetime.timedelta(days=future_days)
 
-    with configure_scope() as scope:
-        scope.set_extra('resource', str(ex_resource))
+def download_from_exchange(ex_resource, start_date, end_date, session=None, user_cache=None):
+    """
+    Download calendar items of an Exchange resource between the given dates.
+
+    Items whose change key matches the stored one are skipped as soon as they
+    are parsed; only new and changed items are kept and parsed further.
 
+    :type ex_resource: respa_exchange.models.ExchangeResource
+    :type user_cache: MailboxUserCache|None
+    :rtype: ExchangeDownload
+    """
+    if user_cache is None:
+        user_cache = MailboxUserCache()
     log.info(
         "%s: Requesting items between (%s..%s)",
         ex_resource.principal_email,
         start_date,
         end_date
     )
+    if session is None:
+        session = ex_resource.exchange.get_ews_session()
+    known_change_keys = dict(
+        ExchangeReservation.objects.filter(reservation__resource__exchange_resource=ex_resource)
+        .values_list('item_id_hash', '_change_key')
+    )
     gcir = FindCalendarItemsRequest(
         principal=ex_resource.principal_email,
         start_date=start_date,
         end_date=end_date
     )
-    session = ex_resource.exchange.get_ews_session()
-    calendar_items = {}
-    for item in gcir.send(session):
-        calendar_items[ItemID.from_tree(item)] = item
-
-    hashes = set(item_id.hash for item_id in calendar_items.keys())
+    download = ExchangeDownload(start_date, end_date)
+    for item in gcir.iter_items(session):
+        item_id = ItemID.from_tree(item)
+        if item_id.hash in download.hashes:
+            continue
+        download.hashes.add(item_id.hash)
+        if known_change_keys.get(item_id.hash) == item_id.change_key:
+            continue
+        with configure_scope() as scope:
+            # Send the raw XML to Sentry for better debugging
+            scope.set_extra('item_xml', element_to_string(item))
+        download.changed_items.append((item_id, _parse_item_props(ex_resource, item, user_cache)))
 
     log.info(
-        "%s: Received %d items",
+        "%s: Received %d items, %d new or changed",
         ex_resource.principal_email,
-        len(calendar_items)
+        len(download.hashes),
+        len(download.changed_items)
     )
+    return download
 
-    if no_op:
-        with configure_scope() as scope:
-            scope.remove_extra('resource')
+
+@atomic
+def apply_exchange_download(ex_resource, download):
+    """
+    Apply the items downloaded from Exchange into Respa reservations.
+
+    Vanished items are deleted, and new and changed items are created and
+    updated, in batches. The post_save signals of the reservations are sent
+    after the transaction commits. If a batch would overlap an existing
+    reservation, its items are saved one at a time, skipping the overlapping
+    ones.
+
+    :type ex_resource: respa_exchange.models.ExchangeResource
+    :type download: ExchangeDownload
+    """
+
+    # To avoid race conditions with the Respa API processes, we lock the
+    # resource on database level while applying the changes.
+    ex_resource = ExchangeResource.objects.select_for_update().get(id=ex_resource.id)
+    if not ex_resource.sync_to_respa:
         return
 
     # First handle deletions . . .
-    items_to_delete = ExchangeReservation.objects.select_related("reservation").filter(
+    items_to_delete = list(ExchangeReservation.objects.select_related("reservation__resource").filter(
         managed_in_exchange=True,  # Reservations we've downloaded ...
-        reservation__begin__gte=start_date,  # that are in ...
-        reservation__end__lte=end_date,  # ... our get items range ...
+        reservation__begin__gte=download.start_date,  # that are in ...
+        reservation__end__lte=download.end_date,  # ... our get items range ...
         reservation__resource__exchange_resource=ex_resource,  # and belong to this resource,
-    ).exclude(item_id_hash__in=hashes)  # but aren't ones we're going to mangle
+    ).exclude(item_id_hash__in=download.hashes))  # but aren't ones we're going to mangle
 
-    for ex_reservation in items_to_delete:
-        log.info("Deleting: %s", ex_reservation)
-        reservation = ex_reservation.reservation
-        ex_reservation.delete()
-        reservation.delete()
+    if items_to_delete:
+        log.info("%s: Deleting %d items", ex_resource.principal_email, len(items_to_delete))
+        reservations = [ex_reservation.reservation for ex_reservation in items_to_delete]
+        for reservation in reservations:
+            reservation._from_exchange = True  # Set a flag to prevent deleting it from Exchange
+        ExchangeReservation.objects.filter(pk__in=[ex_reservation.pk for ex_reservation in items_to_delete]).delete()
+        Reservation.objects.delete_stack(reservations)
 
     # And then creations/additions
 
     extant_exchange_reservations = {
         ex_reservation.item_id_hash: ex_reservation
         for ex_reservation
-        in ExchangeReservation.objects.select_related("reservation").filter(item_id_hash__in=hashes)
+        in ExchangeReservation.objects.select_related("reservation__resource").filter(
+            item_id_hash__in=[item_id.hash for item_id, _ in download.changed_items]
+        )
     }
 
-    for item_id, item in calendar_items.items():
-        with configure_scope() as scope:
-            # Send the raw XML to Sentry for better debugging
-            scope.set_extra('item_xml', element_to_string(item))
-
+    created_items = []
+    updated_items = []
+    for item_id, item_props in download.changed_items:
         ex_reservation = extant_exchange_reservations.get(item_id.hash)
+        if not ex_reservation:  # It's a new one!
+            created_items.append((item_id, item_props))
+        elif ex_reservation._change_key != item_id.change_key:
+            # Things changed, so edit the reservation
+            updated_items.append((item_id, ex_reservation, item_props))
 
-        item_props = _parse_item_props(ex_resource, item)
+    if created_items:
+        _create_reservations_from_exchange(ex_resource, created_items)
+    if updated_items:
+        _update_reservations_from_exchange(ex_resource, updated_items)
+
+    log.info("%s: download processing complete", ex_resource.principal_email)
 
-        if not ex_reservation:  # It's a new one!
-            ex_reservation = _create_reservation_from_exchange(item_id, ex_resource, item_props)
-        else:
-            if ex_reservation._change_key != item_id.change_key:
-                # Things changed, so edit the reservation
-                _update_reservation_from_exchange(item_id, ex_reservation, ex_resource, item_props)
+
+def _create_reservations_from_exchange(ex_resource, items):
+    reservations = []
+    for item_id, item_props in items:
+        reservation = Reservation(resource=ex_resource.resource)
+        _populate_reservation(reservation, ex_resource, item_props)
+        reservations.append(reservation)
+    try:
+        with atomic():
+            reservations = Reservation.objects.create_stack(reservations, on_commit=True)
+    except IntegrityError as exc:
+        if not is_reservation_overlap_error(exc):
+            raise
+        for item_id, item_props in items:
+            _apply_item(ex_resource, item_id,
+                        lambda: _create_reservation_from_exchange(item_id, ex_resource, item_props))
+        return
+
+    ex_reservations = []
+    for (item_id, item_props), reservation in zip(items, reservations):
+        ex_reservation = ExchangeReservation(
+            exchange=ex_resource.exchange,
+            principal_email=ex_resource.principal_email,
+            reservation=reservation,
+            managed_in_exchange=True,
+        )
+        ex_reservation.item_id = item_id
+        ex_reservation.organizer = item_props.get("organizer")
+        ex_reservations.append(ex_reservation)
+    ExchangeReservation.objects.bulk_create(ex_reservations)
+    log.info("%s: Created %d items", ex_resource.principal_email, len(ex_reservations))
+
+
+def _update_reservations_from_exchange(ex_resource, items):
+    reservations = []
+    for item_id, ex_reservation, item_props in items:
+        _populate_reservation(ex_reservation.reservation, ex_resource, item_props, ex_reservation)
+        reservations.append(ex_reservation.reservation)
+    try:
+        with atomic():
+            Reservation.objects.update_stack(reservations, fields=[
+                'begin', 'end', 'event_subject', 'reserver_email_address', 'reserver_name', 'host_name', 'comments',
+            ], on_commit=True)
+    except IntegrityError as exc:
+        if not is_reservation_overlap_error(exc):
+            raise
+        for item_id, ex_reservation, item_props in items:
+            _apply_item(ex_resource, item_id, lambda: _update_reservation_from_exchange(
+                item_id, ex_reservation, ex_resource, item_props
+            ))
+        return
+
+    ex_reservations = []
+    for item_id, ex_reservation, item_props in items:
+        ex_reservation.item_id = item_id
+        if not ex_reservation.managed_in_exchange:
+            ex_reservation.organizer = item_props.get("organizer")
+        ex_reservations.append(ex_reservation)
+    ExchangeReservation.objects.bulk_update(ex_reservations, ['_item_id', '_change_key', 'item_id_hash', 'organizer'])
+    log.info("%s: Updated %d items", ex_resource.principal_email, len(ex_reservations))
+
+
+def _apply_item(ex_resource, item_id, apply):
+    try:
+        with atomic():
+            apply()
+    except IntegrityError as exc:
+        # Exchange calendars allow double bookings, Respa does not
+        if not is_reservation_overlap_error(exc):
+            raise
+        log.warning("%s: skipping item %s that overlaps another reservation", ex_resource.principal_email, item_id)
+
+
+def sync_from_exchange(ex_resource, future_days=365, no_op=False, session=None, user_cache=None):
+    """
+    Synchronize from Exchange to Respa
+
+    Synchronizes current and future events for the given Exchange resource into
+    the relevant Respa resource as reservations. The resource is locked only
+    while the downloaded items are applied.
+
+    :param ex_resource: The Exchange resource to sync
+    :type ex_resource: respa_exchange.models.ExchangeResource
+    :param future_days: How many days into the future to look
+    :type future_days: int
+    :param no_op: If True, do not save the reservations
+    :type no_op: bool
+    :param session: EWS session to download with, by default the session of the Exchange configuration
+    :type session: respa_exchange.ews.session.ExchangeSession|None
+    :param user_cache: Organizer lookups to share with other syncs
+    :type user_cache: MailboxUserCache|None
+    """
+    if not ex_resource.sync_to_respa and not no_op:
+        return
+    start_date = now().replace(hour=0, minute=0, second=0)
+    end_date = start_date + datetime.timedelta(days=future_days)
 
     with configure_scope() as scope:
-        scope.remove_extra('item_xml')
-        scope.remove_extra('resource')
+        scope.set_extra('resource', str(ex_resource))
+    try:
+        if no_op:
+            for _ in FindCalendarItemsRequest(
+                principal=ex_resource.principal_email,
+                start_date=start_date,
+                end_date=end_date
+            ).iter_items(session or ex_resource.exchange.get_ews_session()):
+                pass
+            return
+        download = download_from_exchange(ex_resource, start_date, end_date, session=session, user_cache=user_cache)
+        apply_exchange_download(ex_resource, download)
+    finally:
+        with configure_scope() as scope:
+            scope.remove_extra('item_xml')
+            scope.remove_extra('resource')
 
-    log.info("%s: download processing complete", ex_resource.principal_email)
+
+def sync_many_from_exchange(ex_resources, future_days=365, workers=None):
+    """
+    Synchronize several Exchange resources from Exchange to Respa concurrently
+
+    Each resource is downloaded and applied in a thread of its own, using
+    pooled EWS sessions. A failing resource doesn't stop the others.
+
+    :type ex_resources: list[respa_exchange.models.ExchangeResource]
+    :param workers: Number of threads, by default RESPA_EXCHANGE_DOWNLOAD_WORKERS
+    :type workers: int|None
+    :return: The resources that failed to sync
+    :rtype: list[respa_exchange.models.ExchangeResource]
+    """
+    if workers is None:
+        workers = getattr(settings, "RESPA_EXCHANGE_DOWNLOAD_WORKERS", 4)
+    pool = ExchangeSessionPool()
+    user_cache = MailboxUserCache()
+    failed = []
+
+    def sync(ex_resource):
+        try:
+            with pool.session(ex_resource.exchange) as session:
+                sync_from_exchange(ex_resource, future_days=future_days, session=session, user_cache=user_cache)
+        except Exception:
+            log.exception("%s: download failed", ex_resource.principal_email)
+            failed.append(ex_resource)
+
+    if workers <= 1:
+        for ex_resource in ex_resources:
+            sync(ex_resource)
+        return failed
+
+    def sync_in_thread(ex_resource):
+        try:
+            sync(ex_resource)
+        finally:
+            # Each thread has its own database connections
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(sync_in_thread, ex_resources):
+            pass
+    return failed
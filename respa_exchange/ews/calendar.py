@@ -44,6 +44,15 @@ class FindCalendarItemsRequest(EWSRequest):
         resp = sess.soap(self)
         return resp.xpath("//t:CalendarItem", namespaces=NAMESPACES)
 
+    def iter_items(self, sess):
+        """
+        Send the calendar item request, and yield CalendarItem XML elements as they are received.
+
+        :type sess: respa_exchange.session.ExchangeSession
+        :rtype: Iterable[lxml.etree.Element]
+        """
+        return sess.soap_iter(self, tag="{%s}CalendarItem" % NAMESPACES["t"])
+
 
 class GetCalendarItemsRequest(EWSRequest):
     """
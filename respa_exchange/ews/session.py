@@ -105,6 +105,36 @@ class ExchangeSession(requests.Session):
                 continue
             yield self._process_soap_response(data)
 
+    def soap_iter(self, request, tag, timeout=10):
+        """
+        Send an EWSRequest by SOAP and yield the elements with the given tag as the response is parsed.
+
+        The response is parsed incrementally, and the yielded elements are
+        detached from the tree so that the whole response is never kept in
+        memory.
+
+        :type request: respa_exchange.base.EWSRequest
+        :param tag: Clark notation tag of the elements to yield
+        :rtype: Iterable[lxml.etree.Element]
+        """
+        resp = self.post(self.url, timeout=timeout, stream=True, **self._prepare_soap(request))
+        try:
+            if resp.status_code != 500:
+                resp.raise_for_status()
+            fault_tag = "{%s}Fault" % NAMESPACES["s"]
+            parser = etree.XMLPullParser(events=("end",), tag=(tag, fault_tag))
+            for data in resp.iter_content(chunk_size=64 * 1024):
+                parser.feed(data)
+                for _, elem in parser.read_events():
+                    if elem.tag == fault_tag:
+                        raise SoapFault.from_xml(elem)
+                    elem.getparent().remove(elem)
+                    yield elem
+            parser.close()
+            resp.raise_for_status()
+        finally:
+            resp.close()
+
     def _process_soap_response(self, content):
         if content.count(SOAP_ENVELOPE_TAG) > 1:
             self.log.debug('Multiple envelopes in response %r, using `recover` mode for parsing.', content)
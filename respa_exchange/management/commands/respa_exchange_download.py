@@ -1,8 +1,8 @@
 import logging
 
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
 
-from respa_exchange.downloader import sync_from_exchange
+from respa_exchange.downloader import sync_many_from_exchange
 from respa_exchange.management.base import configure_logging, get_active_download_resources, select_resources
 from respa_exchange.models import ExchangeConfiguration
 
@@ -13,6 +13,8 @@ class Command(BaseCommand):
                             help='List supported exchange resources')
         parser.add_argument('--resource', action='append', dest='resources',
                             help='Sync only specified resource(s)')
+        parser.add_argument('--workers', type=int, dest='workers', default=None,
+                            help='Number of resources to sync concurrently')
 
     def handle(self, verbosity, *args, **options):
         if verbosity >= 2:
@@ -31,5 +33,8 @@ class Command(BaseCommand):
         if options['resources']:
             resources = select_resources(resources, options['resources'])
 
-        for resource in resources:
-            sync_from_exchange(resource)
+        failed = sync_many_from_exchange(resources, workers=options['workers'])
+        if failed:
+            raise CommandError('Sync failed for %d resource(s): %s' % (
+                len(failed), ', '.join(str(res) for res in failed)
+            ))
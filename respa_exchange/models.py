@@ -61,15 +61,23 @@ class ExchangeConfiguration(models.Model):
         """
         if hasattr(self, '_ews_session'):
             return self._ews_session
+        self._ews_session = self.create_ews_session()
+        return self._ews_session
+
+    def create_ews_session(self):
+        """
+        Create a new EWS session, not shared with other users of this configuration.
+
+        :rtype:   respa_exchange.ews.session.ExchangeSession
+        """
         session_class = import_string(
             getattr(settings, "RESPA_EXCHANGE_EWS_SESSION_CLASS", "respa_exchange.ews.session.ExchangeSession")
         )
-        self._ews_session = session_class(
+        return session_class(
             url=self.url,
             username=self.username,
             password=self.password,
         )
-        return self._ews_session
 
 
 class ExchangeResource(models.Model):
@@ -59,6 +59,10 @@ def handle_reservation_delete(instance, **kwargs):
     if not getattr(settings, "RESPA_EXCHANGE_ENABLED", True):
         return
 
+    if getattr(instance, "_from_exchange", False):
+        # Deleted by the Downloader, as it was deleted in Exchange
+        return
+
     with transaction.atomic():
         exchange_resource = ExchangeResource.objects.filter(
             sync_from_respa=True, resource=instance.resource
@@ -1,10 +1,14 @@
 from datetime import timedelta
+from types import SimpleNamespace
 
 import pytest
 from django.utils.crypto import get_random_string
 from django.utils.timezone import now
+from lxml import etree
 
-from respa_exchange.downloader import sync_from_exchange
+from resources.models import Resource, Unit
+from respa_exchange import downloader
+from respa_exchange.downloader import sync_from_exchange, sync_many_from_exchange
 from respa_exchange.ews.objs import ItemID
 from respa_exchange.models import ExchangeReservation, ExchangeResource
 from respa_exchange.tests.handlers import FindItemsHandler
@@ -80,3 +84,85 @@ def _check_imported_reservation(item_id, item_dict):
     assert moments_close_enough(ex.reservation.end, item_dict['end'])
 
     return ex
+
+
+@pytest.mark.django_db
+def test_download_many_skips_unchanged_items(settings, monkeypatch, space_resource_type, exchange):
+    delegate = FindItemsHandler()
+    ex_resources = []
+    for i in range(3):
+        resource = Resource.objects.create(
+            unit=Unit.objects.create(name='unit %d' % i), type=space_resource_type,
+            authentication='none', name='resource %d' % i
+        )
+        email = "%s@example.com" % get_random_string(8)
+        delegate.add_item(email, _generate_item_dict())
+        ex_resources.append(ExchangeResource.objects.create(
+            resource=resource, principal_email=email, exchange=exchange, sync_to_respa=True
+        ))
+    SoapSeller.wire(settings, delegate)
+
+    assert sync_many_from_exchange(ex_resources, workers=1) == []
+    assert all(ex_resource.reservations.count() == 1 for ex_resource in ex_resources)
+
+    # Items with unchanged change keys are not parsed again
+    parsed = []
+    parse_item_props = downloader._parse_item_props
+    monkeypatch.setattr(downloader, '_parse_item_props', lambda *args: parsed.append(args) or parse_item_props(*args))
+    assert sync_many_from_exchange(ex_resources, workers=1) == []
+    assert parsed == []
+    assert all(ex_resource.reservations.count() == 1 for ex_resource in ex_resources)
+
+
+@pytest.mark.django_db
+def test_download_applies_items_in_batches(settings, space_resource, exchange):
+    email = "%s@example.com" % get_random_string(8)
+    delegate = FindItemsHandler()
+    item_dicts = [_generate_item_dict() for i in range(3)]
+    for i, item_dict in enumerate(item_dicts):
+        item_dict['start'] += timedelta(hours=2 * i)
+        item_dict['end'] += timedelta(hours=2 * i)
+        delegate.add_item(email, item_dict)
+    SoapSeller.wire(settings, delegate)
+    ex_resource = ExchangeResource.objects.create(
+        resource=space_resource, principal_email=email, exchange=exchange, sync_to_respa=True
+    )
+
+    sync_from_exchange(ex_resource)
+    assert ex_resource.reservations.count() == 3
+
+    # An item overlapping another one is skipped, the rest of the batch is saved
+    overlapping = _generate_item_dict()
+    delegate.add_item(email, overlapping)
+    delegate.add_item(email, _generate_item_dict() | {
+        'start': now() + timedelta(hours=8), 'end': now() + timedelta(hours=9)
+    })
+    sync_from_exchange(ex_resource)
+    assert ex_resource.reservations.count() == 4
+    assert not ExchangeReservation.objects.filter(item_id_hash=overlapping['id'].hash).exists()
+
+    for item_dict in item_dicts[:2]:
+        delegate.delete_item(email, item_dict['id'])
+    sync_from_exchange(ex_resource)
+    assert ex_resource.reservations.count() == 2
+
+
+def test_mailbox_user_cache_looks_up_users_again_for_newer_items(monkeypatch):
+    updated_at = now()
+    looked_up = []
+
+    def find_user(ex_resource, mailbox, last_updated_at=None):
+        looked_up.append(last_updated_at)
+        return SimpleNamespace(updated_at=updated_at)
+
+    monkeypatch.setattr(downloader, '_find_exchange_user_by_mailbox', find_user)
+    ex_resource = SimpleNamespace(exchange_id=1)
+    mailbox = etree.fromstring('<Mailbox><Name>Bob Dummy</Name></Mailbox>')
+    cache = downloader.MailboxUserCache()
+
+    cache.get(ex_resource, mailbox, updated_at - timedelta(hours=1))
+    cache.get(ex_resource, mailbox, updated_at)
+    assert len(looked_up) == 1
+
+    cache.get(ex_resource, mailbox, updated_at + timedelta(hours=1))
+    assert looked_up == [updated_at - timedelta(hours=1), updated_at + timedelta(hours=1)]
@@ -1,13 +1,16 @@
 import logging
 import json
+from concurrent.futures import ThreadPoolExecutor
 
-from django.db import transaction, DatabaseError
+from django.db import connections, transaction, DatabaseError
+from django.db.models import Min
 from respa_o365.respa_availabilility_repository import RespaAvailabilityRepository
 from respa_o365.o365_availability_repository import O365AvailabilityRepository
 import string
 import random
 
 from django.conf import settings
+from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -36,50 +39,88 @@ def add_to_queue(link):
     OutlookSyncQueue.objects.create(calendar_link=link)
 
 def process_queue():
+    """
+    Sync every calendar link which has entries in the sync queue
+
+    All entries of a link are coalesced into a single sync. Links are synced
+    concurrently by O365_SYNC_WORKERS threads, and a link is synced at most
+    once per O365_SYNC_MIN_INTERVAL seconds; deferred entries are left in the
+    queue for the next round.
+    """
     try:
-        queue = OutlookSyncQueue.objects.all().order_by('calendar_link_id')
-        if not queue:
-            logger.info("Nothing to sync.")
-            return
-
-        logger.info("Handling {} entries from sync queue.".format(queue.count()))
-        previous_id = None
-        index = 0
-        for item in queue:
-            index = index + 1
-            logger.debug("%d: starting transaction", index)
-            with transaction.atomic():
-                logger.debug("%d: transaction started", index)
-                link_id = item.calendar_link_id
-                same_than_previous = link_id == previous_id
-                previous_id = link_id
-                if not same_than_previous:
-                    link = OutlookCalendarLink.objects.get(pk=link_id)
-                    perform_sync_to_exchange(link, lambda sync: sync.sync_all())
-                item.delete()
-            logger.debug("%d: transaction done", index)
+        link_ids = list(OutlookSyncQueue.objects.values('calendar_link_id')
+                        .annotate(queued_at=Min('created_at'))
+                        .order_by('queued_at')
+                        .values_list('calendar_link_id', flat=True))
     except DatabaseError as e:
         logger.warning("Outlook synchronisation failed due database error.", exc_info=e)
         return
+    if not link_ids:
+        logger.info("Nothing to sync.")
+        return
+
+    logger.info("Handling {} calendar links from sync queue.".format(len(link_ids)))
+    if settings.O365_SYNC_WORKERS <= 1:
+        for link_id in link_ids:
+            _process_queue_for_link(link_id)
+        return
+    with ThreadPoolExecutor(max_workers=settings.O365_SYNC_WORKERS) as executor:
+        for _ in executor.map(_process_queue_for_link_in_thread, link_ids):
+            pass
+
+def _process_queue_for_link_in_thread(link_id):
+    try:
+        _process_queue_for_link(link_id)
+    finally:
+        # Each thread has its own database connections
+        connections.close_all()
+
+def _process_queue_for_link(link_id):
+    try:
+        with transaction.atomic():
+            # A link being synced by another worker is locked and skipped here
+            link = OutlookCalendarLink.objects.select_for_update(skip_locked=True).filter(pk=link_id).first()
+            if link is None:
+                logger.info("Link %s is removed or being synced by another worker.", link_id)
+                return
+            item_ids = list(OutlookSyncQueue.objects.filter(calendar_link=link).values_list('id', flat=True))
+            if not item_ids:
+                return
+            interval = settings.O365_SYNC_MIN_INTERVAL
+            now = timezone.now()
+            if interval > 0 and link.last_synced_at and (now - link.last_synced_at).total_seconds() < interval:
+                logger.info("Link %s was synced less than %d seconds ago, deferring.", link_id, interval)
+                return
+            link.last_synced_at = now
+            OutlookCalendarLink.objects.filter(pk=link.pk).update(last_synced_at=now)
+            logger.debug("Link %s: syncing %d queued entries", link_id, len(item_ids))
+            perform_sync_to_exchange(link, lambda sync: sync.sync_all())
+            OutlookSyncQueue.objects.filter(id__in=item_ids).delete()
+    except DatabaseError as e:
+        logger.warning("Outlook synchronisation of link %s failed due database error.", link_id, exc_info=e)
+    except Exception:
+        logger.exception("Outlook synchronisation of link %s failed.", link_id)
 
 def perform_sync_to_exchange(link, func):
     # Sync reservations
     logger.info("Syncing reservations. User=%s, resource=%s (%s), link=%s", link.user.id, link.resource.name, link.resource.id, link.id)
     _perform_sync(link=link, func=func, respa_memento_field='respa_reservation_sync_memento',
-        o365_memento_field='exchange_reservation_sync_memento', outlook_model=OutlookCalendarReservation,
+        o365_memento_field='exchange_reservation_sync_memento', o365_delta_field='exchange_reservation_delta',
+        outlook_model=OutlookCalendarReservation,
         outlook_model_event_id_property='reservation_id', respa_repo=RespaReservations, o365_repo=O365ReservationRepository,
         event_prefix=settings.O365_CALENDAR_RESERVATION_EVENT_PREFIX, sync_actions=reservationSyncActions)
 
     # Sync availability / periods
     logger.info("Syncing availability. User=%s, resource=%s (%s), link=%s", link.user.id, link.resource.name, link.resource.id, link.id)
     _perform_sync(link=link, func=func, respa_memento_field='respa_availability_sync_memento',
-        o365_memento_field='exchange_availability_sync_memento', outlook_model=OutlookCalendarAvailability,
+        o365_memento_field='exchange_availability_sync_memento', o365_delta_field='exchange_availability_delta',
+        outlook_model=OutlookCalendarAvailability,
         outlook_model_event_id_property='period_id', respa_repo=RespaAvailabilityRepository, o365_repo=O365AvailabilityRepository,
         event_prefix=settings.O365_CALENDAR_AVAILABILITY_EVENT_PREFIX, sync_actions=availabilitySyncActions)
 
 
-def _perform_sync(link, func, respa_memento_field, o365_memento_field, outlook_model, outlook_model_event_id_property,
-        event_prefix, sync_actions, o365_repo, respa_repo):
+def _perform_sync(link, func, respa_memento_field, o365_memento_field, o365_delta_field, outlook_model,
+        outlook_model_event_id_property, event_prefix, sync_actions, o365_repo, respa_repo):
     token = link.token
     respa_memento = getattr(link, respa_memento_field)
     o365_memento = getattr(link, o365_memento_field)
@@ -101,7 +142,8 @@ def _perform_sync(link, func, respa_memento_field, o365_memento_field, outlook_m
     logger.debug("Initialise components")
     mapper = IdMapper(id_mappings)
     api = MicrosoftApi(token)
-    cal = O365Calendar(microsoft_api=api, known_events=known_exchange_items, event_prefix=event_prefix)
+    cal = O365Calendar(microsoft_api=api, known_events=known_exchange_items, event_prefix=event_prefix,
+        delta_state=getattr(link, o365_delta_field))
     o365 = o365_repo(cal)
     respa = respa_repo(resource_id=link.resource.id)
     sync = ReservationSync(respa, o365, id_mapper=mapper, respa_memento=respa_memento, remote_memento=o365_memento,
@@ -186,6 +228,7 @@ def _perform_sync(link, func, respa_memento_field, o365_memento_field, outlook_m
 
         setattr(link, o365_memento_field, sync.remote_memento())
         setattr(link, respa_memento_field, sync.respa_memento())
+        setattr(link, o365_delta_field, cal.delta_state)
         link.token = api.current_token()
         logger.debug("Saving link")
         with transaction.atomic():
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respa_o365', '0007_one_to_one'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outlookcalendarlink',
+            name='exchange_availability_delta',
+            field=models.TextField(null=True, verbose_name='Delta query state of Exchange availability'),
+        ),
+        migrations.AddField(
+            model_name='outlookcalendarlink',
+            name='exchange_reservation_delta',
+            field=models.TextField(null=True, verbose_name='Delta query state of Exchange reservations'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respa_o365', '0008_outlookcalendarlink_delta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outlookcalendarlink',
+            name='last_synced_at',
+            field=models.DateTimeField(null=True, verbose_name='Time of the last sync from the queue'),
+        ),
+    ]
@@ -28,8 +28,11 @@ class OutlookCalendarLink(models.Model):
     exchange_reservation_sync_memento = models.TextField(verbose_name=_('Last known state of Exchange reservations'), null=True)
     respa_availability_sync_memento = models.TextField(verbose_name=_('Last known state of Respa availability'), null=True)
     exchange_availability_sync_memento = models.TextField(verbose_name=_('Last known state of Exchange availability'), null=True)
+    exchange_reservation_delta = models.TextField(verbose_name=_('Delta query state of Exchange reservations'), null=True)
+    exchange_availability_delta = models.TextField(verbose_name=_('Delta query state of Exchange availability'), null=True)
     exchange_subscription_id = models.TextField(verbose_name=_('Id of the registered notification listener'), null=True)
     exchange_subscription_secret = models.TextField(verbose_name=_('Secret used by the notifier'), null=True)
+    last_synced_at = models.DateTimeField(verbose_name=_('Time of the last sync from the queue'), null=True)
 
 class OutlookCalendarReservation(models.Model):
     calendar_link = models.ForeignKey('OutlookCalendarLink', verbose_name=_('Calendar Link'),
@@ -45,13 +45,15 @@ local_tz = pytz.timezone(settings.TIME_ZONE)
 time_format = '%Y-%m-%dT%H:%M:%S.%f%z'
 
 class O365Calendar:
-    def __init__(self,  microsoft_api, known_events={}, calendar_id=None, event_prefix=None):
+    def __init__(self,  microsoft_api, known_events={}, calendar_id=None, event_prefix=None, delta_state=None):
         self._calendar_id = calendar_id
         self._api = microsoft_api
         self._known_events = known_events
         self._event_prefix = event_prefix
         self._start_date = (datetime.now(tz=timezone.utc) - timedelta(days=settings.O365_SYNC_DAYS_BACK)).replace(microsecond=0)
         self._end_date = (datetime.now(tz=timezone.utc) + timedelta(days=settings.O365_SYNC_DAYS_FORWARD)).replace(microsecond=0)
+        # Delta link of the calendar view and the window it was started for, as JSON
+        self.delta_state = delta_state
 
     def _parse_outlook_timestamp(self, ts):
         # 2017-08-29T04:00:00.0000000 is too long format. Shorten it to 26 characters, drop last number.
@@ -180,18 +182,24 @@ class O365Calendar:
         return event.change_key()
 
     def get_changes(self, memento=None):
-        # Microsoft API does not provide general API to fetch changes.
-        # There is delta for primary calendar, but this does not work in cases
-        # where calendar id needs to be defined. Thus this method is not
-        # able to return whole status as memento. Items seen during last
-        # call is used to detect deleted items between calls.
+        # Microsoft API provides changes with delta queries only for the primary
+        # calendar. Elsewhere, and when the delta link has expired, the whole
+        # calendar is read and items seen during last call are used to detect
+        # deleted items between calls.
         # Method is not immutable against memento as it should.
         if memento:
             time = datetime.strptime(memento, time_format)
         else:
             time = datetime(1970, 1, 1, tzinfo=timezone.utc)
-        events = self.get_events()
-        deleted_keys = set(self._known_events) - set(events)
+        changes = self._get_delta_changes() if self._calendar_id is None else None
+        if changes is None:
+            events, removed_ids = self.get_events(), None
+        else:
+            events, removed_ids = changes
+        if removed_ids is None:
+            deleted_keys = set(self._known_events) - set(events)
+        else:
+            deleted_keys = set(self._known_events) & removed_ids
         deleted = { key: self._known_events[key] for key in deleted_keys }
         self._known_events = events
         events = {i: e for i, e in events.items() if e.modified_at > time}
@@ -205,6 +213,73 @@ class O365Calendar:
 
         return result, new_memento.strftime(time_format)
 
+    def _get_delta_changes(self):
+        """
+        Return the changed events and the ids of removed events since the last call
+
+        Events which have left the synchronised period, or don't match the
+        prefix anymore, are removed. On the first round all the events are
+        returned and the removed ids are None. Returns None if the changes
+        are not available.
+        """
+        window_start = self._midnight_utc(self._start_date.date() - timedelta(days=1))
+        state = json.loads(self.delta_state) if self.delta_state else {}
+        if state.get('window_start') == window_start:
+            try:
+                events, removed_ids, delta_link = self._read_delta(state['delta_link'])
+                self._set_delta_state(window_start, delta_link)
+                return events, removed_ids
+            except DeltaLinkExpired:
+                logger.info("Delta link of the calendar has expired, reading all events")
+            except MicrosoftApiError:
+                return {}, set()
+
+        # The calendar view of a delta query doesn't move with time, so a new
+        # one is started every day. It covers whole days around the period.
+        window_end = self._midnight_utc(self._end_date.date() + timedelta(days=1))
+        qs = 'startDateTime={}&endDateTime={}'.format(parse.quote_plus(window_start), parse.quote_plus(window_end))
+        try:
+            events, _, delta_link = self._read_delta('me/calendarView/delta?{}'.format(qs))
+        except MicrosoftApiError:
+            self.delta_state = None
+            return None
+        self._set_delta_state(window_start, delta_link)
+        return events, None
+
+    def _midnight_utc(self, date):
+        return datetime(date.year, date.month, date.day, tzinfo=timezone.utc).isoformat()
+
+    def _set_delta_state(self, window_start, delta_link):
+        if delta_link:
+            self.delta_state = json.dumps({'window_start': window_start, 'delta_link': delta_link})
+        else:
+            self.delta_state = None
+
+    def _read_delta(self, url):
+        events = {}
+        removed_ids = set()
+        delta_link = None
+        while url is not None:
+            logger.info("Retrieving changed events from calendar at {}".format(url))
+            response = self._api.get(url)
+            if response is None:
+                raise MicrosoftApiError("Calendar not found at {}".format(url))
+            url = response.get('@odata.nextLink')
+            delta_link = response.get('@odata.deltaLink', delta_link)
+            for event in response.get('value'):
+                event_id = event.get("id")
+                e = None if '@removed' in event else self.json_to_event(event)
+                if e is not None and self.event_prefix_matches(e.subject) and self._is_in_period(e):
+                    events[event_id] = e
+                    removed_ids.discard(event_id)
+                else:
+                    events.pop(event_id, None)
+                    removed_ids.add(event_id)
+        return events, removed_ids, delta_link
+
+    def _is_in_period(self, event):
+        return event.end > self._start_date and event.begin < self._end_date
+
     def get_changes_by_ids(self, item_ids, memento=None):
         changes, new_memento = self.get_changes(memento)
         return {i: changes.get(i, (ChangeType.NO_CHANGE, "")) for i in item_ids}, new_memento
@@ -269,6 +344,8 @@ class MicrosoftApi:
         if response.status_code == 404:
             # Item is not available
             return None
+        if response.status_code == 410:
+            raise DeltaLinkExpired("Microsoft API delta link has expired for GET {}".format(path))
         return response.json()
 
     def post(self, path, json=None):
@@ -335,4 +412,8 @@ class O365CalendarError(Exception):
     pass
 
 class MicrosoftApiError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class DeltaLinkExpired(MicrosoftApiError):
+    pass
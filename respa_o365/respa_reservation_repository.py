@@ -4,8 +4,10 @@ from datetime import datetime, timezone, timedelta
 from functools import reduce
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 
 from resources.models import Reservation
+from resources.models.reservation import is_reservation_overlap_error
 from respa_o365.reservation_sync_item import model_to_item
 from respa_o365.sync_operations import ChangeType
 
@@ -33,8 +35,7 @@ class RespaReservations:
         reservation.begin = item.begin
         reservation.end = item.end
         reservation._from_o365_sync = True
-        reservation.set_state(Reservation.CONFIRMED, None)
-        reservation.save()
+        _save_or_deny(reservation, lambda: reservation.set_state(Reservation.CONFIRMED, None))
         return reservation.id, reservation_change_key(item)
 
     def set_item(self, item_id, item):
@@ -50,7 +51,7 @@ class RespaReservations:
         reservation.begin = item.begin
         reservation.end = item.end
         reservation._from_o365_sync = True
-        reservation.save()
+        _save_or_deny(reservation)
         return reservation_change_key(item)
 
     def get_item(self, item_id):
@@ -92,6 +93,26 @@ class RespaReservations:
         return {r.id: (status(r, time), reservation_change_key(r)) for r in reservations}, new_memento.strftime(time_format)
 
 
+def _save_or_deny(reservation, save=None):
+    """
+    Save the reservation, or save it as denied if it overlaps another reservation
+
+    Outlook calendars allow double bookings, Respa does not. The denied
+    reservation keeps the item mapped, and its event is removed from
+    Outlook on the next sync.
+    """
+    try:
+        with transaction.atomic():
+            (save or reservation.save)()
+    except IntegrityError as exc:
+        if not is_reservation_overlap_error(exc):
+            raise
+        logger.warning("Outlook event at {}-{} overlaps another reservation in resource {}, denying it".format(
+            reservation.begin, reservation.end, reservation.resource_id))
+        reservation.state = Reservation.DENIED
+        reservation.save()
+
+
 def status(reservation, time):
     # XXX: This method is debug code for logging purposes
     status = _status(reservation, time)
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import pytest
+
+from resources.tests.conftest import *  # noqa
+from respa_o365.models import OutlookCalendarLink
+from respa_o365.o365_calendar import DeltaLinkExpired, MicrosoftApiError
+
+
+class FakeGraphApi:
+    """
+    In-memory stand-in for the calendar view endpoints of Microsoft Graph
+
+    Has the same interface as MicrosoftApi. Every change to the events is
+    logged, and delta tokens are positions in that log.
+    """
+    page_size = 2
+
+    def __init__(self):
+        self.events = {}
+        self.changes = []
+        self.requests = []
+        self.delta_links_expired = False
+        self._clock = datetime.now(tz=timezone.utc).replace(microsecond=0)
+
+    def _tick(self):
+        self._clock += timedelta(seconds=1)
+        return self._clock.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    def _timestamp(self, dt):
+        return {'dateTime': dt.strftime('%Y-%m-%dT%H:%M:%S.%f0'), 'timeZone': 'UTC'}
+
+    def add_event(self, subject, begin, end):
+        event_id = 'event-{}'.format(len(self.changes))
+        now = self._tick()
+        self.events[event_id] = {
+            'id': event_id, 'subject': subject, 'body': {'content': ''},
+            'start': self._timestamp(begin), 'end': self._timestamp(end),
+            'createdDateTime': now, 'lastModifiedDateTime': now,
+        }
+        self.changes.append(event_id)
+        return event_id
+
+    def update_event(self, event_id, subject):
+        self.events[event_id].update(subject=subject, lastModifiedDateTime=self._tick())
+        self.changes.append(event_id)
+
+    def remove_event(self, event_id):
+        del self.events[event_id]
+        self.changes.append(event_id)
+
+    def get(self, path):
+        self.requests.append(path)
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        assert url.path.endswith('calendarView/delta')
+
+        if '$deltatoken' in query:
+            if self.delta_links_expired:
+                raise DeltaLinkExpired(path)
+            changed_ids = dict.fromkeys(self.changes[int(query['$deltatoken'][0]):])
+            items = [self.events.get(i, {'id': i, '@removed': {'reason': 'deleted'}}) for i in changed_ids]
+        else:
+            if '$skiptoken' not in query:
+                # Graph accepts only full date and time values for the calendar view
+                for param in ('startDateTime', 'endDateTime'):
+                    try:
+                        valid = datetime.fromisoformat(query[param][0]).tzinfo is not None
+                    except (KeyError, ValueError):
+                        valid = False
+                    if not valid:
+                        raise MicrosoftApiError('Invalid {} in {}'.format(param, path))
+            items = list(self.events.values())
+
+        skip = int(query.pop('$skiptoken', ['0'])[0])
+        response = {'value': items[skip:skip + self.page_size]}
+        if skip + self.page_size < len(items):
+            query['$skiptoken'] = [skip + self.page_size]
+            response['@odata.nextLink'] = '{}?{}'.format(url.path, urlencode(query, doseq=True))
+        else:
+            response['@odata.deltaLink'] = '{}?$deltatoken={}'.format(url.path, len(self.changes))
+        return response
+
+
+@pytest.fixture
+def fake_graph():
+    return FakeGraphApi()
+
+
+@pytest.fixture
+def calendar_links(resource_in_unit, resource_in_unit2, user, staff_user):
+    return [
+        OutlookCalendarLink.objects.create(resource=resource, user=link_user, token='{}',
+                                           microsoft_user_id='user-{}'.format(link_user.pk))
+        for resource, link_user in ((resource_in_unit, user), (resource_in_unit2, staff_user))
+    ]
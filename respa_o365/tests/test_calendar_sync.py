@@ -0,0 +1,40 @@
+import pytest
+
+from respa_o365 import calendar_sync
+from respa_o365.calendar_sync import add_to_queue, process_queue
+from respa_o365.models import OutlookSyncQueue
+
+
+@pytest.fixture
+def synced_links(monkeypatch):
+    synced = []
+    monkeypatch.setattr(calendar_sync, 'perform_sync_to_exchange', lambda link, func: synced.append(link.pk))
+    return synced
+
+
+@pytest.mark.django_db
+def test_process_queue_coalesces_entries_per_link(settings, calendar_links, synced_links):
+    settings.O365_SYNC_WORKERS = 1
+    for link in calendar_links + calendar_links + calendar_links[:1]:
+        add_to_queue(link)
+
+    process_queue()
+
+    assert sorted(synced_links) == sorted(link.pk for link in calendar_links)
+    assert not OutlookSyncQueue.objects.exists()
+
+
+@pytest.mark.django_db
+def test_process_queue_defers_recently_synced_link(settings, calendar_links, synced_links):
+    settings.O365_SYNC_WORKERS = 1
+    settings.O365_SYNC_MIN_INTERVAL = 60
+    link = calendar_links[0]
+    add_to_queue(link)
+    process_queue()
+    add_to_queue(link)
+    process_queue()
+
+    assert synced_links == [link.pk]
+    assert OutlookSyncQueue.objects.filter(calendar_link=link).count() == 1
+    link.refresh_from_db()
+    assert link.last_synced_at is not None
@@ -0,0 +1,69 @@
+from datetime import datetime, time, timedelta, timezone
+from urllib.parse import parse_qs, urlparse
+
+from respa_o365.o365_calendar import O365Calendar
+from respa_o365.sync_operations import ChangeType
+
+PREFIX = 'Varaus Varaamo'
+
+
+def test_get_changes_starts_delta_query_for_the_period(fake_graph):
+    begin = datetime.now(tz=timezone.utc).replace(microsecond=0) + timedelta(days=1)
+    event_id = fake_graph.add_event(PREFIX, begin, begin + timedelta(hours=1))
+
+    calendar = O365Calendar(microsoft_api=fake_graph, event_prefix=PREFIX)
+    changes, memento = calendar.get_changes()
+
+    assert set(changes) == {event_id}
+    assert calendar.delta_state is not None
+    assert all('calendarView/delta' in request for request in fake_graph.requests)
+    query = parse_qs(urlparse(fake_graph.requests[0]).query)
+    assert datetime.fromisoformat(query['startDateTime'][0]).timetz() == time(0, tzinfo=timezone.utc)
+    assert datetime.fromisoformat(query['endDateTime'][0]).timetz() == time(0, tzinfo=timezone.utc)
+
+
+def test_get_changes_reads_only_changes_with_delta_link(fake_graph):
+    begin = datetime.now(tz=timezone.utc).replace(microsecond=0) + timedelta(days=1)
+    event_ids = [fake_graph.add_event(PREFIX, begin + timedelta(hours=i), begin + timedelta(hours=i + 1))
+                 for i in range(3)]
+    fake_graph.add_event('Lunch', begin, begin + timedelta(hours=1))
+
+    calendar = O365Calendar(microsoft_api=fake_graph, event_prefix=PREFIX)
+    changes, memento = calendar.get_changes()
+    assert set(changes) == set(event_ids)
+    assert calendar.delta_state is not None
+
+    fake_graph.update_event(event_ids[0], PREFIX + ' updated')
+    fake_graph.remove_event(event_ids[1])
+    fake_graph.requests.clear()
+    known = {event_id: {'begin': begin, 'end': begin + timedelta(hours=1)} for event_id in event_ids}
+    calendar = O365Calendar(microsoft_api=fake_graph, known_events=known, event_prefix=PREFIX,
+                            delta_state=calendar.delta_state)
+    changes, memento = calendar.get_changes(memento)
+
+    assert {event_id: change[0] for event_id, change in changes.items()} == {
+        event_ids[0]: ChangeType.UPDATED,
+        event_ids[1]: ChangeType.DELETED,
+    }
+    assert len(fake_graph.requests) == 1
+    assert '$deltatoken' in fake_graph.requests[0]
+
+
+def test_get_changes_reads_all_events_when_delta_link_expires(fake_graph):
+    begin = datetime.now(tz=timezone.utc).replace(microsecond=0) + timedelta(days=1)
+    event_ids = [fake_graph.add_event(PREFIX, begin + timedelta(hours=i), begin + timedelta(hours=i + 1))
+                 for i in range(2)]
+    calendar = O365Calendar(microsoft_api=fake_graph, event_prefix=PREFIX)
+    _, memento = calendar.get_changes()
+    delta_state = calendar.delta_state
+
+    fake_graph.remove_event(event_ids[0])
+    fake_graph.delta_links_expired = True
+    known = {event_id: {'begin': begin, 'end': begin + timedelta(hours=1)} for event_id in event_ids}
+    calendar = O365Calendar(microsoft_api=fake_graph, known_events=known, event_prefix=PREFIX,
+                            delta_state=delta_state)
+    changes, _ = calendar.get_changes(memento)
+
+    assert {event_id: change[0] for event_id, change in changes.items()} == {event_ids[0]: ChangeType.DELETED}
+    assert '$deltatoken' not in fake_graph.requests[-1]
+    assert calendar.delta_state != delta_state
@@ -63,6 +63,32 @@ class TestRespaReservationRepository(ReservationRepositoryContract):
         change_type, _ = changes[reservation.id]
         assert change_type == ChangeType.DELETED
 
+    def test__create_item__denies_reservation__when_it_overlaps_another(self, a_repo, a_item):
+        # Arrange
+        a_item.end = a_item.begin + timedelta(hours=1)
+        first_id, _ = a_repo.create_item(a_item)
+        # Act
+        item_id, _ = a_repo.create_item(a_item)
+        # Assert
+        assert Reservation.objects.get(id=first_id).state == Reservation.CONFIRMED
+        assert Reservation.objects.get(id=item_id).state == Reservation.DENIED
+        changes, _ = a_repo.get_changes_by_ids([item_id])
+        change_type, _ = changes[item_id]
+        assert change_type == ChangeType.DELETED
+
+    def test__set_item__denies_reservation__when_it_overlaps_another(self, a_repo, a_item):
+        # Arrange
+        a_item.end = a_item.begin + timedelta(hours=1)
+        a_repo.create_item(a_item)
+        other_item = ReservationSyncItem()
+        other_item.begin = a_item.end
+        other_item.end = a_item.end + timedelta(hours=1)
+        item_id, _ = a_repo.create_item(other_item)
+        # Act
+        a_repo.set_item(item_id, a_item)
+        # Assert
+        assert Reservation.objects.get(id=item_id).state == Reservation.DENIED
+
     @pytest.fixture()
     def a_repo(self, a_resource):
         return RespaReservations(a_resource.id)
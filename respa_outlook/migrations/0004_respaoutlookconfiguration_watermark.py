@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('respa_outlook', '0003_respaoutlookreservation_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='respaoutlookconfiguration',
+            name='watermark',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Last seen modification in Outlook'),
+        ),
+    ]
@@ -32,6 +32,9 @@ class RespaOutlookConfiguration(models.Model):
     email = models.CharField(verbose_name=_('Email'), max_length=255)
     password = models.CharField(verbose_name=_('Password'), max_length=255)
 
+    # Last modification time of the calendar items seen by the listener
+    watermark = models.DateTimeField(verbose_name=_('Last seen modification in Outlook'), blank=True, null=True,
+                                     editable=False)
 
     objects = RespaOutlookConfigurationQuerySet.as_manager()
 
@@ -1,115 +1,251 @@
 from django.conf import settings
+from django.db import connections
+from django.utils import timezone
 
-from respa_outlook.models import RespaOutlookReservation
+from respa_outlook.models import RespaOutlookConfiguration, RespaOutlookReservation
+from resources.models import Reservation
 from django.core.exceptions import ValidationError
 
+from exchangelib import EWSDateTime
 from exchangelib.errors import ErrorItemNotFound
+from exchangelib.queryset import DoesNotExist
 
-from time import sleep, time
-from copy import copy
+from concurrent.futures import ThreadPoolExecutor
+from random import uniform
+from time import monotonic
+
+from threading import Thread, Event, Lock
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cycles are scheduled this much around the polling rate, so that the
+# configurations don't all hit Exchange at the same moment
+JITTER = 0.2
+# Seconds between logging the cycle durations
+METRICS_LOG_INTERVAL = 300
 
-from threading import Thread, Event
 
 class Listen():
+    """
+    Syncs the calendars of the configurations in the store
+
+    Each configuration is synced in a worker pool of OUTLOOK_POLLING_WORKERS
+    threads, once every OUTLOOK_POLLING_RATE seconds with some jitter.
+    The cycle durations are logged every METRICS_LOG_INTERVAL seconds.
+    """
     def __init__(self, store):
         self.store = store
         self.configs = store.items
-        self.status = False
-        self.creating = False
-        self.modifying = False
-        self.thread = Thread(target=self.start)
         self.signal = Event()
-        self.manager = None
-        self.config = None
-        self.calendar = None
-        self.thread.setDaemon(True)
+        self.metrics = ListenMetrics()
+        self.executor = ThreadPoolExecutor(max_workers=settings.OUTLOOK_POLLING_WORKERS,
+                                           thread_name_prefix='respa-outlook')
+        self.schedule = {}  # Configuration id -> monotonic time of the next cycle
+        self.lock = Lock()
+        self.thread = Thread(target=self.start)
+        self.thread.daemon = True
         self.thread.start()
 
     def start(self):
-        while not self.signal.wait(0):
-            pop = []
-
-            configs = copy(self.configs) # Avoid RunTimeError this way
+        rate = settings.OUTLOOK_POLLING_RATE
+        metrics_logged_at = monotonic()
+        while not self.signal.is_set():
+            now = monotonic()
+            if now - metrics_logged_at >= METRICS_LOG_INTERVAL:
+                self.metrics.log()
+                metrics_logged_at = now
+            next_cycle = self.submit_due_cycles(now)
+            self.signal.wait(min(max(next_cycle - monotonic(), 0), rate))
+
+    def submit_due_cycles(self, now):
+        """
+        Submit the cycles of the configurations which are due, and return the time of the next one
+
+        A configuration is not scheduled again until its running cycle is finished.
+        """
+        rate = settings.OUTLOOK_POLLING_RATE
+        for config_id in list(self.configs):  # Avoid RunTimeError this way
+            manager = self.configs.get(config_id)
+            if manager is None:
+                continue
+            if manager.pop_from_store:
+                self.configs.pop(config_id, None)
+                continue
 
-            for manager in configs:
-                self.manager = self.configs[manager]
-                if self.manager.pop_from_store:
-                    pop.append(self.manager)
+            with self.lock:
+                # Spread the first cycles over the polling interval
+                next_cycle = self.schedule.setdefault(config_id, now + uniform(0, rate))
+                if next_cycle > now:
                     continue
+                self.schedule[config_id] = float('inf')  # Running
+            self.executor.submit(self.run_cycle, config_id, manager)
 
-                self.config = self.manager.configuration
-                self.calendar = copy(self.manager.future())
-
-                assert self.manager is not None
-                assert self.config is not None
-                assert self.calendar is not None
+        with self.lock:
+            for config_id in set(self.schedule) - set(self.configs):
+                self.schedule.pop(config_id)
+            return min(self.schedule.values(), default=now + rate)
 
-                self.handle_add()
-
-                self.manager = None
-                self.config = None
-                self.calendar = None
-
-            for manager in pop:
-                self.configs.pop(manager.configuration.id)
-            sleep(settings.OUTLOOK_POLLING_RATE)
-    
     def stop(self):
         self.signal.set()
-
-
-    def handle_add(self):
-        for appointment in self.calendar:
+        self.executor.shutdown(wait=False)
+
+    def run_cycle(self, config_id, manager):
+        rate = settings.OUTLOOK_POLLING_RATE
+        started = monotonic()
+        try:
+            CalendarSync(manager).run()
+        except Exception:
+            logger.exception("Syncing Outlook configuration %s failed", config_id)
+        finally:
+            duration = monotonic() - started
+            self.metrics.record(config_id, duration)
+            if duration > rate:
+                logger.warning("Syncing Outlook configuration %s took %.1f s, more than the polling rate",
+                               config_id, duration)
+            with self.lock:
+                if config_id in self.schedule:
+                    self.schedule[config_id] = monotonic() + rate * uniform(1 - JITTER, 1 + JITTER)
+            # Each worker thread has its own database connections
+            connections.close_all()
+
+
+class ListenMetrics():
+    """
+    Durations of the sync cycles, per configuration
+    """
+    def __init__(self):
+        self.cycles = {}
+        self.lock = Lock()
+
+    def record(self, config_id, duration):
+        with self.lock:
+            count, total, longest, _ = self.cycles.get(config_id, (0, 0.0, 0.0, None))
+            self.cycles[config_id] = (count + 1, total + duration, max(longest, duration), duration)
+        logger.debug("Outlook configuration %s synced in %.3f s", config_id, duration)
+
+    def summary(self):
+        """
+        Return the cycle count and the average, longest and last cycle duration of each configuration
+
+        :rtype: dict[int, dict]
+        """
+        with self.lock:
+            return {
+                config_id: dict(count=count, average=total / count, longest=longest, last=last)
+                for config_id, (count, total, longest, last) in self.cycles.items()
+            }
+
+    def log(self):
+        for config_id, cycles in sorted(self.summary().items()):
+            logger.info("Outlook configuration %s: %d cycles, average %.1f s, longest %.1f s, last %.1f s",
+                        config_id, cycles['count'], cycles['average'], cycles['longest'], cycles['last'])
+
+
+class CalendarSync():
+    """
+    One sync cycle of a configuration's calendar
+
+    Only the calendar items modified since the stored watermark are
+    fetched. Deletions are detected by comparing the ids of the items
+    in the calendar with the known exchange ids of the resource.
+    """
+    def __init__(self, manager):
+        self.manager = manager
+        self.config = manager.configuration
+
+    def run(self):
+        watermark = self.config.watermark
+        changed = self.manager.future()
+        if watermark:
+            changed = changed.filter(last_modified_time__gte=EWSDateTime.from_datetime(watermark))
+        changed = list(changed)
+
+        # Fetched after the changed items, so that it contains all of them
+        calendar_ids = set(self.manager.future().values_list('id', flat=True))
+        known_ids = set(RespaOutlookReservation.objects.filter(
+            reservation__resource_id=self.config.resource_id
+        ).values_list('exchange_id', flat=True))
+
+        failed = self.handle_add([a for a in changed if a.id not in known_ids])
+        failed += self.handle_modify([a for a in changed if a.id in known_ids])
+        self.handle_remove(calendar_ids)
+
+        # Failed items are fetched again on the next cycle
+        modified_times = [a.last_modified_time for a in changed if a.last_modified_time]
+        failed_times = [a.last_modified_time for a in failed if a.last_modified_time]
+        if failed_times:
+            modified_times = [t for t in modified_times if t < min(failed_times)]
+        if modified_times:
+            watermark = max([watermark] + modified_times) if watermark else max(modified_times)
+        if watermark != self.config.watermark:
+            # Update without saving, the save signal would recreate the manager
+            RespaOutlookConfiguration.objects.filter(pk=self.config.pk).update(watermark=watermark)
+            self.config.watermark = watermark
+
+    def handle_add(self, appointments):
+        failed = []
+        for appointment in appointments:
             try:
-                RespaOutlookReservation.objects.get(exchange_id=appointment.id)
+                # Items without an organizer are never reserved
+                email = appointment.organizer.email_address if appointment.organizer else None
+                self.config.create_respa_outlook_reservation(
+                    appointment=appointment,
+                    reservation=None,
+                    email=email
+                )
+            except Exception as ex:
+                if isinstance(ex, ValidationError):
+                    appointment.delete()
+                else:
+                    failed.append(appointment)
                 continue
-            except:
-                try:
-                    email = appointment.organizer.email_address
-                    self.config.create_respa_outlook_reservation(
-                        appointment=appointment,
-                        reservation=None,
-                        email=email
-                    )
-                except Exception as ex:
-                    if isinstance(ex, ValidationError):
-                        appointment.delete()
-                    continue
-        self.handle_modify()
-    
-    def handle_modify(self):
-        for appointment in self.calendar:
+        return failed
+
+    def handle_modify(self, appointments):
+        outlooks = RespaOutlookReservation.objects.filter(
+            exchange_id__in=[appointment.id for appointment in appointments]
+        ).select_related('reservation')
+        outlooks = {outlook.exchange_id: outlook for outlook in outlooks}
+        failed = []
+        for appointment in appointments:
             try:
-                respa_outlook = RespaOutlookReservation.objects.get(exchange_id=appointment.id)
-                reservation = respa_outlook.reservation
+                reservation = outlooks[appointment.id].reservation
                 if (appointment.start == reservation.begin and
                     appointment.end == reservation.end):
                    continue
                 self.config.handle_modify(reservation, appointment)
-            except:
+            except Exception:
+                logger.exception("Modifying reservation of Outlook item %s failed", appointment.id)
+                failed.append(appointment)
                 continue
-        self.handle_remove()
-    
-    def handle_remove(self):
-        for appointment in self.calendar:
-            try:
-                respa_outlook = RespaOutlookReservation.objects.get(exchange_id=appointment.id)
-                reservation = respa_outlook.reservation
-                if reservation.state == 'cancelled':
-                    appointment.delete()
-                    respa_outlook.delete()
-            except:
-                continue
-        for outlook in RespaOutlookReservation.objects.all():
+        return failed
+
+    def handle_remove(self, calendar_ids):
+        outlooks = RespaOutlookReservation.objects.filter(
+            reservation__resource_id=self.config.resource_id,
+            reservation__end__gte=timezone.now(),
+        ).select_related('reservation')
+        for outlook in outlooks:
             reservation = outlook.reservation
             try:
-                appointment = self.calendar.get(id=outlook.exchange_id)
-                if isinstance(appointment, ErrorItemNotFound):
-                    reservation.state = 'cancelled'
+                if reservation.state == Reservation.CANCELLED:
+                    if outlook.exchange_id in calendar_ids:
+                        self.manager.calendar.get(id=outlook.exchange_id).delete()
+                    outlook.delete()
+                elif outlook.exchange_id not in calendar_ids and not self.exists(outlook.exchange_id):
+                    reservation.state = Reservation.CANCELLED
                     reservation.save()
                     outlook.delete()
-            except:
-                outlook.reservation.state = 'cancelled'
-                reservation.save()
-                outlook.delete()
+            except Exception:
+                logger.exception("Removing Outlook item %s failed", outlook.exchange_id)
+                continue
 
+    def exists(self, exchange_id):
+        # The item may have been created after the calendar was listed
+        try:
+            appointment = self.manager.calendar.get(id=exchange_id)
+        except (DoesNotExist, ErrorItemNotFound):
+            return False
+        return not isinstance(appointment, ErrorItemNotFound)
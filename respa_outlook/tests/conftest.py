@@ -0,0 +1,75 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from django.utils import timezone
+from exchangelib.queryset import DoesNotExist
+
+from resources.tests.conftest import *  # noqa
+from respa_outlook.models import RespaOutlookConfiguration
+
+
+class FakeQuerySet:
+    """
+    The parts of an exchangelib QuerySet used by the listener
+    """
+    def __init__(self, items):
+        self.items = list(items)
+
+    def filter(self, last_modified_time__gte):
+        return FakeQuerySet(item for item in self.items if item.last_modified_time >= last_modified_time__gte)
+
+    def values_list(self, field, flat=False):
+        return [getattr(item, field) for item in self.items]
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class FakeCalendar:
+    """
+    In-memory stand-in for the calendar folder of a RespaOutlookManager
+    """
+    def __init__(self):
+        self.items = {}
+        self._clock = timezone.now().replace(microsecond=0)
+
+    def add(self, item_id, email='reserver@example.com'):
+        self._clock += timedelta(seconds=1)
+        begin = timezone.now() + timedelta(days=1)
+        item = SimpleNamespace(
+            id=item_id, changekey=item_id, start=begin, end=begin + timedelta(hours=1),
+            last_modified_time=self._clock, organizer=SimpleNamespace(email_address=email),
+        )
+        item.delete = lambda: self.items.pop(item_id)
+        self.items[item_id] = item
+        return item
+
+    def get(self, id):
+        if id not in self.items:
+            raise DoesNotExist(id)
+        return self.items[id]
+
+
+class FakeManager:
+    def __init__(self, configuration):
+        self.configuration = configuration
+        self.calendar = FakeCalendar()
+        self.pop_from_store = False
+
+    def future(self):
+        return FakeQuerySet(self.calendar.items.values())
+
+
+@pytest.fixture
+def outlook_configuration(resource_in_unit):
+    # Saving a configuration connects to Exchange in a signal handler
+    RespaOutlookConfiguration.objects.bulk_create([
+        RespaOutlookConfiguration(name='test', resource=resource_in_unit, email='test@example.com', password='x')
+    ])
+    return RespaOutlookConfiguration.objects.get(resource=resource_in_unit)
+
+
+@pytest.fixture
+def outlook_manager(outlook_configuration):
+    return FakeManager(outlook_configuration)
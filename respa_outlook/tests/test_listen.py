@@ -0,0 +1,137 @@
+from datetime import timedelta
+from time import monotonic
+from types import SimpleNamespace
+
+import pytest
+from django.utils import timezone
+
+from resources.models import Reservation
+from respa_outlook.models import RespaOutlookConfiguration, RespaOutlookReservation
+from respa_outlook.manager import Store
+from respa_outlook.polling import listen
+from respa_outlook.polling.listen import CalendarSync, Listen, ListenMetrics
+
+
+@pytest.fixture
+def created_items(outlook_configuration, monkeypatch):
+    created = []
+
+    def create_respa_outlook_reservation(appointment, reservation, email):
+        if appointment.id.startswith('fail'):
+            raise RuntimeError(appointment.id)
+        created.append(appointment.id)
+
+    monkeypatch.setattr(outlook_configuration, 'create_respa_outlook_reservation', create_respa_outlook_reservation)
+    return created
+
+
+def create_outlook_reservation(resource, user, exchange_id, state=Reservation.CONFIRMED, days=1):
+    begin = timezone.now() + timedelta(days=days)
+    reservation = Reservation.objects.create(
+        resource=resource, begin=begin, end=begin + timedelta(hours=1), user=user, state=state,
+    )
+    return RespaOutlookReservation.objects.create(
+        name='test', reservation=reservation, exchange_id=exchange_id, exchange_changekey=exchange_id,
+    )
+
+
+@pytest.mark.django_db
+def test_watermark_advances_to_the_last_modification(outlook_manager, created_items):
+    outlook_manager.calendar.add('first')
+    second = outlook_manager.calendar.add('second')
+
+    CalendarSync(outlook_manager).run()
+
+    assert created_items == ['first', 'second']
+    configuration = RespaOutlookConfiguration.objects.get(pk=outlook_manager.configuration.pk)
+    assert configuration.watermark == second.last_modified_time
+
+    created_items.clear()
+    outlook_manager.calendar.add('third')
+    CalendarSync(outlook_manager).run()
+
+    assert created_items == ['second', 'third']
+
+
+@pytest.mark.django_db
+def test_failed_item_holds_the_watermark_back(outlook_manager, created_items):
+    first = outlook_manager.calendar.add('first')
+    outlook_manager.calendar.add('fail')
+    outlook_manager.calendar.add('third')
+
+    CalendarSync(outlook_manager).run()
+
+    assert created_items == ['first', 'third']
+    configuration = RespaOutlookConfiguration.objects.get(pk=outlook_manager.configuration.pk)
+    assert configuration.watermark == first.last_modified_time
+
+
+@pytest.mark.django_db
+def test_reservation_is_cancelled_when_its_item_is_removed(outlook_manager, created_items, resource_in_unit, user):
+    kept = create_outlook_reservation(resource_in_unit, user, 'kept')
+    removed = create_outlook_reservation(resource_in_unit, user, 'removed', days=2)
+    outlook_manager.calendar.add('kept')
+    outlook_manager.configuration.watermark = timezone.now() + timedelta(days=1)
+
+    CalendarSync(outlook_manager).run()
+
+    assert Reservation.objects.get(pk=removed.reservation_id).state == Reservation.CANCELLED
+    assert Reservation.objects.get(pk=kept.reservation_id).state == Reservation.CONFIRMED
+    assert list(RespaOutlookReservation.objects.values_list('exchange_id', flat=True)) == ['kept']
+
+
+@pytest.mark.django_db
+def test_item_of_cancelled_reservation_is_removed(outlook_manager, created_items, resource_in_unit, user):
+    create_outlook_reservation(resource_in_unit, user, 'cancelled', state=Reservation.CANCELLED)
+    outlook_manager.calendar.add('cancelled')
+    outlook_manager.configuration.watermark = timezone.now() + timedelta(days=1)
+
+    CalendarSync(outlook_manager).run()
+
+    assert 'cancelled' not in outlook_manager.calendar.items
+    assert not RespaOutlookReservation.objects.exists()
+
+
+def test_metrics_summary():
+    metrics = ListenMetrics()
+    metrics.record(1, 2.0)
+    metrics.record(1, 4.0)
+
+    assert metrics.summary() == {1: dict(count=2, average=3.0, longest=4.0, last=4.0)}
+
+
+class FakeExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args):
+        self.submitted.append(args)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def test_configuration_is_not_scheduled_while_its_cycle_runs(settings, monkeypatch):
+    settings.OUTLOOK_POLLING_RATE = 5.0
+    poller = Listen(Store())
+    poller.stop()
+    poller.thread.join()
+    poller.executor = FakeExecutor()
+    manager = SimpleNamespace(pop_from_store=False)
+    poller.configs[1] = manager
+    poller.schedule[1] = monotonic() - 1
+
+    poller.submit_due_cycles(monotonic())
+    assert poller.executor.submitted == [(1, manager)]
+    assert poller.submit_due_cycles(monotonic() + 60) > monotonic() + 60
+    assert len(poller.executor.submitted) == 1
+
+    synced = []
+    monkeypatch.setattr(listen, 'CalendarSync', lambda manager: SimpleNamespace(run=lambda: synced.append(manager)))
+    poller.run_cycle(1, manager)
+
+    assert synced == [manager]
+    assert monotonic() < poller.schedule[1] <= monotonic() + 5.0 * (1 + listen.JITTER)
+    assert poller.metrics.summary()[1]['count'] == 1
+    poller.submit_due_cycles(poller.schedule[1])
+    assert poller.executor.submitted == [(1, manager), (1, manager)]